@@ -11,7 +11,8 @@ from trajectory.trajectory import SystemConfig, Trajectory
 from utils.fmm_map import FmmMap
 from utils.utils import *
 from agents.agent_base import AgentBase
-from params.central_params import create_agent_params
+from params.central_params import get_agent_params
+from simulators.sim_state import compute_agent_clearance
 
 
 class Agent(AgentBase):
@@ -27,6 +28,10 @@ class Agent(AgentBase):
         self.accelerations = {}
         # every *planning* agent gets their own copy of 'sim state' history
         self.world_state = None
+        # the number of updates since the last plan (None before the first)
+        # and the goal it was planned to
+        self.updates_since_plan = None
+        self.plan_goal_3 = None
         super().__init__(start, goal, name)
 
     def simulation_init(self, sim_map, with_planner: bool = True,
@@ -35,7 +40,8 @@ class Agent(AgentBase):
                         keep_episode_running: bool = False):
         """ Initializes important fields for the Simulator"""
         if(not hasattr(self, "params")):
-            self.params = create_agent_params(with_planner=with_planner)
+            # (shared by all the agents, see get_agent_params)
+            self.params = get_agent_params(with_planner=with_planner)
         self.obstacle_map = sim_map
         if(with_objectives):
             # Initialize Fast-Marching-Method map for agent's pathfinding
@@ -76,10 +82,22 @@ class Agent(AgentBase):
         AgentBase.color_indx = 0
 
     def update(self, sim_state=None):
-        """ Run the agent.plan() and agent.act() functions to generate a path and follow it """
+        """ Run the agent.plan() and agent.act() functions to generate a path and follow it.
+        The agent only replans every replan_interval updates and follows its
+        buffered trajectory in between, unless it has to replan right away
+        (see needs_forced_replan) """
         self.sense(sim_state)
-        self.plan()
+        if self.needs_forced_replan():
+            if self.goal_changed():
+                Agent._update_fmm_map(self)
+            # replan from the next config instead of the end of the buffer
+            self.discard_buffered_trajectory()
+            self.plan()
+        elif self.needs_replan():
+            self.plan()
         self.act()
+        if self.updates_since_plan is not None:
+            self.updates_since_plan += 1
 
     def sense(self, sim_state, dt: int = 0.05):
         self.update_world(sim_state)
@@ -100,6 +118,8 @@ class Agent(AgentBase):
 
         self.planner_data = self.planner.optimize(self.planned_next_config,
                                                   self.goal_config)
+        self.updates_since_plan = 0
+        self.plan_goal_3 = self.goal_config.to_3D_numpy()
         traj_segment = \
             Trajectory.new_traj_clip_along_time_axis(self.planner_data['trajectory'],
                                                      self.params.control_horizon,
@@ -113,6 +133,46 @@ class Agent(AgentBase):
                                                track_trajectory_acceleration=tr_acc)
         self.enforce_termination_conditions()
 
+    def needs_replan(self):
+        """Whether replan_interval updates have passed since the last plan or
+        the buffered trajectory runs out before the next update"""
+        if self.updates_since_plan is None or \
+                self.updates_since_plan >= self.params.replan_interval:
+            return True
+        step = int(np.floor(self.sim_dt / self.params.dt))
+        return self.path_step + step >= self.trajectory.k
+
+    def needs_forced_replan(self):
+        """Whether the buffered trajectory has to be replaced, i.e. the goal
+        changed or another agent is within replan_clearance (collision risk)"""
+        if self.params.replan_interval <= 1:
+            # (replans on every update anyways)
+            return False
+        if self.updates_since_plan is None or self.end_acting or \
+                self.collision_point_k != np.inf:
+            return False
+        if self.goal_changed():
+            return True
+        if self.world_state is None:
+            return False
+        clearance = compute_agent_clearance(self.world_state, self.get_name(),
+                                            self.get_current_config().to_3D_numpy(),
+                                            self.get_radius())
+        return clearance < self.params.replan_clearance
+
+    def goal_changed(self):
+        return self.plan_goal_3 is not None and \
+            not np.allclose(self.goal_config.to_3D_numpy(), self.plan_goal_3)
+
+    def discard_buffered_trajectory(self):
+        """Drops the buffered trajectory after the next config (the one the
+        agent moves to in the next act) so the next plan starts from there"""
+        if self.path_step + 1 < self.trajectory.k:
+            self.trajectory.clip_along_time_axis(self.path_step + 1)
+            self.planned_next_config = \
+                SystemConfig.init_config_from_trajectory_time_index(
+                    self.trajectory, t=-1)
+
     def act(self):
         """ A utility method to initialize a config object
         from a particular timestep of a given trajectory object"""
@@ -2,7 +2,7 @@ from utils.utils import *
 from agents.agent import Agent
 from agents.robot_utils import *
 from trajectory.trajectory import SystemConfig
-from params.central_params import create_robot_params
+from params.central_params import get_agent_params
 import numpy as np
 import time
 
@@ -29,6 +29,10 @@ class RobotAgent(Agent):
         self.algo_name = "UnknownAlgo"
 
     def simulation_init(self, sim_map, with_planner=False, keep_episode_running=False):
+        # the robot params are part of the (frozen) agent params of the robot
+        if(not hasattr(self, "params")):
+            self.params = get_agent_params(with_planner=with_planner,
+                                           with_robot=True)
         # first initialize all the agent fields such as basic self.params
         super().simulation_init(sim_map,
                                 with_planner=with_planner,
@@ -36,7 +40,6 @@ class RobotAgent(Agent):
                                 with_objectives=True,
                                 keep_episode_running=keep_episode_running)
         # this robot agent does not have a "planner" since that is done through the joystick
-        self.params.robot_params = create_robot_params()
         # NOTE: robot radius is not the same as regular Agents
         self.radius = self.params.robot_params.physical_params.radius
         # velocity bounds when teleporting to positions (if not using sys dynamics)
@@ -46,11 +46,14 @@ joystick_sender_socket = None
 recv_ID = create_robot_params().recv_ID
 send_ID = create_robot_params().send_ID
 
-# clear sockets to be used
-if os.path.exists(recv_ID):
-    os.remove(recv_ID)
-if os.path.exists(send_ID):
-    os.remove(send_ID)
+
+def clear_sockets():
+    """Removes the (stale) socket files of a previous run, only done before
+    connecting to the joystick (rather than when this module is imported)"""
+    if os.path.exists(recv_ID):
+        os.remove(recv_ID)
+    if os.path.exists(send_ID):
+        os.remove(send_ID)
 
 
 def send_sim_state(robot):
@@ -178,6 +181,8 @@ def establish_handshake(p: DotMap):
         # lite-mode episode does not include a robot or joystick
         return
     import time
+    # clear sockets to be used
+    clear_sockets()
     establish_joystick_receiver_connection()
     time.sleep(0.01)
     establish_joystick_sender_connection()
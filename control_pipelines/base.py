@@ -1,6 +1,7 @@
 import os
 import pickle
 import numpy as np
+from params.frozen_params import is_frozen
 
 
 class ControlPipelineBase(object):
@@ -8,9 +9,15 @@ class ControlPipelineBase(object):
     should expose. A control pipeline is used for planning trajectories between start and waypoint/goal configs.
     """
     only_one_system = None
+    # whether the waypoints are sampled (per plan) from the fmm/obstacle maps
+    goal_directed = False
 
     def __init__(self, params):
-        self.params = params.pipeline.parse_params(params)
+        if is_frozen(params):
+            # (already parsed)
+            self.params = params
+        else:
+            self.params = params.pipeline.parse_params(params)
         self.system_dynamics = params.system_dynamics_params.system(dt=params.system_dynamics_params.dt,
                                                                     params=params.system_dynamics_params)
         self.pipeline_files = self.valid_file_names()
@@ -0,0 +1,239 @@
+import time
+import numpy as np
+from trajectory.trajectory import SystemConfig
+from control_pipelines.control_pipeline_v0 import ControlPipelineV0
+from waypoint_grids.goal_directed_grid import GoalDirectedGrid
+from utils.angle_utils import angle_normalize
+
+
+class ControlPipelineOnline(ControlPipelineV0):
+    """
+    A control pipeline that fits the splines (and runs the LQR) online, i.e.
+    nothing is precomputed. Every plan is made from the exact start velocity
+    (instead of the closest velocity bin) to a subset of the waypoint grid:
+    the waypoints closest to the direction of the goal, as many as fit in the
+    latency budget of the pipeline (see online_params).
+    With a GoalDirectedGrid the waypoints are instead sampled for every plan
+    around the direction of the fmm angle map, in the free space around the
+    start config (from the obstacle map).
+    """
+    pipeline = None
+    # the splines are refit at most max_refits times and are feasible when
+    # their required horizon is within horizon_tolerance (relative) of theirs
+    max_refits = 10
+    horizon_tolerance = 1e-3
+
+    def __init__(self, params):
+        super(ControlPipelineOnline, self).__init__(params)
+        # measured (moving average) planning time per waypoint in seconds
+        self.time_per_waypt_s = None
+        self.waypt_configs_egocentric = None
+        self.goal_directed = isinstance(self.waypoint_grid, GoalDirectedGrid)
+
+    def valid_file_names(self, file_format='.pkl'):
+        # nothing is saved
+        return []
+
+    def generate_control_pipeline(self, params=None):
+        self._load_control_pipeline(params=params)
+
+    def _load_control_pipeline(self, params=None):
+        if not self.instance_variables_loaded:
+            self._init_pipeline()
+            self.instance_variables_loaded = True
+            if self.goal_directed:
+                # (the waypoints are sampled for every plan)
+                return
+            self.waypt_configs_egocentric = self._sample_egocentric_waypoints(
+                vf=0.)
+            waypt_pos_n2 = self.waypt_configs_egocentric.position_nk2()[:, 0]
+            # the direction of every waypoint (in the egocentric frame)
+            self.waypt_bearings_n = np.arctan2(waypt_pos_n2[:, 1],
+                                               waypt_pos_n2[:, 0])
+
+    def plan(self, start_config, goal_config=None, greedy=False,
+             fmm_map=None, obstacle_map=None):
+        """Fits the splines from start_config to the waypoints closest to the
+        direction of goal_config (all directions if goal_config is None) and
+        returns the waypoints, horizons, lqr_trajectories, spline_trajectories
+        and LQR controllers (in the world frame) of the dynamically feasible ones.
+        The fmm_map and obstacle_map are only used by the goal directed grid.
+        NOTE: only the closest waypoint to goal_config is returned if greedy"""
+        start_t = time.perf_counter()
+        if self.goal_directed:
+            waypt_configs_ego = self._sample_goal_directed_waypoints(
+                start_config, goal_config, fmm_map, obstacle_map)
+        else:
+            waypt_configs_ego = SystemConfig.gather_across_batch_dim_and_create(
+                self.waypt_configs_egocentric,
+                self._select_waypt_idxs(start_config, goal_config))
+        num_waypts = waypt_configs_ego.n
+        planned = self._plan_to_waypoints(start_config, waypt_configs_ego)
+        if planned is None:
+            # none of the selected waypoints is feasible, try all of them
+            # (or all the free directions of the goal directed grid)
+            if self.goal_directed:
+                waypt_configs_ego = self._sample_goal_directed_waypoints(
+                    start_config)
+            else:
+                waypt_configs_ego = SystemConfig.gather_across_batch_dim_and_create(
+                    self.waypt_configs_egocentric,
+                    np.arange(self.waypt_configs_egocentric.n))
+            planned = self._plan_to_waypoints(start_config, waypt_configs_ego)
+        self._update_time_per_waypt(time.perf_counter() - start_t, num_waypts)
+        waypt_configs, horizons, trajectories_lqr, trajectories_spline, controllers = planned
+
+        if greedy and goal_config is not None:
+            waypt_idx = self.helper.compute_closest_waypt_idx(goal_config,
+                                                              waypt_configs)
+            idxs = np.array([waypt_idx])
+            waypt_configs = SystemConfig.gather_across_batch_dim_and_create(
+                waypt_configs, idxs)
+            horizons = horizons[idxs]
+            trajectories_lqr.gather_across_batch_dim(idxs)
+            trajectories_spline.gather_across_batch_dim(idxs)
+            controllers = {key: value[idxs] for key, value in controllers.items()}
+
+        trajectories_lqr.update_valid_mask_nk()
+        return waypt_configs, horizons, trajectories_lqr, trajectories_spline, controllers
+
+    def _select_waypt_idxs(self, start_config, goal_config=None):
+        """The indices of the waypoints whose direction is the closest to
+        goal_config, as many as fit in the latency budget"""
+        p = self.params.online_params
+        num_waypts = self.waypt_configs_egocentric.n
+        if self.time_per_waypt_s is None:
+            budget = p.min_waypoints
+        else:
+            budget = int(p.latency_budget_s / self.time_per_waypt_s)
+        budget = min(max(budget, p.min_waypoints), p.max_waypoints, num_waypts)
+        if budget == num_waypts:
+            return np.arange(num_waypts)
+        if goal_config is None:
+            # evenly spread over the waypoint grid
+            return np.linspace(0, num_waypts - 1, budget).astype(int)
+        goal_ego_n13 = self.system_dynamics.convert_position_and_heading_to_ego_coordinates(
+            start_config.position_and_heading_nk3()[:1],
+            goal_config.position_and_heading_nk3()[:1, :1])
+        goal_bearing = np.arctan2(goal_ego_n13[0, 0, 1], goal_ego_n13[0, 0, 0])
+        angle_diff_n = np.abs(angle_normalize(self.waypt_bearings_n - goal_bearing))
+        waypt_idxs = np.argpartition(angle_diff_n, budget - 1)[:budget]
+        waypt_idxs.sort()
+        return waypt_idxs
+
+    def _sample_goal_directed_waypoints(self, start_config, goal_config=None,
+                                        fmm_map=None, obstacle_map=None):
+        """Samples the (egocentric) waypoints of the goal directed grid around
+        the direction of the fmm angle map (or else of goal_config) at
+        start_config, in the free space of obstacle_map (if any)"""
+        goal_angle = 0.
+        if fmm_map is not None:
+            optimal_angle = fmm_map.fmm_angle_map.compute_voxel_function(
+                start_config.position_nk2()[:1, :1])[0, 0]
+            goal_angle = angle_normalize(
+                optimal_angle - start_config.heading_nk1()[0, 0, 0])
+        elif goal_config is not None:
+            goal_ego_n13 = self.system_dynamics.convert_position_and_heading_to_ego_coordinates(
+                start_config.position_and_heading_nk3()[:1],
+                goal_config.position_and_heading_nk3()[:1, :1])
+            goal_angle = np.arctan2(goal_ego_n13[0, 0, 1], goal_ego_n13[0, 0, 0])
+        free_distances_m = None
+        if obstacle_map is not None:
+            free_distances_m = self.waypoint_grid.compute_free_distances(
+                obstacle_map, start_config)
+        # the waypoint patterns are cached per velocity bin
+        v0 = self.start_velocities[self._compute_bin_idx_for_start_velocities(
+            start_config.speed_nk1()[:1, :, 0])[0]]
+        wx_n11, wy_n11, wtheta_n11, wv_n11, ww_n11 = \
+            self.waypoint_grid.sample_egocentric_waypoints(
+                vf=0., v0=v0, goal_angle=goal_angle,
+                free_distances_m=free_distances_m)
+        return SystemConfig(dt=self.params.dt, n=wx_n11.shape[0], k=1,
+                            position_nk2=np.concatenate([wx_n11, wy_n11], axis=2),
+                            speed_nk1=wv_n11, heading_nk1=wtheta_n11,
+                            angular_speed_nk1=ww_n11, variable=True)
+
+    def _plan_to_waypoints(self, start_config, goal_config_ego):
+        """Fits the splines (and runs the LQR) from the speed of start_config
+        to the egocentric waypoints goal_config_ego, the results are in the
+        world frame (None if none of the splines is dynamically feasible)"""
+        p = self.params
+        v_bounds = p.system_dynamics_params.v_bounds
+        speed = np.clip(start_config.speed_nk1()[0, 0, 0], v_bounds[0], v_bounds[1])
+        start_config_ego = self.system_dynamics.init_egocentric_robot_config(
+            dt=p.system_dynamics_params.dt, n=goal_config_ego.n, v=speed)
+        start_config_ego, goal_config_ego, horizons_n1 = \
+            self._dynamically_fit_spline(start_config_ego, goal_config_ego)
+        if goal_config_ego.n == 0:
+            return None
+        trajectories_lqr, K_nkfd, k_nkf1 = self._lqr(start_config_ego)
+
+        to_world = self.system_dynamics.to_world_coordinates
+        waypt_configs = to_world(start_config, goal_config_ego, mode='new')
+        trajectories_lqr_world = to_world(start_config, trajectories_lqr,
+                                          mode='new')
+        trajectories_lqr_world.valid_horizons_n1 = trajectories_lqr.valid_horizons_n1
+        trajectories_spline_world = to_world(start_config, self.spline_trajectory,
+                                             mode='new')
+        trajectories_spline_world.valid_horizons_n1 = \
+            1. * self.spline_trajectory.valid_horizons_n1
+        controllers = {'K_nkfd': K_nkfd, 'k_nkf1': k_nkf1}
+        if p.convert_K_to_world_coordinates:
+            controllers['K_nkfd'] = \
+                self.system_dynamics.convert_K_to_world_coordinates(start_config, K_nkfd,
+                                                                    mode='new')
+        return waypt_configs, horizons_n1, trajectories_lqr_world, trajectories_spline_world, controllers
+
+    def _dynamically_fit_spline(self, start_config, goal_config):
+        """Fits the splines like ControlPipelineV0 but then refits them over their
+        dynamically feasible horizons so they start at the exact speed of
+        start_config (rescaling the horizon also rescales the start speed,
+        which the velocity binning of ControlPipelineV0 accounts for)."""
+        p = self.params
+        start_config, goal_config, horizons_n1 = \
+            super(ControlPipelineOnline, self)._dynamically_fit_spline(
+                start_config, goal_config)
+        times_nk = np.tile(np.linspace(0., p.planning_horizon_s, p.planning_horizon)[
+                           None], [goal_config.n, 1])
+        # the refit changes the speeds so the splines that are still not
+        # feasible over their horizon are refit over the new required horizon
+        # until the horizons converge (the ones that do not are dropped)
+        final_times_n1 = horizons_n1[:, None]
+        for _ in range(self.max_refits):
+            required_horizons_n1 = self._refit_spline(
+                start_config, goal_config, final_times_n1, times_nk)
+            feasible_n1 = required_horizons_n1 <= \
+                final_times_n1 * (1. + self.horizon_tolerance)
+            if np.all(feasible_n1):
+                break
+            final_times_n1 = np.where(feasible_n1, final_times_n1,
+                                      required_horizons_n1)
+        self.spline_trajectory.valid_horizons_n1 = np.ceil(
+            self.spline_trajectory.final_times_n1 / self.spline_trajectory.dt)
+
+        valid_idxs = self.spline_trajectory.find_trajectories_within_a_horizon(
+            p.planning_horizon_s)
+        valid_idxs = valid_idxs[feasible_n1[valid_idxs, 0]]
+        horizons_n1 = np.take(self.spline_trajectory.final_times_n1, valid_idxs)
+        start_config.gather_across_batch_dim(valid_idxs)
+        goal_config.gather_across_batch_dim(valid_idxs)
+        self.spline_trajectory.gather_across_batch_dim(valid_idxs)
+        return start_config, goal_config, horizons_n1
+
+    def _refit_spline(self, start_config, goal_config, final_times_n1, times_nk):
+        """Fits the splines over final_times_n1 and returns the horizons over
+        which they are dynamically feasible"""
+        self.spline_trajectory.fit(start_config, goal_config,
+                                   final_times_n1=final_times_n1)
+        self.spline_trajectory.eval_spline(times_nk, calculate_speeds=True)
+        required_horizons_n1 = self.spline_trajectory.compute_dynamically_feasible_horizon(
+            self.system_dynamics.v_bounds[1], self.system_dynamics.w_bounds[1])
+        return np.maximum(required_horizons_n1, self.params.minimum_spline_horizon)
+
+    def _update_time_per_waypt(self, plan_t, num_waypts):
+        time_per_waypt_s = plan_t / max(num_waypts, 1)
+        if self.time_per_waypt_s is None:
+            self.time_per_waypt_s = time_per_waypt_s
+        else:
+            self.time_per_waypt_s = 0.8 * self.time_per_waypt_s + \
+                0.2 * time_per_waypt_s
@@ -170,9 +170,9 @@ class ControlPipelineV0(ControlPipelineBase):
         the planning horizon."""
         p = self.params
         times_nk = np.tile(np.linspace(0., p.planning_horizon_s, p.planning_horizon)[
-                           None], [self.waypoint_grid.n, 1])
+                           None], [goal_config.n, 1])
         final_times_n1 = np.ones(
-            (self.waypoint_grid.n, 1), dtype=np.float32) * p.planning_horizon_s
+            (goal_config.n, 1), dtype=np.float32) * p.planning_horizon_s
         self.spline_trajectory.fit(
             start_config, goal_config, final_times_n1=final_times_n1)
         self.spline_trajectory.eval_spline(times_nk, calculate_speeds=True)
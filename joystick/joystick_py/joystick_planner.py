@@ -3,6 +3,7 @@ from joystick_py.joystick_base import JoystickBase
 from params.central_params import create_agent_params
 from trajectory.trajectory import Trajectory
 from utils.utils import generate_config_from_pos_3, euclidean_dist2
+from simulators.sim_state import compute_agent_clearance
 from agents.agent import Agent
 
 
@@ -15,16 +16,28 @@ class JoystickWithPlanner(JoystickBase):
         self.robot_current = None    # current position of the robot
         self.robot_v = 0     # not tracked in the base simulator
         self.robot_w = 0     # not tracked in the base simulator
+        # the number of joystick_plan calls since the last plan (None before
+        # the first) and the goal it was planned to
+        self.plans_since_replan = None
+        self.plan_goal_3 = None
         super().__init__("SamplingPlanner")  # parent class needs to know the algorithm
 
     def init_obstacle_map(self, renderer=0):
         """ Initializes the sbpd map."""
+        from obstacles.map_registry import get_obstacle_map, attach_from_shared_memory
         p = self.agent_params.obstacle_map_params
         env = self.current_ep.get_environment()
-        return p.obstacle_map(p, renderer,
-                              res=float(env["map_scale"]) * 100.,
-                              map_trav=np.array(env["map_traversible"])
-                              )
+        if "shared_obstacle_map" in env:
+            try:
+                # use the simulator's map directly (no recomputation)
+                return attach_from_shared_memory(p, env["shared_obstacle_map"])
+            except FileNotFoundError:
+                # simulator is not on the same machine, build our own map
+                pass
+        return get_obstacle_map(p, renderer,
+                                res=float(env["map_scale"]) * 100.,
+                                map_trav=np.array(env["map_traversible"]),
+                                building_name=env.get("building_name"))
 
     def init_control_pipeline(self):
         # NOTE: this is like an init() run *after* obtaining episode metadata
@@ -55,6 +68,8 @@ class JoystickWithPlanner(JoystickBase):
         self.robot_current = self.current_ep.get_robot_start().copy()
         # init a list of commands that will be sent to the robot
         self.commands = None
+        self.plans_since_replan = None
+        self.plan_goal_3 = None
 
     def joystick_sense(self):
         # ping's the robot to request a sim state
@@ -78,12 +93,43 @@ class JoystickWithPlanner(JoystickBase):
         self.robot_w = \
             (self.robot_current[2] - robot_prev[2]) / self.sim_dt
 
+    def needs_replan(self):
+        """Whether to replan (instead of sending the rest of the planned
+        commands): every replan_interval calls of joystick_plan, when the
+        commands run out, the goal changed or a pedestrian is closer than
+        replan_clearance (collision risk)"""
+        p = self.joystick_params
+        if self.plans_since_replan is None or \
+                self.plans_since_replan + 1 >= p.replan_interval:
+            return True
+        if self.num_commands_left() < self.agent_params.control_horizon:
+            return True
+        if not np.allclose(self.goal_config.to_3D_numpy(), self.plan_goal_3):
+            return True
+        robot_name, robot = list(self.sim_state_now.get_robots().items())[0]
+        clearance = compute_agent_clearance(self.sim_state_now, robot_name,
+                                            self.robot_current, robot.get_radius())
+        return clearance < p.replan_clearance
+
+    def num_commands_left(self):
+        return len(self.commands) if self.commands is not None else 0
+
+    def plan_horizon(self):
+        """The planned commands last until the next (regular) replan"""
+        return self.agent_params.control_horizon * self.joystick_params.replan_interval
+
     def joystick_plan(self):
         """ Runs the planner for one step from config to generate a
         subtrajectory, the resulting robot config after the robot executes
         the subtrajectory, and relevant planner data
         - Access to sim_states from the self.current_world
         """
+        if not self.needs_replan():
+            # keep sending the planned commands
+            self.plans_since_replan += 1
+            return
+        self.plans_since_replan = 0
+        self.plan_goal_3 = self.goal_config.to_3D_numpy()
         robot_config = generate_config_from_pos_3(self.robot_current,
                                                   dt=self.agent_params.dt,
                                                   v=self.robot_v,
@@ -97,7 +143,7 @@ class JoystickWithPlanner(JoystickBase):
 
         # LQR feedback control loop
         t_seg = Trajectory.new_traj_clip_along_time_axis(self.planner_data['trajectory'],
-                                                         self.agent_params.control_horizon,
+                                                         self.plan_horizon(),
                                                          repeat_second_to_last_speed=True)
         # From the new planned subtrajectory, parse it for the requisite v & w commands
         _, cmd_actions_nkf = self.system_dynamics.parse_trajectory(t_seg)
@@ -107,12 +153,14 @@ class JoystickWithPlanner(JoystickBase):
         if self.joystick_on:
             # sends velocity commands within the robot's system dynamics
             assert(self.joystick_params.use_system_dynamics)
-            # runs through the entire planned horizon just with a cmds_step
+            # runs through the control horizon just with a cmds_step (the
+            # rest of the planned commands are sent after the next sense)
             num_cmds_per_step = self.simulator_joystick_update_ratio
+            num_cmds = min(len(self.commands), self.agent_params.control_horizon)
             # get velocity bounds from the system dynamics params
             self.v_bounds = self.system_dynamics_params.v_bounds
             self.w_bounds = self.system_dynamics_params.w_bounds
-            for _ in range(int(np.floor(len(self.commands) / num_cmds_per_step))):
+            for _ in range(int(np.floor(num_cmds / num_cmds_per_step))):
                 # initialize the command containers
                 velocity_cmds = []
                 # only going to send the first simulator_joystick_update_ratio commands
@@ -166,6 +214,12 @@ class JoystickWithPlannerPosns(JoystickWithPlanner):
         # can also try:
         #     # assumes the robot has executed all the previous commands in self.commands
         #     (x, y, th, v) = self.from_conf(self.commands, -1)
+        if not self.needs_replan():
+            # keep sending the planned commands
+            self.plans_since_replan += 1
+            return
+        self.plans_since_replan = 0
+        self.plan_goal_3 = self.goal_config.to_3D_numpy()
         robot_config = generate_config_from_pos_3(pos_3=(x, y, th), v=v)
         self.planner_data = self.planner.optimize(robot_config,
                                                   self.goal_config,
@@ -176,14 +230,18 @@ class JoystickWithPlannerPosns(JoystickWithPlanner):
 
         # LQR feedback control loop
         self.commands = Trajectory.new_traj_clip_along_time_axis(self.planner_data['trajectory'],
-                                                                 self.agent_params.control_horizon,
+                                                                 self.plan_horizon(),
                                                                  repeat_second_to_last_speed=True)
 
+    def num_commands_left(self):
+        return self.commands.k if self.commands is not None else 0
+
     def joystick_act(self):
         if self.joystick_on:
             num_cmds_per_step = self.simulator_joystick_update_ratio
-            # runs through the entire planned horizon just with a cmds_step of the above
-            num_steps = int(np.floor(self.commands.k / num_cmds_per_step))
+            # runs through the control horizon just with a cmds_step of the above
+            num_cmds = min(self.commands.k, self.agent_params.control_horizon)
+            num_steps = int(np.floor(num_cmds / num_cmds_per_step))
             for j in range(num_steps):
                 xytv_cmds = []
                 for i in range(num_cmds_per_step):
@@ -195,3 +253,9 @@ class JoystickWithPlannerPosns(JoystickWithPlanner):
                 # break if the robot finished
                 if not self.joystick_on:
                     break
+            # remove the sent commands
+            num_sent = num_steps * num_cmds_per_step
+            if num_sent >= self.commands.k:
+                self.commands = None
+            else:
+                self.commands.take_along_time_axis(num_sent)
@@ -3,8 +3,177 @@ from metrics import cost_functions
 from simulators.simulator import Simulator
 import pandas as pd
 
+"""
+Every metric declares (with the @metric decorator) the episode inputs it
+needs, such as the robot positions or velocities. These intermediate arrays
+are computed lazily, only once per episode, by an EpisodeMetricInputs and
+shared between all the metrics that are scored together (see compute_metrics).
+Metrics can still be called directly as metric_fn(central_sim).
+"""
+
+# all the metrics, indexed by name: (metric_fn, names of its inputs)
+metric_registry = {}
+# functions computing the intermediate (shared) inputs, indexed by name
+metric_input_registry = {}
+
+
+def metric(*input_names):
+    """Registers the decorated function as a metric computed from the inputs
+    named in input_names (passed to it as keyword arguments)"""
+    def register(fn):
+        for name in input_names:
+            assert(name in metric_input_registry)
+
+        def metric_fn(central_sim: Simulator, inputs=None):
+            if inputs is None:
+                inputs = EpisodeMetricInputs(central_sim)
+            return fn(**{name: inputs.get(name) for name in input_names})
+        metric_fn.__name__ = fn.__name__
+        metric_fn.__doc__ = fn.__doc__
+        metric_fn.input_names = input_names
+        metric_registry[fn.__name__] = (metric_fn, input_names)
+        return metric_fn
+    return register
+
+
+def metric_input(fn):
+    """Registers the decorated function as an input that metrics can depend on"""
+    metric_input_registry[fn.__name__] = fn
+    return fn
+
+
+class EpisodeMetricInputs(object):
+    """Lazily computes and caches the metric inputs of a single episode"""
+
+    def __init__(self, central_sim: Simulator):
+        self.central_sim = central_sim
+        self.cache = {}
+
+    def get(self, name: str):
+        if name not in self.cache:
+            self.cache[name] = metric_input_registry[name](self)
+        return self.cache[name]
+
+
+# metrics that need every sim_state (see keep_sim_history)
+sim_history_metrics = ["total_sim_time_taken", "closest_pedestrian_distance",
+                       "time_to_collision"]
+
+
+def compute_metrics(central_sim: Simulator, metrics_list: list,
+                    online_scores: dict = None):
+    """Computes all the metrics in metrics_list, sharing their inputs. The
+    online_scores (accumulated during the simulation) only fill in the scores
+    that are not in metrics_list, they never replace a metric since e.g. the
+    online path length is sampled once per sim_step while the metrics use the
+    robot trajectory (at its control rate)"""
+    inputs = EpisodeMetricInputs(central_sim)
+    metrics_out = {}
+    if online_scores is not None:
+        metrics_out.update({name: score for name, score in online_scores.items()
+                            if name not in metrics_list})
+    for metric_name in metrics_list:
+        if metric_name not in metric_registry:
+            print("The metric %s is not implemented yet" % metric_name)
+            continue
+        metric_fn, _ = metric_registry[metric_name]
+        metrics_out[metric_name] = metric_fn(central_sim, inputs=inputs)
+    return metrics_out
+
+
+""" BEGIN METRIC INPUTS """
+
+
+@metric_input
+def central_sim(inputs: EpisodeMetricInputs):
+    return inputs.central_sim
+
+
+@metric_input
+def dt(inputs: EpisodeMetricInputs):
+    return inputs.central_sim.dt
+
+
+@metric_input
+def robot_traj_k3(inputs: EpisodeMetricInputs):
+    return np.squeeze(
+        inputs.central_sim.robot.get_trajectory().position_and_heading_nk3())
+
+
+@metric_input
+def robot_pos_k2(inputs: EpisodeMetricInputs):
+    # drop the heading
+    return inputs.get('robot_traj_k3')[:, :-1]
+
+
+@metric_input
+def robot_goal_2(inputs: EpisodeMetricInputs):
+    return np.squeeze(
+        inputs.central_sim.robot.goal_config.position_and_heading_nk3())[:-1]
+
+
+@metric_input
+def robot_vel_k2(inputs: EpisodeMetricInputs):
+    return np.diff(inputs.get('robot_pos_k2'), axis=0) / inputs.get('dt')
+
+
+@metric_input
+def robot_acc_k2(inputs: EpisodeMetricInputs):
+    return np.diff(inputs.get('robot_vel_k2'), axis=0) / inputs.get('dt')
+
+
+@metric_input
+def robot_jerk_k2(inputs: EpisodeMetricInputs):
+    return np.diff(inputs.get('robot_acc_k2'), axis=0) / inputs.get('dt')
+
+
+@metric_input
+def robot_speed_k(inputs: EpisodeMetricInputs):
+    robot_vel_k2 = inputs.get('robot_vel_k2')
+    return np.sqrt(robot_vel_k2[:, 0]**2 + robot_vel_k2[:, 1]**2)
+
+
+@metric_input
+def ped_arrays(inputs: EpisodeMetricInputs):
+    """
+    Pivot the simulation dataframe (once) into a (steps x pedestrians) layout.
+    Returns the robot trajectory (steps x 3) and the pedestrian x, y, vx, vy
+    arrays (steps x pedestrians) which are nan where a pedestrian is absent.
+    NOTE: assumes the robot is present at every sim_step
+    """
+    sim_df = inputs.central_sim.sim_df
+    robot_indcs = (sim_df.agent_name == 'robot_agent').to_numpy()
+    ped_df = sim_df[~robot_indcs]
+    bot_df = sim_df[robot_indcs]
+    robot_trajectory = np.vstack([bot_df.x, bot_df.y, bot_df.theta]).T
+    num_steps = len(robot_trajectory)
+    dt = inputs.get('dt')
+
+    # calculate velocities for pedestrians (between their consecutive rows)
+    vel_df = ped_df.groupby(['agent_name'], observed=True)[['x', 'y']].diff()
+    vel_df = vel_df.fillna(0) / dt
+
+    sim_steps = ped_df.sim_step.to_numpy().astype(np.int64)
+    ped_ids, _ = pd.factorize(ped_df.agent_name)
+    in_range = sim_steps < num_steps
+    sim_steps = sim_steps[in_range]
+    ped_ids = ped_ids[in_range]
+    num_peds = (ped_ids.max() + 1) if len(ped_ids) > 0 else 0
+
+    def pivot(values):
+        pivoted = np.full((num_steps, num_peds), np.nan)
+        pivoted[sim_steps, ped_ids] = values.to_numpy()[in_range]
+        return pivoted
+
+    return (robot_trajectory, pivot(ped_df.x), pivot(ped_df.y),
+            pivot(vel_df.x), pivot(vel_df.y))
+
+
+""" END METRIC INPUTS """
+
 
 # meta
+@metric('central_sim')
 def success(central_sim: Simulator):
     terminate_cause = central_sim.robot.termination_cause
     if terminate_cause == "Pedestrian Collision":
@@ -22,173 +191,94 @@ def success(central_sim: Simulator):
     return False
 
 
+@metric('central_sim')
 def total_sim_time_taken(central_sim: Simulator):
     last_step_num = max(list(central_sim.sim_states.keys()))
     return last_step_num * central_sim.dt
 
 
+@metric('central_sim')
 def sim_time_budget(central_sim: Simulator):
     return central_sim.episode_params.max_time
 
 
+@metric('central_sim')
 def termination_cause(central_sim: Simulator):
     return central_sim.robot.termination_cause
 
 
+@metric('central_sim')
 def wall_wait_time(central_sim: Simulator):
     return central_sim.robot.get_block_t_total()
 
 
+@metric('central_sim')
 def map(central_sim: Simulator):
     return central_sim.episode_params.map_name
 
 
 # motion
-def robot_speed(central_sim: Simulator, percentile=False):
-    # extract the bot traj and drop the heading
-    robot_trajectory = np.squeeze(
-        central_sim.robot.get_trajectory().position_and_heading_nk3())[:, :-1]
-    dt = central_sim.dt
-    robot_displacement = np.diff(robot_trajectory, axis=0)
-    robot_speed = np.sqrt(
-        (robot_displacement[:, 0] / dt)**2 + (robot_displacement[:, 1] / dt)**2)
+@metric('robot_speed_k')
+def robot_speed(robot_speed_k):
+    return robot_speed_k
 
-    if percentile:
-        # TODO run for all peds
-        df = central_sim.sim_df
-        pass
-    return robot_speed
 
+@metric('robot_vel_k2')
+def robot_velocity(robot_vel_k2):
+    return robot_vel_k2
 
-def robot_velocity(central_sim: Simulator, percentile=False):
-    # extract the bot traj and drop the heading
-    robot_trajectory = np.squeeze(
-        central_sim.robot.get_trajectory().position_and_heading_nk3())[:, :-1]
-    dt = central_sim.dt
-    robot_displacement = np.diff(robot_trajectory, axis=0)
-    robot_vel = robot_displacement / dt
 
-    if percentile:
-        # TODO run for all peds
-        df = central_sim.sim_df
-        pass
-    return robot_vel
+@metric('robot_acc_k2')
+def robot_acceleration(robot_acc_k2):
+    return robot_acc_k2
 
 
-def robot_acceleration(central_sim: Simulator, percentile=False):
-    # extract the bot traj and drop the heading
-    robot_trajectory = np.squeeze(
-        central_sim.robot.get_trajectory().position_and_heading_nk3())[:, :-1]
-    dt = central_sim.dt
-    robot_displacement = np.diff(robot_trajectory, axis=0)
-    robot_vel = robot_displacement / dt
-    robot_acc = np.diff(robot_vel, axis=0) / dt
-
-    if percentile:
-        # TODO run for all peds
-        df = central_sim.sim_df
-        pass
-    return robot_acc
-
-
-def robot_jerk(central_sim: Simulator, percentile=False):
-    # extract the bot traj and drop the heading
-    robot_trajectory = np.squeeze(
-        central_sim.robot.get_trajectory().position_and_heading_nk3())[:, :-1]
-    dt = central_sim.dt
-    robot_vel = np.diff(robot_trajectory, axis=0) / dt
-    robot_acc = np.diff(robot_vel, axis=0) / dt
-    robot_jrk = np.diff(robot_acc, axis=0) / dt
-
-    if percentile:
-        # TODO run for all peds
-        df = central_sim.sim_df
-        pass
-    return robot_jrk
-
-
-def robot_motion_energy(central_sim: Simulator, percentile=False):
-    # extract the bot traj and drop the heading
-    robot_trajectory = np.squeeze(
-        central_sim.robot.get_trajectory().position_and_heading_nk3())[:, :-1]
-    dt = central_sim.dt
-    robot_displacement = np.diff(robot_trajectory, axis=0)
-    robot_motion_energy = np.sum(
-        (robot_displacement[:, 0] / dt)**2 + (robot_displacement[:, 1] / dt)**2)
+@metric('robot_jerk_k2')
+def robot_jerk(robot_jerk_k2):
+    return robot_jerk_k2
+
 
-    if percentile:
-        # TODO run for all peds
-        df = central_sim.sim_df
-        pass
-    return robot_motion_energy
+@metric('robot_vel_k2')
+def robot_motion_energy(robot_vel_k2):
+    return np.sum(robot_vel_k2[:, 0]**2 + robot_vel_k2[:, 1]**2)
 
 
 # path
-def path_length(central_sim: Simulator, percentile=False):
-    # extract the bot traj and drop the heading
-    robot_trajectory = np.squeeze(
-        central_sim.robot.get_trajectory().position_and_heading_nk3())[:, :-1]
-    robot_goal = np.squeeze(
-        central_sim.robot.goal_config.position_and_heading_nk3())[:-1]
-    robot_path_ln = cost_functions.path_length(robot_trajectory)
-    if percentile:
-        # TODO run for all peds
-        df = central_sim.sim_df
-        pass
-    return robot_path_ln
-
-
-def path_length_ratio(central_sim: Simulator, percentile=False):
-    # extract the bot traj and drop the heading
-    robot_trajectory = np.squeeze(
-        central_sim.robot.get_trajectory().position_and_heading_nk3())[:, :-1]
-    robot_goal = np.squeeze(
-        central_sim.robot.goal_config.position_and_heading_nk3())[:-1]
-    robot_path_ln_ratio = cost_functions.path_length_ratio(
-        robot_trajectory, goal_config=robot_goal)
-    if percentile:
-        # TODO run for all peds
-        df = central_sim.sim_df
-        pass
-    return robot_path_ln_ratio
-
-
-def path_irregularity(central_sim: Simulator, percentile=False):
-
-    robot_trajectory = np.squeeze(
-        central_sim.robot.get_trajectory().position_and_heading_nk3())
+@metric('robot_pos_k2')
+def path_length(robot_pos_k2):
+    return cost_functions.path_length(robot_pos_k2)
+
+
+@metric('robot_pos_k2', 'robot_goal_2')
+def path_length_ratio(robot_pos_k2, robot_goal_2):
+    return cost_functions.path_length_ratio(robot_pos_k2,
+                                            goal_config=robot_goal_2)
+
+
+@metric('central_sim', 'robot_traj_k3')
+def path_irregularity(central_sim: Simulator, robot_traj_k3):
     # check if goal was reached
     if central_sim.robot.termination_cause == "Success":
         path_irr = cost_functions.path_irregularity(
-            trajectory=robot_trajectory
+            trajectory=robot_traj_k3
         )
     else:
         goal = central_sim.robot.get_goal_config().to_3D_numpy()
         path_irr = cost_functions.path_irregularity(
-            trajectory=robot_trajectory,
+            trajectory=robot_traj_k3,
             goal_config=goal
         )
-
-    if percentile:
-        # TODO run for all
-        df = central_sim.sim_df
-        pass
     return path_irr
 
 
-def goal_traversal_ratio(central_sim: Simulator, percentile=False):
-    # extract the bot traj and the goal and drop the heading
-    robot_trajectory = np.squeeze(
-        central_sim.robot.get_trajectory().position_and_heading_nk3())[:, :-1]
-    robot_end = robot_trajectory[-1, :]
-    robot_start = robot_trajectory[0, :]
-    robot_goal = np.squeeze(
-        central_sim.robot.goal_config.position_and_heading_nk3())[:-1]
-    robot_path_ln = cost_functions.path_length(robot_trajectory)
+@metric('robot_pos_k2', 'robot_goal_2')
+def goal_traversal_ratio(robot_pos_k2, robot_goal_2):
+    robot_end = robot_pos_k2[-1, :]
+    robot_start = robot_pos_k2[0, :]
 
     # extract bot dist to goal and bot start to goal
-    start_goal_dist = np.linalg.norm(robot_start - robot_goal)
-    end_goal_dist = np.linalg.norm(robot_end - robot_goal)
+    start_goal_dist = np.linalg.norm(robot_start - robot_goal_2)
+    end_goal_dist = np.linalg.norm(robot_end - robot_goal_2)
 
     goal_trav_ratio = end_goal_dist / start_goal_dist
 
@@ -196,84 +286,60 @@ def goal_traversal_ratio(central_sim: Simulator, percentile=False):
 
 
 # pedestrian related
+def _carry_forward_empty_steps(values, has_peds):
+    """
+    Steps without any pedestrians take the value of the previous step
+    (and 0 if there are no pedestrians before them)
+    """
+    step_idx = np.where(has_peds, np.arange(len(values)), -1)
+    last_valid = np.maximum.accumulate(step_idx) if len(values) > 0 else step_idx
+    return np.where(last_valid >= 0, values[np.maximum(last_valid, 0)], 0.)
+
+
 # TODO incorporate radii
-def time_to_collision(central_sim: Simulator, percentile=False):
-    sim_df = central_sim.sim_df
-    robot_indcs = (sim_df.agent_name == 'robot_agent')
-    ped_df = central_sim.sim_df[~robot_indcs]
-    bot_df = central_sim.sim_df[robot_indcs]
-    robot_trajectory = np.vstack([bot_df.x, bot_df.y, bot_df.theta]).T
-    ped_name_df = ped_df.set_index('agent_name')
-    dt = central_sim.dt
+@metric('ped_arrays', 'dt')
+def time_to_collision(ped_arrays, dt):
+    robot_trajectory, ped_x, ped_y, ped_vx, ped_vy = ped_arrays
     robot_displacement = np.diff(robot_trajectory, axis=0)
     robot_inst_vels = robot_displacement[:, :-1] / dt
-    robot_df = ped_df[ped_df.agent_name == 'robot_agent']
-
-    # calculate velocities for pedestrians
-    vel_df = ped_df.groupby(['agent_name'])[['x', 'y']].diff().fillna(0) / dt
-    vel_df.columns = ['vx', 'vy']
-    ped_df = pd.concat([ped_df, vel_df], axis=1)
-
-    # for each time instance in which robot_trajectory exists
-    ttc = np.zeros((len(robot_inst_vels)))
-    for sim_step in range(len(robot_inst_vels)):
-        robot_inst_vel = robot_inst_vels[sim_step - 1]
-        sim_step += 1  # velocity is valid only after 2 steps
-        # for each bot-ped pair
-        # compute the robot-pedestrian relative velocity at each instant
-        ped_inst = vel_df[ped_df.sim_step == sim_step]
-        if len(ped_inst) == 0:
-            ttc[sim_step - 1] = ttc[sim_step - 2]
-            continue
+    # NOTE: step s+1 is paired with the robot velocity at s-1 (and the first
+    # step with the last velocity) to match the original loop-based metric
+    robot_inst_vels = np.roll(robot_inst_vels, 1, axis=0)
 
-        ped_inst_vels = np.array(
-            ped_df[ped_df.sim_step == sim_step].loc[:, ('vx', 'vy')])
-        botped_relative_vels = ped_inst_vels - robot_inst_vel
+    # velocity is valid only after 2 steps
+    ped_x, ped_y = ped_x[1:], ped_y[1:]
+    ped_vx, ped_vy = ped_vx[1:], ped_vy[1:]
+    present = ~np.isnan(ped_x)
 
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # compute the robot-pedestrian relative velocity at each instant
+        rel_vx = ped_vx - robot_inst_vels[:, 0:1]
+        rel_vy = ped_vy - robot_inst_vels[:, 1:2]
         # compute the robot-pedestrian joining unit vector
-        ped_inst_posns = np.array(
-            ped_df[ped_df.sim_step == sim_step].loc[:, ('x', 'y')])
-        botped_vectors = robot_trajectory[sim_step, :2] - ped_inst_posns
-        botped_distances = np.linalg.norm(botped_vectors, axis=1)
-        # needs the extra axis to divide correctly
-        botped_uvectors = botped_vectors / \
-            np.linalg.norm(botped_vectors, axis=1)[:, None]
-
+        botped_vx = robot_trajectory[1:, 0:1] - ped_x
+        botped_vy = robot_trajectory[1:, 1:2] - ped_y
+        botped_distances = np.sqrt(botped_vx * botped_vx +
+                                   botped_vy * botped_vy)
         # take relative velocity component along the joining vector
-        botped_component = np.sum(
-            botped_relative_vels * botped_uvectors, axis=1)
-
+        botped_component = rel_vx * (botped_vx / botped_distances) + \
+            rel_vy * (botped_vy / botped_distances)
         # see how long it would take to cover that distance w relative velocity
         ttc_all = botped_distances / botped_component
-        # discard negative times since there is no collision
-        ttc_pos = ttc_all[ttc_all > 0]
-        if len(ttc_pos) == 0:  # no collisions
-            ttc[sim_step - 1] = -1
-        else:
-            ttc[sim_step - 1] = np.min(ttc_pos)
-
-    return ttc
-
-
-def closest_pedestrian_distance(central_sim: Simulator, percentile=False):
-    sim_df = central_sim.sim_df
-    robot_indcs = (sim_df.agent_name == 'robot_agent')
-    ped_df = central_sim.sim_df[~robot_indcs]
-    bot_df = central_sim.sim_df[robot_indcs]
-    robot_trajectory = np.vstack([bot_df.x, bot_df.y]).T
-    # robot_trajectory = np.squeeze(central_sim.robot.get_trajectory().position_and_heading_nk3())[:, :-1]
-    dt = central_sim.dt
-
-    cpd = np.zeros((len(robot_trajectory)))
-    for sim_step in range(len(robot_trajectory)):
-        ped_inst = ped_df[ped_df.sim_step == sim_step]
-        if len(ped_inst) == 0:
-            cpd[sim_step] = cpd[sim_step - 1]
-            continue
-        # compute the robot-pedestrian joining unit vector
-        ped_inst_posns = np.vstack([ped_inst.x, ped_inst.y]).T
-        botped_vectors = robot_trajectory[sim_step] - ped_inst_posns
-        botped_distances = np.linalg.norm(botped_vectors, axis=1)
-        cpd[sim_step] = np.min(botped_distances)
 
-    return cpd
+    # discard negative times since there is no collision
+    ttc_pos = present & (ttc_all > 0)
+    ttc = np.where(ttc_pos, ttc_all, np.inf).min(axis=1, initial=np.inf)
+    ttc[~ttc_pos.any(axis=1)] = -1  # no collisions
+    return _carry_forward_empty_steps(ttc, present.any(axis=1))
+
+
+@metric('ped_arrays')
+def closest_pedestrian_distance(ped_arrays):
+    robot_trajectory, ped_x, ped_y, _, _ = ped_arrays
+    present = ~np.isnan(ped_x)
+    botped_vx = robot_trajectory[:, 0:1] - ped_x
+    botped_vy = robot_trajectory[:, 1:2] - ped_y
+    botped_distances = np.sqrt(botped_vx * botped_vx + botped_vy * botped_vy)
+    cpd = np.where(present, botped_distances, np.inf).min(axis=1,
+                                                            initial=np.inf)
+    return _carry_forward_empty_steps(cpd, present.any(axis=1))
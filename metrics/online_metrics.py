@@ -0,0 +1,122 @@
+import numpy as np
+from simulators.sim_state import SimState
+
+"""
+Episode metrics that are accumulated incrementally (one SimState at a time)
+during the simulation, so their scores are ready as soon as the episode ends
+and do not need the full history of sim_states (see keep_sim_history).
+NOTE: the robot positions are sampled once per sim_step (from the SimStates)
+"""
+
+
+class OnlineEpisodeMetrics(object):
+    """Running accumulators for the path length, motion energy, jerk,
+    closest pedestrian distance and time to collision of the robot"""
+
+    def __init__(self, dt: float):
+        self.dt = dt
+        self.last_step = 0
+        self.num_robot_steps = 0
+        # last robot position, velocity and acceleration (None until known)
+        self.robot_pos_2 = None
+        self.robot_vel_2 = None
+        self.robot_acc_2 = None
+        # last position of every pedestrian indexed by name
+        self.ped_pos = {}
+        # (sim_step, name) of the pedestrians the robot collided with
+        self.robot_colliders = []
+        # accumulators
+        self.path_length = 0.
+        self.motion_energy = 0.
+        self.jerk_sum = 0.
+        self.num_jerks = 0
+        self.min_ped_dist = np.inf
+        self.min_ttc = np.inf
+
+    def update(self, sim_step: int, sim_state: SimState):
+        """Updates all the accumulators with the newest SimState"""
+        self.last_step = max(self.last_step, sim_step)
+        collider = sim_state.get_collider()
+        if collider != "":
+            self.robot_colliders.append((sim_step, collider))
+        robots = sim_state.get_robots()
+        if len(robots) == 0:
+            return
+        robot = list(robots.values())[0]
+        pos_2 = np.asarray(robot.get_current_config().to_3D_numpy(),
+                           dtype=np.float64)[:2]
+        # the robot velocity at the previous step is used for the time to
+        # collision (same as in metrics_sim_utils.time_to_collision)
+        prev_robot_vel_2 = self.robot_vel_2
+        self._update_robot(pos_2)
+        self._update_pedestrians(sim_state.get_pedestrians(), pos_2,
+                                 prev_robot_vel_2)
+
+    def _update_robot(self, pos_2: np.ndarray):
+        self.num_robot_steps += 1
+        if self.robot_pos_2 is not None:
+            displacement_2 = pos_2 - self.robot_pos_2
+            self.path_length += np.linalg.norm(displacement_2)
+            vel_2 = displacement_2 / self.dt
+            self.motion_energy += np.sum(vel_2 * vel_2)
+            if self.robot_vel_2 is not None:
+                acc_2 = (vel_2 - self.robot_vel_2) / self.dt
+                if self.robot_acc_2 is not None:
+                    jerk_2 = (acc_2 - self.robot_acc_2) / self.dt
+                    self.jerk_sum += np.linalg.norm(jerk_2)
+                    self.num_jerks += 1
+                self.robot_acc_2 = acc_2
+            self.robot_vel_2 = vel_2
+        self.robot_pos_2 = pos_2
+
+    def _update_pedestrians(self, pedestrians: dict, robot_pos_2: np.ndarray,
+                            robot_vel_2: np.ndarray):
+        if len(pedestrians) == 0:
+            return
+        names = list(pedestrians.keys())
+        ped_pos_n2 = np.array([pedestrians[name].get_current_config().to_3D_numpy()[:2]
+                               for name in names], dtype=np.float64)
+        # pedestrians that just appeared have no velocity yet
+        ped_vel_n2 = np.array([(ped_pos_n2[i] - self.ped_pos[name]) / self.dt
+                               if name in self.ped_pos else np.zeros(2)
+                               for i, name in enumerate(names)])
+        for i, name in enumerate(names):
+            self.ped_pos[name] = ped_pos_n2[i]
+
+        botped_vectors_n2 = robot_pos_2 - ped_pos_n2
+        botped_distances_n = np.linalg.norm(botped_vectors_n2, axis=1)
+        self.min_ped_dist = min(self.min_ped_dist, botped_distances_n.min())
+
+        # velocity is valid only after 2 steps
+        if robot_vel_2 is None:
+            return
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rel_vels_n2 = ped_vel_n2 - robot_vel_2
+            botped_uvectors_n2 = botped_vectors_n2 / botped_distances_n[:, None]
+            botped_component_n = np.sum(rel_vels_n2 * botped_uvectors_n2, axis=1)
+            ttc_n = botped_distances_n / botped_component_n
+        # discard negative times since there is no collision
+        ttc_n = ttc_n[ttc_n > 0]
+        if len(ttc_n) > 0:
+            self.min_ttc = min(self.min_ttc, ttc_n.min())
+
+    def get_robot_colliders(self, max_step: int = None):
+        """Names of the pedestrians the robot collided with before max_step"""
+        return [collider for step, collider in self.robot_colliders
+                if max_step is None or step < max_step]
+
+    def get_scores(self):
+        """Returns the accumulated scores (indexed by metric name)"""
+        return {
+            "total_sim_time_taken": self.last_step * self.dt,
+            "path_length": self.path_length,
+            "robot_motion_energy": self.motion_energy,
+            "robot_mean_jerk":
+                self.jerk_sum / self.num_jerks if self.num_jerks > 0 else 0.,
+            # -1 when there were never any pedestrians around
+            "min_closest_pedestrian_distance":
+                self.min_ped_dist if np.isfinite(self.min_ped_dist) else -1,
+            # -1 when there are no collisions
+            "min_time_to_collision":
+                self.min_ttc if np.isfinite(self.min_ttc) else -1,
+        }
@@ -16,6 +16,8 @@
 """Various function to compute the ground truth map for training etc.
 """
 import copy
+import multiprocessing
+from collections import OrderedDict
 from skimage import morphology
 import numpy as np
 import scipy.ndimage
@@ -25,11 +27,24 @@ import sys
 from utils.utils import Foo
 from params.central_params import create_building_params
 
+# (area weighted) number of points of the building meshes projected onto every
+# cell of the map, indexed by the building and the map, robot base and height
+# (see compute_traversibility), least recently used first
+point_counts_cache = OrderedDict()
+# (obstacle_free, valid_space) indexed by the point counts key and robot radius
+traversible_cache = OrderedDict()
+
+
+def clear_traversible_caches():
+    """Frees the point counts and traversibles cached by compute_traversibility"""
+    point_counts_cache.clear()
+    traversible_cache.clear()
+
 
 def _get_xy_bounding_box(vertex, padding):
     """Returns the xy bounding box of the environment."""
-    min_ = np.floor(np.min(vertex[:, :2], axis=0) - padding).astype(np.int)
-    max_ = np.ceil(np.max(vertex[:, :2], axis=0) + padding).astype(np.int)
+    min_ = np.floor(np.min(vertex[:, :2], axis=0) - padding).astype(int)
+    max_ = np.ceil(np.max(vertex[:, :2], axis=0) + padding).astype(int)
     return min_, max_
 
 
@@ -38,14 +53,14 @@ def _project_to_map(map, vertex, wt=None, ignore_points_outside_map=False):
     location."""
     num_points = np.zeros((map.size[1], map.size[0]))
     vertex_ = vertex[:, :2] - map.origin
-    vertex_ = np.round(vertex_ / map.resolution).astype(np.int)
+    vertex_ = np.round(vertex_ / map.resolution).astype(int)
     if ignore_points_outside_map:
         good_ind = np.all(np.array([vertex_[:, 1] >= 0, vertex_[:, 1] < map.size[1],
                                     vertex_[:, 0] >= 0, vertex_[:, 0] < map.size[0]]),
                           axis=0)
         vertex_ = vertex_[good_ind, :]
         if wt is not None:
-            wt = wt[good_ind, :]
+            wt = wt[good_ind]
     if wt is None:
         np.add.at(num_points, (vertex_[:, 1], vertex_[:, 0]), 1)
     else:
@@ -69,13 +84,14 @@ def _fill_holes(img, thresh):
     """Fills holes less than thresh area (assumes 4 connectivity when computing
     hole area."""
     l, n = scipy.ndimage.label(np.logical_not(img))
-    img_ = img == True
     cnts = np.bincount(l.reshape(-1))
-    for i, cnt in enumerate(cnts):
-        if cnt < thresh:
-            l[l == i] = -1
-    img_[l == -1] = True
-    return img_
+    # (the label 0 is img itself)
+    return np.logical_or(img == True, (cnts < thresh)[l])
+
+
+def _dilate(img, selem):
+    """Binary dilation of img by the (symmetric) structuring element selem"""
+    return cv2.dilate(img.astype(np.uint8), selem.astype(np.uint8)) > 0
 
 
 def add_human_to_traversible(map, robot_base, robot_height, robot_radius,
@@ -85,11 +101,34 @@ def add_human_to_traversible(map, robot_base, robot_height, robot_radius,
     Update map.traversible to include the space occupied by the human(s)
     whose meshes are held in shapess.
     """
+    window, occupied, human_radius, human_xy_footprint_coordinates_n2 = \
+        compute_human_occupancy(map, robot_base, robot_height, robot_radius,
+                                valid_min, valid_max, num_point_threshold, shapess,
+                                sc=sc, n_samples_per_face=n_samples_per_face,
+                                human_xy_center_2=human_xy_center_2)
+    obstacle_free = np.ones((map.size[1], map.size[0]), dtype=bool)
+    obstacle_free[window] = np.logical_not(occupied)
 
-    # Compute the space occupied by the human only
-    num_obstcale_points = np.zeros((map.size[1], map.size[0]))
-    num_points = np.zeros((map.size[1], map.size[0]))
+    # Combine the occupancy information from the static map
+    # and the human
+    traversible = np.logical_and(map._traversible, obstacle_free)
 
+    map.traversible = traversible
+    map._human_traversible = obstacle_free * 1.
+    map._human_radius = human_radius
+    map.human_xy_footprint_coordinates_n2 = human_xy_footprint_coordinates_n2
+    return map
+
+
+def compute_human_occupancy(map, robot_base, robot_height, robot_radius,
+                            valid_min, valid_max, num_point_threshold, shapess, sc=100.,
+                            n_samples_per_face=200, human_xy_center_2=None):
+    """
+    Computes the space occupied by the human whose mesh is held in shapess
+    (expanded by the robot base) only within the human's bounding window
+    of the map. Returns the window (row and column slices), the occupied
+    patch of the map in that window, the human's radius and footprint.
+    """
     # One Shape
     assert(len(shapess) == 1)
     shapes = shapess[0]
@@ -102,16 +141,7 @@ def add_human_to_traversible(map, robot_base, robot_height, robot_radius,
         j, n_samples_per_face, sc)
     wt = face_areas[face_idx] / n_samples_per_face
 
-    ind = np.all(np.concatenate(
-        (p[:, [2]] > robot_base,
-         p[:, [2]] < robot_base + robot_height), axis=1), axis=1)
-    num_obstcale_points += _project_to_map(map, p[ind, :], wt[ind])
-
-    ind = np.all(np.concatenate(
-        (p[:, [2]] > valid_min,
-         p[:, [2]] < valid_max), axis=1), axis=1)
-    num_points += _project_to_map(map, p[ind, :], wt[ind])
-
+    ind = np.logical_and(p[:, 2] > valid_min, p[:, 2] < valid_max)
     # Compute the radius of the human footprint (without augmenting by the robot base)
     human_footprint_coordinates_n3 = p[ind, :] / sc
     human_xy_footprint_coordinates_n2 = (
@@ -119,60 +149,218 @@ def add_human_to_traversible(map, robot_base, robot_height, robot_radius,
     human_radius = np.linalg.norm(
         human_xy_footprint_coordinates_n2, axis=1).max()
 
-    # Expand the occupied space to account for the robot base
+    # Project the points occupied by the human onto its window of the map,
+    # padded so the expansion by the robot base fits in the window
     selem = morphology.disk(robot_radius / map.resolution)
+    margin = selem.shape[0] // 2 + 1
+    ind = np.logical_and(p[:, 2] > robot_base,
+                         p[:, 2] < robot_base + robot_height)
+    cells_n2 = np.round((p[ind, :2] - map.origin) /
+                        map.resolution).astype(np.int64)
+    wt = wt[ind]
+    in_map = np.all([cells_n2[:, 0] >= 0, cells_n2[:, 0] < map.size[0],
+                     cells_n2[:, 1] >= 0, cells_n2[:, 1] < map.size[1]], axis=0)
+    cells_n2, wt = cells_n2[in_map], wt[in_map]
+    if len(cells_n2) == 0:
+        return (slice(0, 0), slice(0, 0)), np.zeros((0, 0), dtype=bool), \
+            human_radius, human_xy_footprint_coordinates_n2
+    min_2 = np.maximum(cells_n2.min(axis=0) - margin, 0)
+    max_2 = np.minimum(cells_n2.max(axis=0) + margin + 1, map.size)
+    window = (slice(min_2[1], max_2[1]), slice(min_2[0], max_2[0]))
+    window_size_2 = max_2 - min_2
+    cells_n2 = cells_n2 - min_2
+    num_obstacle_points = np.bincount(cells_n2[:, 1] * window_size_2[0] + cells_n2[:, 0],
+                                      weights=wt, minlength=np.prod(window_size_2))
+    num_obstacle_points = num_obstacle_points.reshape(window_size_2[::-1])
+
+    # Fill the holes (that do not extend past the window, since the free
+    # space around the human is not a hole) and expand by the robot base
     thresh = create_building_params().building_thresh
-    obstacle_free = morphology.binary_dilation(
-        _fill_holes(num_obstcale_points > num_point_threshold, thresh), selem) != True
+    open_sides = [min_2[1] > 0, max_2[1] < map.size[1],
+                  min_2[0] > 0, max_2[0] < map.size[0]]
+    occupied = _dilate(
+        _fill_holes_in_window(num_obstacle_points > num_point_threshold,
+                              thresh, open_sides), selem)
+    return window, occupied, human_radius, human_xy_footprint_coordinates_n2
+
+
+def _fill_holes_in_window(img, thresh, open_sides):
+    """Same as _fill_holes for a window of a larger map where the holes
+    touching the open (top, bottom, left, right) sides of the window
+    continue outside of it, so they are never filled."""
+    l, n = scipy.ndimage.label(np.logical_not(img))
+    cnts = np.bincount(l.reshape(-1))
+    fill = cnts < thresh
+    fill[0] = False  # not a hole
+    for side, is_open in zip([l[0, :], l[-1, :], l[:, 0], l[:, -1]], open_sides):
+        if is_open:
+            fill[side] = False
+    return np.logical_or(img, fill[l])
 
-    # Combine the occupancy information from the static map
-    # and the human
-    traversible = np.stack([map._traversible, obstacle_free], axis=2)
-    traversible = np.all(traversible, axis=2)
 
-    map.traversible = traversible
-    map._human_traversible = obstacle_free * 1.
-    map._human_radius = human_radius
-    map.human_xy_footprint_coordinates_n2 = human_xy_footprint_coordinates_n2
-    return map
+class HumanOccupancy(object):
+    """
+    Reference counted occupancy of all the humans in a map. Every human
+    adds its occupied patch (see compute_human_occupancy) to the counts, so
+    adding, moving or removing a human only touches the human's window.
+    """
+
+    def __init__(self, traversible):
+        # the (static) traversible of the building
+        self.building_traversible = np.asarray(traversible, dtype=bool)
+        self.counts = np.zeros(self.building_traversible.shape, dtype=np.int32)
+        # the space not occupied by any human
+        self.human_traversible = np.ones(self.counts.shape, dtype=bool)
+        # the building traversible without the space occupied by humans
+        self.traversible = self.building_traversible.copy()
+        # (window, occupied) of every human indexed by name
+        self.patches = {}
+
+    def add(self, name, window, occupied):
+        """Adds (or moves) the human's occupied patch"""
+        if name in self.patches:
+            self.remove(name)
+        self.counts[window] += occupied
+        self.patches[name] = (window, occupied)
+        self._update(window)
+
+    def remove(self, name):
+        if name not in self.patches:
+            return
+        window, occupied = self.patches.pop(name)
+        self.counts[window] -= occupied
+        self._update(window)
+
+    def _update(self, window):
+        free = self.counts[window] == 0
+        self.human_traversible[window] = free
+        self.traversible[window] = np.logical_and(
+            self.building_traversible[window], free)
+
+
+def project_mesh_to_map(vertices, faces, map_origin, map_size, resolution,
+                        z_ranges, n_samples_per_face=200, chunk_size=10000, seed=0):
+    """
+    Samples n_samples_per_face points on every face of the mesh (the same
+    points as sample_points_on_faces with a RandomState(seed)) and returns,
+    for every (min, max) z range, the (area weighted) number of points in
+    that range projected onto each cell of the map. The faces are processed
+    chunk_size at a time so the points of the whole mesh are never in memory.
+    """
+    rng = np.random.RandomState(seed)
+    num_cells = int(map_size[0]) * int(map_size[1])
+    counts = [np.zeros(num_cells) for _ in z_ranges]
+    for start in range(0, faces.shape[0], chunk_size):
+        fs = faces[start:start + chunk_size]
+        v1 = vertices[fs[:, 0], :]
+        v2 = vertices[fs[:, 1], :]
+        v3 = vertices[fs[:, 2], :]
+        face_areas = 0.5 * np.sqrt(np.sum(np.cross(v1 - v3, v2 - v3)**2, 1))
+        wt = np.repeat(face_areas / n_samples_per_face, n_samples_per_face)
+
+        r = rng.rand(wt.size, 2)
+        r1 = r[:, :1]
+        r2 = r[:, 1:]
+        sqrt_r1 = np.sqrt(r1)
+        v1 = np.repeat(v1, n_samples_per_face, axis=0)
+        v2 = np.repeat(v2, n_samples_per_face, axis=0)
+        v3 = np.repeat(v3, n_samples_per_face, axis=0)
+        p = (1 - sqrt_r1) * v1 + sqrt_r1 * (1 - r2) * v2 + sqrt_r1 * r2 * v3
+
+        cells_n2 = np.round((p[:, :2] - map_origin) /
+                            resolution).astype(np.int64)
+        in_map = np.all([cells_n2[:, 0] >= 0, cells_n2[:, 0] < map_size[0],
+                         cells_n2[:, 1] >= 0, cells_n2[:, 1] < map_size[1]], axis=0)
+        cells_n = cells_n2[:, 1] * int(map_size[0]) + cells_n2[:, 0]
+        for (z_min, z_max), count in zip(z_ranges, counts):
+            ind = np.logical_and(in_map, np.logical_and(p[:, 2] > z_min,
+                                                        p[:, 2] < z_max))
+            count += np.bincount(cells_n[ind], weights=wt[ind],
+                                 minlength=num_cells)
+    return [count.reshape(int(map_size[1]), int(map_size[0]))
+            for count in counts]
+
+
+def _project_mesh_to_map_worker(args):
+    return project_mesh_to_map(*args)
+
+
+def project_shapes_to_map(map, shapess, z_ranges, sc=100., n_samples_per_face=200,
+                          num_workers=1):
+    """
+    Sum of project_mesh_to_map over every mesh of shapess, the meshes are
+    projected in a pool of num_workers processes (0 for one per cpu)
+    """
+    args = []
+    for shapes in shapess:
+        for mesh in shapes.meshes[:shapes.get_number_of_meshes()]:
+            args.append((mesh.vertices * sc, np.asarray(mesh.faces), map.origin,
+                         map.size, map.resolution, z_ranges, n_samples_per_face))
+    if num_workers <= 0:
+        num_workers = multiprocessing.cpu_count()
+    num_workers = min(num_workers, len(args))
+    if num_workers > 1:
+        with multiprocessing.Pool(num_workers) as pool:
+            mesh_counts = pool.map(_project_mesh_to_map_worker, args)
+    else:
+        mesh_counts = [project_mesh_to_map(*a) for a in args]
+    counts = [np.zeros((map.size[1], map.size[0])) for _ in z_ranges]
+    for mesh_count in mesh_counts:
+        for count, count_i in zip(counts, mesh_count):
+            count += count_i
+    return counts
 
 
 def compute_traversibility(map, robot_base, robot_height, robot_radius,
                            valid_min, valid_max, num_point_threshold, shapess, sc=100.,
-                           n_samples_per_face=200):
+                           n_samples_per_face=200, cache_key=None, num_workers=None):
     """Returns a bit map with pixels that are traversible or not as long as the
     robot center is inside this volume we are good colisions can be detected by
     doing a line search on things, or walking from current location to final
-    location in the bitmap, or doing bwlabel on the traversibility map."""
-    num_obstcale_points = np.zeros((map.size[1], map.size[0]))
-    num_points = np.zeros((map.size[1], map.size[0]))
-
-    for i, shapes in enumerate(shapess):
-        for j in range(shapes.get_number_of_meshes()):
-            p, face_areas, face_idx = shapes.sample_points_on_face_of_shape(
-                j, n_samples_per_face, sc)
-            wt = face_areas[face_idx] / n_samples_per_face
-
-            ind = np.all(np.concatenate(
-                (p[:, [2]] > robot_base,
-                 p[:, [2]] < robot_base + robot_height), axis=1), axis=1)
-            num_obstcale_points += _project_to_map(map, p[ind, :], wt[ind])
-
-            ind = np.all(np.concatenate(
-                (p[:, [2]] > valid_min,
-                 p[:, [2]] < valid_max), axis=1), axis=1)
-            num_points += _project_to_map(map, p[ind, :], wt[ind])
+    location in the bitmap, or doing bwlabel on the traversibility map.
+    The projected points are cached (in this process) by cache_key (which
+    identifies the building meshes, None to not cache them), the map, robot
+    base and height, so only the morphology is recomputed for a new robot
+    radius."""
+    p = create_building_params()
+    if num_workers is None:
+        num_workers = p.traversible_num_workers
+    counts_key = None
+    if cache_key is not None:
+        counts_key = (cache_key, tuple(map.origin), tuple(map.size),
+                      float(map.resolution), float(robot_base), float(robot_height),
+                      valid_min, valid_max, sc, n_samples_per_face)
+    if counts_key is not None and counts_key in point_counts_cache:
+        point_counts_cache.move_to_end(counts_key)
+        num_obstcale_points, num_points = point_counts_cache[counts_key]
+    else:
+        z_ranges = [(robot_base, robot_base + robot_height),
+                    (valid_min, valid_max)]
+        num_obstcale_points, num_points = project_shapes_to_map(
+            map, shapess, z_ranges, sc=sc, n_samples_per_face=n_samples_per_face,
+            num_workers=num_workers)
+        if counts_key is not None:
+            _cache(point_counts_cache, counts_key,
+                   _freeze(num_obstcale_points, num_points),
+                   p.traversible_cache_size)
 
-    selem = morphology.disk(robot_radius / map.resolution)
     # use _fill_holes to clean up the bitmap
     # NOTE: tune the threshold to clean up 'noise' in the .obj map
-    thresh = create_building_params().building_thresh
-    obstacle_free = morphology.binary_dilation(
-        _fill_holes(num_obstcale_points > num_point_threshold, thresh), selem) != True
-    valid_space = _fill_holes(num_points > num_point_threshold, thresh)
-    traversible = np.concatenate((obstacle_free[..., np.newaxis],
-                                  valid_space[..., np.newaxis]), axis=2)
-    traversible = np.all(traversible, axis=2)
+    thresh = p.building_thresh
+    traversible_key = (counts_key, float(robot_radius), num_point_threshold, thresh)
+    if counts_key is not None and traversible_key in traversible_cache:
+        traversible_cache.move_to_end(traversible_key)
+        obstacle_free, valid_space = traversible_cache[traversible_key]
+    else:
+        selem = morphology.disk(robot_radius / map.resolution)
+        obstacle_free = _dilate(
+            _fill_holes(num_obstcale_points > num_point_threshold, thresh), selem) != True
+        valid_space = _fill_holes(num_points > num_point_threshold, thresh)
+        print("%sComputing Traversible" % '\033[31m', '\033[0m')
+        if counts_key is not None:
+            _cache(traversible_cache, traversible_key,
+                   _freeze(obstacle_free, valid_space), p.traversible_cache_size)
+    traversible = np.logical_and(obstacle_free, valid_space)
 
     map_out = copy.deepcopy(map)
     map_out.num_obstcale_points = num_obstcale_points
@@ -182,10 +370,26 @@ def compute_traversibility(map, robot_base, robot_height, robot_radius,
     map_out._human_traversible = np.ones_like(traversible * 1.)
     map_out.obstacle_free = obstacle_free
     map_out.valid_space = valid_space
-    print("%sComputing Traversible" % '\033[31m', '\033[0m')
     return map_out
 
 
+def _cache(cache, key, value, cache_size):
+    """Adds the value to the (least recently used first) cache, evicting the
+    oldest entries beyond cache_size"""
+    if cache_size <= 0:
+        return
+    cache[key] = value
+    while len(cache) > cache_size:
+        cache.popitem(last=False)
+
+
+def _freeze(*arrays):
+    """Makes the (cached and shared) arrays read-only"""
+    for array in arrays:
+        array.flags.writeable = False
+    return arrays
+
+
 def resize_maps(map, map_scales, resize_method):
     scaled_maps = []
     for i, sc in enumerate(map_scales):
@@ -1,6 +1,7 @@
 from __future__ import print_function
 import numpy as np
 import sys
+from collections import OrderedDict
 from agents.humans.human_appearance import HumanAppearance
 if sys.version_info[0] == 2:
     from . import map_utils as mu
@@ -10,10 +11,19 @@ else:
 make_map = mu.make_map
 resize_maps = mu.resize_maps
 compute_traversibility = mu.compute_traversibility
-add_human_to_traversible = mu.add_human_to_traversible
+compute_human_occupancy = mu.compute_human_occupancy
 pick_largest_cc = mu.pick_largest_cc
 
 
+def get_texture_key(human_materials):
+    """Identifies the human's texture by its file name"""
+    material = human_materials[0]
+    if isinstance(material, tuple):
+        # loaded materials are (file_name, image)
+        return material[0]
+    return material
+
+
 class Building():
     def __init__(self, dataset, name, robot, env, flip=False):
         self.restrict_to_largest_cc = True
@@ -41,7 +51,7 @@ class Building():
         map = compute_traversibility(
             map, robot.base, robot.height, robot.radius, env.valid_min,
             env.valid_max, env.num_point_threshold, shapess=shapess, sc=100.,
-            n_samples_per_face=env.n_samples_per_face)
+            n_samples_per_face=env.n_samples_per_face, cache_key=(name, flip))
 
         self.env_paths = env_paths
         self.shapess = shapess
@@ -63,7 +73,13 @@ class Building():
 
         # Instance variable for storing human information and humans
         self.people = {}
-        self.ind_human_traversibles = {}
+        # the space occupied by the humans (updated one human at a time)
+        self.human_occupancy = mu.HumanOccupancy(self.map._traversible)
+        # (human mesh, renderer entity ids) of the humans in the scene
+        self.human_meshes_in_scene = {}
+        # canonical human meshes (by pose) of every human appearance and
+        # speed bin, least recently used first
+        self.human_mesh_cache = OrderedDict()
 
     def set_r_obj(self, r_obj):
         self.r_obj = r_obj
@@ -137,28 +153,79 @@ class Building():
         pos_3 = np.array([xy_offset_map[0], xy_offset_map[1], pos_3[2]])
         return pos_3
 
-    def load_human_into_scene(self, human, dedup_tbo=False, allow_repeat_humans=False):
+    def load_human_into_scene(self, human, dedup_tbo=False, allow_repeat_humans=False,
+                              human_mesh=None):
         """
         Load a 'gendered' human mesh with 'body shape' and texture, 'human_materials',
         into a building at 'pos_3' with 'speed' in the static building.
+        The human_mesh (see get_human_mesh) is sampled if it is not given.
         """
         # Add human to dictionary in building
-        dataset = HumanAppearance.dataset
-        human_appearance = human.get_appearance()
         current_config = human.get_current_config()
         self.people[human.get_name()] = human
         pos_3 = current_config.to_3D_numpy()
-        speed = current_config.speed_nk1()
+        identification = human.get_name()
+
+        # Get the (canonical) human mesh, only loaded from disk once
+        if human_mesh is None:
+            human_mesh = self.get_human_mesh(human)
+        shapess = human_mesh['shapess']
+
+        # Move the human to the desired location
+        pos_3 = self._traversible_world_to_vertex_world(pos_3)
+        shapess[0].meshes[0].vertices = self._transform_to_world(
+            human_mesh['ego_vertices'], pos_3)
+        shapess[0].meshes[0].name = human_mesh['name'] + identification
+        entity_ids = self.r_obj.load_shapes(
+            shapess, dedup_tbo, allow_repeat_humans=allow_repeat_humans)
+        # the cached mesh is shared by every human with the same key
+        shapess[0].meshes[0].name = human_mesh['name']
+        self.renderer_entitiy_ids += entity_ids
+        self.human_meshes_in_scene[identification] = (human_mesh, entity_ids)
+
+        # Update The Human Traversible
+        self._add_human_to_traversible(identification, shapess, pos_3)
+        self.human_ego_vertices = human_mesh['ego_vertices']
+
+    def get_human_mesh(self, human):
+        """
+        Returns the human's mesh (of a random pose at its current speed) in
+        the canonical position. The meshes are cached by the human's
+        appearance (gender, body shape and texture) and speed bin, which
+        repeat across updates, each with up to human_mesh_poses_per_bin poses
+        (the pose and frame are sampled on every call): once a human has
+        that many poses in the speed bin one of them is reused instead of
+        loading (and centering) the sampled pose from disk.
+        """
+        dataset = HumanAppearance.dataset
+        surreal_params = dataset.surreal_params
+        human_appearance = human.get_appearance()
+        speed = human.get_current_config().speed_nk1()
         gender = human_appearance.get_gender()
         human_materials = human_appearance.get_texture()
         body_shape = human_appearance.get_shape()
         rng = human_appearance.get_mesh_rng()
-        identification = human.get_name()
 
-        # Load the human mesh
-        shapess, center_pos_3, human_mesh_info = \
-            dataset.load_random_human(
-                speed, gender, human_materials, body_shape, rng)
+        # Sample the mesh (always, so the mesh rng is used the same way)
+        human_mesh_info = dataset.sample_human_mesh_info(
+            speed, gender, body_shape, rng)
+        key = (gender, body_shape, get_texture_key(human_materials),
+               dataset.get_velocity_dir(speed))
+        # the mesh_dir holds the speed bin, pose, body shape and gender
+        pose_key = (human_mesh_info['mesh_dir'], human_mesh_info['frame'])
+        human_meshes = self.human_mesh_cache.get(key, OrderedDict())
+        if key in self.human_mesh_cache:
+            self.human_mesh_cache.move_to_end(key)
+        if pose_key in human_meshes:
+            return human_meshes[pose_key]
+        poses_per_bin = surreal_params.human_mesh_poses_per_bin
+        if 0 < poses_per_bin <= len(human_meshes):
+            # reuse one of the (random) poses already loaded for this human
+            pose_keys = list(human_meshes.keys())
+            return human_meshes[pose_keys[rng.randint(len(pose_keys))]]
+
+        shapess, center_pos_3 = dataset.load_human_mesh(
+            human_materials=human_materials, **human_mesh_info)
 
         # Make sure the human's feet are actually on the ground in SBPD
         # (i.e. the minimum z coordinate is 0)
@@ -171,44 +238,71 @@ class Building():
         # Make sure the human is in the canonical position
         # The centerpoint between the left and right foot should be (0, 0)
         # and the heading (average of the direction of the two feet) should be 0
-        shapess[0].meshes[0].vertices = self._transform_to_ego(shapess[0].meshes[0].vertices,
-                                                               center_pos_3)
-        human_ego_vertices = shapess[0].meshes[0].vertices * 1.
-
-        # Move the human to the desired location
-        pos_3 = self._traversible_world_to_vertex_world(pos_3)
+        human_ego_vertices = self._transform_to_ego(shapess[0].meshes[0].vertices,
+                                                    center_pos_3)
+        human_mesh = {'shapess': shapess, 'ego_vertices': human_ego_vertices,
+                      'name': shapess[0].meshes[0].name,
+                      'velocity_dir': dataset.get_velocity_dir(speed)}
+        cache_size = surreal_params.human_mesh_cache_size
+        if cache_size > 0:
+            human_meshes[pose_key] = human_mesh
+            self.human_mesh_cache[key] = human_meshes
+            self.human_mesh_cache.move_to_end(key)
+            # keep at most cache_size meshes (of the most recently used humans)
+            while sum(len(meshes) for meshes in self.human_mesh_cache.values()) > cache_size:
+                oldest_meshes = next(iter(self.human_mesh_cache.values()))
+                if oldest_meshes is human_meshes:
+                    # (the only human in the cache)
+                    human_meshes.popitem(last=False)
+                else:
+                    self.human_mesh_cache.popitem(last=False)
+        return human_mesh
+
+    def move_human(self, human):
+        """
+        Moves an already loaded human to its current position by only
+        updating the vertices of its mesh (the geometry and texture are not
+        reloaded, so the human keeps the same pose)
+        """
+        identification = human.get_name()
+        self.people[identification] = human
+        human_mesh, entity_ids = self.human_meshes_in_scene[identification]
+        shapess = human_mesh['shapess']
+        pos_3 = self._traversible_world_to_vertex_world(
+            human.get_current_config().to_3D_numpy())
         shapess[0].meshes[0].vertices = self._transform_to_world(
-            shapess[0].meshes[0].vertices, pos_3)
-        shapess[0].meshes[0].name += identification
-        self.renderer_entitiy_ids += self.r_obj.load_shapes(
-            shapess, dedup_tbo, allow_repeat_humans=allow_repeat_humans)
+            human_mesh['ego_vertices'], pos_3)
+        for entity_id in entity_ids:
+            self.r_obj.update_entity_mesh(entity_id, shapess[0].meshes[0])
 
         # Update The Human Traversible
+        self._add_human_to_traversible(identification, shapess, pos_3)
+
+    def _add_human_to_traversible(self, identification, shapess, pos_3):
+        dataset = HumanAppearance.dataset
         if dataset.surreal_params.compute_human_traversible:
             map = self.map
             env = self.env
             robot = self.robot
-            map = add_human_to_traversible(
-                map, robot.base, robot.height, robot.radius, env.valid_min,
-                env.valid_max, env.num_point_threshold, shapess=shapess, sc=100.,
-                n_samples_per_face=env.n_samples_per_face, human_xy_center_2=pos_3[:2])
-
-            self.traversible = map.traversible
-            self.ind_human_traversibles[human.get_name()] = \
-                map._human_traversible
-            self.human_traversible = self.compute_human_traversible()
-            self.map = map
-        self.human_ego_vertices = (human_ego_vertices)
+            window, occupied, human_radius, human_xy_footprint_coordinates_n2 = \
+                compute_human_occupancy(
+                    map, robot.base, robot.height, robot.radius, env.valid_min,
+                    env.valid_max, env.num_point_threshold, shapess=shapess, sc=100.,
+                    n_samples_per_face=env.n_samples_per_face, human_xy_center_2=pos_3[:2])
+            # (also moves the human if it was already in the traversible)
+            self.human_occupancy.add(identification, window, occupied)
+            map._human_radius = human_radius
+            map.human_xy_footprint_coordinates_n2 = human_xy_footprint_coordinates_n2
+            self._update_traversibles()
+
+    def _update_traversibles(self):
+        self.map.traversible = self.human_occupancy.traversible
+        self.map._human_traversible = self.human_occupancy.human_traversible
+        self.traversible = self.map.traversible
+        self.human_traversible = self.human_occupancy.human_traversible
 
     def compute_human_traversible(self):
-        new_human_traversible = np.ones_like(self.map._traversible * 1.)
-        for ID, _ in list(self.people.items()):
-            if(ID in self.ind_human_traversibles):
-                new_human_traversible = \
-                    np.stack([new_human_traversible,
-                              self.ind_human_traversibles[ID]], axis=2)
-                new_human_traversible = np.all(new_human_traversible, axis=2)
-        return new_human_traversible
+        return self.human_occupancy.human_traversible
 
     def remove_human(self, name):
         """
@@ -230,28 +324,42 @@ class Building():
                 # only delete the one human, no need to keep traversing
                 break
 
-        # Update the traversible to be human free
-        self.map.traversible = self.map._traversible
-        self.traversible = self.map._traversible
-        self.ind_human_traversibles.pop(name)
-        self.human_traversible = self.compute_human_traversible()
+        # Free the space occupied by the human in the traversible
+        self.human_occupancy.remove(name)
+        self._update_traversibles()
 
         # Remove from dictionary
         self.people.pop(name)
+        self.human_meshes_in_scene.pop(name, None)
 
     def update_human(self, human):
         """
-        Removes the previously loaded human mesh,
-        and loads a new one with the same gender, texture
-        and body shape at the updated position and speed
+        Updates the human to its current position with a newly sampled pose
+        (see get_human_mesh), or the same pose while its speed bin is
+        unchanged unless reload_human_meshes. The loaded mesh is only moved
+        when the pose is unchanged, otherwise it is removed and the human
+        (with the same gender, texture and body shape) is loaded again.
         """
-        # Remove the previous human
-        if(human.get_name() in self.people.keys()):
-            self.remove_human(human.get_name())
+        dataset = HumanAppearance.dataset
+        name = human.get_name()
+        human_mesh = None
+        if name in self.people.keys():
+            previous_human_mesh, _ = self.human_meshes_in_scene[name]
+            if dataset.surreal_params.reload_human_meshes:
+                human_mesh = self.get_human_mesh(human)
+            else:
+                speed = human.get_current_config().speed_nk1()
+                if dataset.get_velocity_dir(speed) == previous_human_mesh['velocity_dir']:
+                    human_mesh = previous_human_mesh
+            if human_mesh is previous_human_mesh:
+                self.move_human(human)
+                return
+            # Remove the previous human
+            self.remove_human(name)
 
         # Load a new human with the updated speed and position
         # same human appearance
-        self.load_human_into_scene(human)
+        self.load_human_into_scene(human, human_mesh=human_mesh)
 
     def to_actual_xyt(self, pqr):
         """Converts from node array to location array on the map."""
@@ -274,40 +382,48 @@ class Building():
 
     def render_nodes(self, nodes, modality, perturb=None, aux_delta_theta=0., human_visible=True):
         # List of nodes to render.
+        imgs = self.render_nodes_batch(nodes, [modality], perturb=perturb,
+                                       aux_delta_theta=aux_delta_theta,
+                                       human_visible=human_visible)[modality]
+        return list(imgs)
+
+    def render_nodes_batch(self, nodes, modalities, perturb=None, aux_delta_theta=0., human_visible=True):
+        """Renders all the modalities from all the nodes in a single call to
+        the renderer. Returns the (n, h, w, c) images indexed by modality."""
         self.set_building_visibility(True)
         self.set_human_visibility(human_visible)
         if perturb is None:
             perturb = np.zeros((len(nodes), 4))
 
-        imgs = []
-        r = 2
-        elevation_z = r * \
-            np.tan(np.deg2rad(self.robot.camera_elevation_degree))
-
-        for i in range(len(nodes)):
-            xyt = self.to_actual_xyt(nodes[i][np.newaxis, :] * 1.)[0, :]
-            lookat_theta = 3.0 * np.pi / 2.0 - \
-                (xyt[2] + perturb[i, 2] + aux_delta_theta) * \
-                (self.robot.delta_theta)
-            nxy = np.array([xyt[0] + perturb[i, 0], xyt[1] +
-                            perturb[i, 1]]).reshape(1, -1)
-            nxy = nxy * self.map.resolution
-            nxy = nxy + self.map.origin
-            camera_xyz = np.zeros((1, 3))
-            camera_xyz[...] = [nxy[0, 0], nxy[0, 1], self.robot.sensor_height]
-            camera_xyz = camera_xyz / 100.
-            lookat_xyz = np.array([-r * np.sin(lookat_theta),
-                                   -r * np.cos(lookat_theta), elevation_z])
-            lookat_xyz = lookat_xyz + camera_xyz[0, :]
-            self.r_obj.position_camera(camera_xyz[0, :].tolist(), lookat_xyz.tolist(),
-                                       [0.0, 0.0, 1.0])
-            img = self.r_obj.render(
-                modality, take_screenshot=True, output_type=0)
-            img = [x for x in img if x is not None]
-            img = np.concatenate(img, axis=2).astype(np.float32)
-            if perturb[i, 3] > 0:
-                img = img[:, ::-1, :]
-            imgs.append(img)
+        view_matrices = [self.r_obj.get_view_matrix(*self.get_node_camera(
+            nodes[i], perturb[i], aux_delta_theta)) for i in range(len(nodes))]
+        imgs = self.r_obj.render_batch(modalities, view_matrices)
+        flip = perturb[:, 3] > 0
+        for modality in modalities:
+            img = imgs[modality].astype(np.float32)
+            img[flip] = img[flip, :, ::-1, :]
+            imgs[modality] = img
 
         self.set_building_visibility(False)
         return imgs
+
+    def get_node_camera(self, node, perturb_4, aux_delta_theta=0.):
+        """The camera position, look at point and up vector at a node"""
+        r = 2
+        elevation_z = r * \
+            np.tan(np.deg2rad(self.robot.camera_elevation_degree))
+        xyt = self.to_actual_xyt(node[np.newaxis, :] * 1.)[0, :]
+        lookat_theta = 3.0 * np.pi / 2.0 - \
+            (xyt[2] + perturb_4[2] + aux_delta_theta) * \
+            (self.robot.delta_theta)
+        nxy = np.array([xyt[0] + perturb_4[0], xyt[1] +
+                        perturb_4[1]]).reshape(1, -1)
+        nxy = nxy * self.map.resolution
+        nxy = nxy + self.map.origin
+        camera_xyz = np.zeros((1, 3))
+        camera_xyz[...] = [nxy[0, 0], nxy[0, 1], self.robot.sensor_height]
+        camera_xyz = camera_xyz / 100.
+        lookat_xyz = np.array([-r * np.sin(lookat_theta),
+                               -r * np.cos(lookat_theta), elevation_z])
+        lookat_xyz = lookat_xyz + camera_xyz[0, :]
+        return camera_xyz[0, :].tolist(), lookat_xyz.tolist(), [0.0, 0.0, 1.0]
@@ -444,7 +444,9 @@ class SwiftshaderRenderer():
     def _actual_render(self, mode):
         assert(mode in self.egl_program.keys())
         glUseProgram(self.egl_program[mode])
+        self._draw_entities()
 
+    def _draw_entities(self):
         for entity in self.entities.values():
             if entity['visible']:
                 vbo = entity['vbo']
@@ -472,62 +474,105 @@ class SwiftshaderRenderer():
 
         np_rgb_img = None
         np_d_img = None
-        c = 1000.
         if take_screenshot:
+            # Even though we dont want the alpha channel, opengl crashes if you
+            # dont read it. Bad OpenGL.
+            screenshot_rgba = np.zeros(
+                (self.height, self.width, 4), dtype=np.uint8)
+            glReadPixels(0, 0, self.width, self.height,
+                         GL_RGBA, GL_UNSIGNED_BYTE, screenshot_rgba)
             if modality == 'rgb':
-                # Even though we dont want the alpha channel, opengl crashes if you
-                # dont read it. Bad OpenGL.
-                screenshot_rgba = np.zeros(
-                    (self.height, self.width, 4), dtype=np.uint8)
-
-                glReadPixels(0, 0, self.width, self.height,
-                             GL_RGBA, GL_UNSIGNED_BYTE, screenshot_rgba)
-                np_rgb_img = screenshot_rgba[::-1, :, :3]
-
-                # Resize here if necessary.
-                if self.im_resize < 1.:
-                    np_rgb_img = cv2.resize(np_rgb_img, None, None, fx=self.im_resize,
-                                            fy=self.im_resize, interpolation=cv2.INTER_LINEAR)
-                elif self.im_resize > 1.:
-                    np_rgb_img = cv2.resize(np_rgb_img, None, None, fx=self.im_resize,
-                                            fy=self.im_resize, interpolation=cv2.INTER_AREA)
-
+                np_rgb_img = self._screenshots_to_rgb(screenshot_rgba)
             if modality == 'disparity':
-                screenshot_d = np.zeros(
-                    (self.height, self.width, 4), dtype=np.uint8)
-                glReadPixels(0, 0, self.width, self.height,
-                             GL_RGBA, GL_UNSIGNED_BYTE, screenshot_d)
-                np_d_img = screenshot_d[::-1, :, :3]
-                np_d_img = np_d_img[:, :, 2] * (255. * 255. / c) + np_d_img[:, :, 1] * (
-                    255. / c) + np_d_img[:, :, 0] * (1. / c)
-                np_d_img = np_d_img.astype(np.float32)
-                # np_d_img[np_d_img == 0] = np.NaN
-                np_d_img = np_d_img[:, :, np.newaxis]
-                d = np_d_img
-                d[d < 0.01] = np.NaN
-                isnan = np.isnan(d)
-                d = 100. / d
-                d[isnan] = 0.
-                d = np.concatenate((d, isnan), axis=2)
-                np_d_img = d
-
-                # Resize here if necessary.
-                if self.im_resize < 1.:
-                    np_d_img_0 = cv2.resize(np_d_img[..., 0], None, None,
-                                            fx=self.im_resize, fy=self.im_resize, interpolation=cv2.INTER_AREA)
-                elif self.im_resize > 1.:
-                    np_d_img_0 = cv2.resize(np_d_img[..., 0], None, None, fx=self.im_resize,
-                                            fy=self.im_resize, interpolation=cv2.INTER_AREA)
-                if self.im_resize != 1.:
-                    np_d_img_1 = cv2.resize(np_d_img[..., 1], None, None,
-                                            fx=self.im_resize, fy=self.im_resize,
-                                            interpolation=cv2.INTER_NEAREST)
-                    np_d_img = np.concatenate((np_d_img_0[:, :, np.newaxis],
-                                               np_d_img_1[:, :, np.newaxis]), axis=2)
+                np_d_img = self._screenshots_to_disparity(screenshot_rgba)
 
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         return np_rgb_img, np_d_img
 
+    def render_batch(self, modalities, view_matrices):
+        """
+        Renders every modality from every camera view (the flattened view
+        matrices of get_view_matrix). Each shader program is set up only once
+        per batch (only its view matrix changes between the views) and the
+        framebuffer is read back into a single preallocated buffer.
+        Returns a dictionary of the (n, h, w, c) images indexed by modality.
+        """
+        n = len(view_matrices)
+        imgs = {}
+        for modality in modalities:
+            assert(modality in self.egl_program.keys())
+            glUseProgram(self.egl_program[modality])
+            view_matrix_o = glGetUniformLocation(
+                self.egl_program[modality], 'uViewMatrix')
+            screenshots_nhw4 = np.zeros(
+                (n, self.height, self.width, 4), dtype=np.uint8)
+            with self.render_timer.record():
+                for i in range(n):
+                    glUniformMatrix4fv(view_matrix_o, 1,
+                                       GL_FALSE, view_matrices[i])
+                    self._draw_entities()
+                    glReadPixels(0, 0, self.width, self.height,
+                                 GL_RGBA, GL_UNSIGNED_BYTE, screenshots_nhw4[i])
+                    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            if modality == 'rgb':
+                imgs[modality] = self._screenshots_to_rgb(screenshots_nhw4)
+            elif modality == 'disparity':
+                imgs[modality] = self._screenshots_to_disparity(
+                    screenshots_nhw4)
+        # the programs' view matrices are now the one of the last view
+        if n > 0:
+            self.modelview_matrix = np.asarray(
+                view_matrices[-1]).astype(np.double)
+        return imgs
+
+    def _resize_screenshots(self, imgs, interpolation):
+        """Resizes the (..., h, w, c) images by im_resize"""
+        def resize(img):
+            return cv2.resize(np.ascontiguousarray(img), None, None, fx=self.im_resize,
+                              fy=self.im_resize, interpolation=interpolation)
+        if imgs.ndim == 3:
+            return resize(imgs)
+        return np.array([resize(img) for img in imgs])
+
+    def _screenshots_to_rgb(self, screenshots_rgba):
+        """Converts the (..., h, w, 4) rgba screenshots into rgb images"""
+        np_rgb_img = screenshots_rgba[..., ::-1, :, :3]
+
+        # Resize here if necessary.
+        if self.im_resize < 1.:
+            np_rgb_img = self._resize_screenshots(np_rgb_img, cv2.INTER_LINEAR)
+        elif self.im_resize > 1.:
+            np_rgb_img = self._resize_screenshots(np_rgb_img, cv2.INTER_AREA)
+        return np_rgb_img
+
+    def _screenshots_to_disparity(self, screenshots_d):
+        """Decodes the (..., h, w, 4) depth encoded screenshots into
+        (..., h, w, 2) disparity images (disparity, is invalid)"""
+        c = 1000.
+        np_d_img = screenshots_d[..., ::-1, :, :3]
+        np_d_img = np_d_img[..., 2] * (255. * 255. / c) + np_d_img[..., 1] * (
+            255. / c) + np_d_img[..., 0] * (1. / c)
+        np_d_img = np_d_img.astype(np.float32)
+        # np_d_img[np_d_img == 0] = np.NaN
+        np_d_img = np_d_img[..., np.newaxis]
+        d = np_d_img
+        d[d < 0.01] = np.nan
+        isnan = np.isnan(d)
+        d = 100. / d
+        d[isnan] = 0.
+        d = np.concatenate((d, isnan), axis=-1)
+        np_d_img = d
+
+        # Resize here if necessary.
+        if self.im_resize != 1.:
+            np_d_img_0 = self._resize_screenshots(
+                np_d_img[..., 0:1], cv2.INTER_AREA)
+            np_d_img_1 = self._resize_screenshots(
+                np_d_img[..., 1:2], cv2.INTER_NEAREST)
+            np_d_img = np.concatenate((np_d_img_0[..., np.newaxis],
+                                       np_d_img_1[..., np.newaxis]), axis=-1)
+        return np_d_img
+
     def _mesh_to_vvt(self, mesh):
         vvt = np.concatenate(
             (mesh.vertices, mesh.texturecoords[0, :, :2]), axis=1)
@@ -547,15 +592,23 @@ class SwiftshaderRenderer():
         assert(len(human_keys) <= 1)
 
         if len(human_keys) == 1:
-            # Get the Vertex Buffer Object Index for the Human (vbo)
-            vbo = self.entities[human_keys[0]]['vbo']
-
-            # Bind the new vertex, texture, and face data (vvt) to the old memory location
-            vvt, num = self._mesh_to_vvt(mesh)
-            glBindBuffer(GL_ARRAY_BUFFER, vbo)
-            glBufferData(GL_ARRAY_BUFFER, vvt.dtype.itemsize *
-                         vvt.size, vvt, GL_STATIC_DRAW)
-            assert(glGetError() == GL_NO_ERROR)
+            self.update_entity_mesh(human_keys[0], mesh)
+
+    def update_entity_mesh(self, entity_id, mesh):
+        """
+        Update the vertices (and faces) of an already loaded entity, its
+        texture is kept.
+        """
+        # Get the Vertex Buffer Object Index for the entity (vbo)
+        entity = self.entities[entity_id]
+
+        # Bind the new vertex, texture, and face data (vvt) to the old memory location
+        vvt, num = self._mesh_to_vvt(mesh)
+        glBindBuffer(GL_ARRAY_BUFFER, entity['vbo'])
+        glBufferData(GL_ARRAY_BUFFER, vvt.dtype.itemsize *
+                     vvt.size, vvt, GL_STATIC_DRAW)
+        assert(glGetError() == GL_NO_ERROR)
+        entity['num'] = num
 
     def _load_mesh_into_gl(self, mesh, material=None, tbo=None):
         vvt, num = self._mesh_to_vvt(mesh)
@@ -623,7 +676,9 @@ class SwiftshaderRenderer():
         for entity_id in entity_ids:
             self.entities[entity_id]['visible'] = visibility
 
-    def position_camera(self, camera_xyz, lookat_xyz, up):
+    def get_view_matrix(self, camera_xyz, lookat_xyz, up):
+        """The flattened view matrix of a camera at camera_xyz looking at
+        lookat_xyz (see position_camera)"""
         camera_xyz = np.array(camera_xyz)
         lookat_xyz = np.array(lookat_xyz)
         up = np.array(up)
@@ -650,7 +705,10 @@ class SwiftshaderRenderer():
         view_matrix = np.dot(flip_yz, view_matrix)
         view_matrix = view_matrix.T
         # print np.concatenate((R, t, view_matrix), axis=1)
-        view_matrix = np.reshape(view_matrix, (-1))
+        return np.reshape(view_matrix, (-1))
+
+    def position_camera(self, camera_xyz, lookat_xyz, up):
+        view_matrix = self.get_view_matrix(camera_xyz, lookat_xyz, up)
 
         if self.egl_program['rgb'] is not None:
             glUseProgram(self.egl_program['rgb'])
@@ -0,0 +1,123 @@
+"""Per-building preprocessed map bundle. Every array is stored as its own .npy
+file (next to the building's data.pkl) so it can be memory-mapped read-only
+and shared between the simulator, its agents, and the joystick process."""
+import hashlib
+import json
+import os
+import numpy as np
+
+bundle_dirname = 'map_bundle'
+metadata_filename = 'metadata.json'
+
+
+def get_map_bundle_dir(building_name: str, traversible_dir: str = None):
+    """Directory holding the map bundle for building_name"""
+    if traversible_dir is None:
+        from params.central_params import get_traversible_dir
+        traversible_dir = get_traversible_dir()
+    return os.path.join(traversible_dir, building_name, bundle_dirname)
+
+
+def load_bundle_metadata(bundle_dir: str):
+    """Returns the metadata dictionary of the bundle or None if missing"""
+    filename = os.path.join(bundle_dir, metadata_filename)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def get_source_filename(bundle_dir: str):
+    """The building's data.pkl that the bundle was generated next to"""
+    return os.path.join(os.path.dirname(bundle_dir), 'data.pkl')
+
+
+def get_source_stat(bundle_dir: str):
+    """Modification time (ns) and size of the building's data.pkl, None if
+    the building has no data.pkl"""
+    filename = get_source_filename(bundle_dir)
+    if not os.path.exists(filename):
+        return None
+    stat = os.stat(filename)
+    return [int(stat.st_mtime_ns), int(stat.st_size)]
+
+
+def get_traversible_digest(traversible: np.ndarray):
+    """Content hash of the traversible the bundle arrays are generated from"""
+    traversible = np.ascontiguousarray(np.asarray(traversible) > 0)
+    return hashlib.sha1(traversible.tobytes()).hexdigest() + \
+        str(traversible.shape)
+
+
+def save_bundle_metadata(bundle_dir: str, resolution: float,
+                         map_size_2: np.ndarray, map_origin_2: np.ndarray,
+                         traversible: np.ndarray):
+    """Writes the resolution (cm), map size, origin and traversible digest
+    that the bundle arrays were generated with, along with the current
+    mtime/size of the source data.pkl. Returns True if this invalidated the
+    (now removed) stale arrays of the bundle."""
+    old_metadata = load_bundle_metadata(bundle_dir)
+    metadata = {'resolution': float(resolution),
+                'map_size_2': [int(x) for x in map_size_2],
+                'map_origin_2': [float(x) for x in map_origin_2],
+                'traversible_digest': get_traversible_digest(traversible),
+                'source_stat': get_source_stat(bundle_dir)}
+    if old_metadata == metadata:
+        return False
+    os.makedirs(bundle_dir, exist_ok=True)
+    stale = not bundle_matches(bundle_dir, resolution, map_size_2, traversible)
+    if stale:
+        for filename in os.listdir(bundle_dir):
+            if filename.endswith('.npy'):
+                os.remove(os.path.join(bundle_dir, filename))
+    # (only the source stat changed, e.g. data.pkl was rewritten with the
+    # same traversible, the arrays are still valid)
+    _atomic_write(os.path.join(bundle_dir, metadata_filename),
+                  lambda f: f.write(json.dumps(metadata).encode('utf-8')))
+    return stale
+
+
+def bundle_matches(bundle_dir: str, resolution: float, map_size_2: np.ndarray,
+                   traversible: np.ndarray):
+    """Whether the bundle was generated for this resolution, map size and
+    traversible"""
+    metadata = load_bundle_metadata(bundle_dir)
+    if metadata is None:
+        return False
+    return np.isclose(metadata['resolution'], resolution) and \
+        list(metadata['map_size_2']) == [int(x) for x in map_size_2] and \
+        metadata.get('traversible_digest') == get_traversible_digest(traversible)
+
+
+def source_matches(bundle_dir: str, metadata: dict = None):
+    """Whether the building's data.pkl is unchanged since the bundle was
+    generated, i.e. the bundled traversible can be trusted without reading it"""
+    if metadata is None:
+        metadata = load_bundle_metadata(bundle_dir)
+    if metadata is None or 'source_stat' not in metadata:
+        return False
+    return metadata['source_stat'] == get_source_stat(bundle_dir)
+
+
+def load_bundle_array(bundle_dir: str, name: str):
+    """Memory-maps (read-only) the array called name, None if not in the bundle"""
+    filename = os.path.join(bundle_dir, name + '.npy')
+    if not os.path.exists(filename):
+        return None
+    return np.load(filename, mmap_mode='r')
+
+
+def save_bundle_array(bundle_dir: str, name: str, array: np.ndarray):
+    """Saves the array called name into the bundle"""
+    os.makedirs(bundle_dir, exist_ok=True)
+    _atomic_write(os.path.join(bundle_dir, name + '.npy'),
+                  lambda f: np.save(f, np.ascontiguousarray(array)))
+
+
+def _atomic_write(filename: str, write_fn):
+    # write to a temporary file first so concurrent readers (other
+    # processes) never see a partially written file
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_filename, 'wb') as f:
+        write_fn(f)
+    os.replace(tmp_filename, filename)
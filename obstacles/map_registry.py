@@ -0,0 +1,169 @@
+"""Process-wide registry of obstacle maps. Obstacle maps never change during
+an episode, so a single (read-only) instance is handed out to the simulator,
+every agent, and (through shared memory) the joystick process."""
+import atexit
+import hashlib
+import json
+import numpy as np
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from utils.fmm_map import FmmMap
+
+# maps indexed by (building, traversible digest, resolution, obstacle distance
+# backend) from the least to the most recently used
+obstacle_maps = OrderedDict()
+# shared memory blocks exported (and owned) by this process
+exported_blocks = {}
+# shared memory blocks attached to (owned by another process)
+attached_blocks = []
+
+# arrays that fully describe an obstacle map
+shared_array_names = ['occupancy_grid_map', 'free_xy_map_m2',
+                      'obstacle_dist', 'obstacle_angle']
+
+
+def get_map_key(p, res: float, map_trav: np.ndarray, building_name: str = None):
+    # identify the map by its traversible (independent of its dtype) so a
+    # building whose traversible changed does not get the stale map
+    trav = np.asarray(map_trav) > 0
+    trav_digest = hashlib.sha1(np.packbits(trav).tobytes()).hexdigest() + \
+        str(trav.shape)
+    return (building_name, trav_digest, float(res),
+            p.get('obstacle_dist_backend', 'fmm'))
+
+
+def get_obstacle_map(p, renderer=None, res: float = None,
+                     map_trav: np.ndarray = None, building_name: str = None):
+    """Returns the shared obstacle map for this building, constructing it
+    (with p.obstacle_map) only the first time it is requested. Only the
+    p.max_cached_maps most recently used maps are kept."""
+    key = get_map_key(p, res, map_trav, building_name)
+    if key in obstacle_maps:
+        obstacle_maps.move_to_end(key)
+        return obstacle_maps[key]
+    obstacle_map = p.obstacle_map(p, renderer, res=res, map_trav=map_trav,
+                                  building_name=building_name)
+    freeze_obstacle_map(obstacle_map)
+    obstacle_maps[key] = obstacle_map
+    while len(obstacle_maps) > max(1, p.get('max_cached_maps', 2)):
+        _, evicted_map = obstacle_maps.popitem(last=False)
+        release_obstacle_map(evicted_map)
+    return obstacle_map
+
+
+def release_obstacle_map(obstacle_map):
+    """Removes the obstacle map from the registry and unlinks its exported
+    shared memory (processes already attached to it keep their mapping)"""
+    for key in [k for k, m in obstacle_maps.items() if m is obstacle_map]:
+        del obstacle_maps[key]
+    _, blocks = exported_blocks.pop(id(obstacle_map), (None, []))
+    for shm in blocks:
+        _close_block(shm)
+        shm.unlink()
+
+
+def freeze_obstacle_map(obstacle_map):
+    """Makes the arrays of the obstacle map read-only since it is shared"""
+    for array in _get_map_arrays(obstacle_map).values():
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+
+
+def _get_map_arrays(obstacle_map):
+    fmm_map = obstacle_map.fmm_map
+    return {'occupancy_grid_map': obstacle_map.occupancy_grid_map,
+            'free_xy_map_m2': obstacle_map.free_xy_map_m2,
+            'obstacle_dist': fmm_map.fmm_distance_map.voxel_function_mn,
+            'obstacle_angle': fmm_map.fmm_angle_map.voxel_function_mn}
+
+
+def export_to_shared_memory(obstacle_map):
+    """Copies the arrays of the obstacle map into shared memory (once per map)
+    and returns a json-serializable descriptor that another process can use
+    to attach to them with attach_from_shared_memory"""
+    map_id = id(obstacle_map)
+    if map_id in exported_blocks:
+        return exported_blocks[map_id][0]
+    descriptor = {'dx': float(obstacle_map.get_dx()),
+                  'map_origin_2': [float(x) for x in obstacle_map.get_map_origin_2()],
+                  'building_name': obstacle_map.building_name,
+                  'arrays': {}}
+    blocks = []
+    for name, array in _get_map_arrays(obstacle_map).items():
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(1, array.nbytes))
+        shm_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        shm_array[:] = array
+        blocks.append(shm)
+        descriptor['arrays'][name] = {'shm_name': shm.name,
+                                      'shape': list(array.shape),
+                                      'dtype': array.dtype.str}
+    exported_blocks[map_id] = (descriptor, blocks)
+    return descriptor
+
+
+def attach_from_shared_memory(p, descriptor):
+    """Constructs an obstacle map (of type p.obstacle_map) around the shared
+    arrays exported by another process, without recomputing anything"""
+    if isinstance(descriptor, str):
+        # descriptors are sent to the joystick as json strings
+        descriptor = json.loads(descriptor)
+    arrays = {}
+    for name in shared_array_names:
+        info = descriptor['arrays'][name]
+        shm = _attach_block(info['shm_name'])
+        # NOTE: keep the block open for as long as the arrays are used
+        attached_blocks.append(shm)
+        array = np.ndarray(tuple(info['shape']), dtype=np.dtype(info['dtype']),
+                           buffer=shm.buf)
+        array.flags.writeable = False
+        arrays[name] = array
+    p.dx = descriptor['dx']
+    p.map_origin_2 = descriptor['map_origin_2']
+    fmm_map = FmmMap.create_fmm_map_from_precomputed(
+        fmm_distance_mn=arrays['obstacle_dist'],
+        fmm_angle_mn=arrays['obstacle_angle'],
+        dx=p.dx,
+        map_origin_2=p.map_origin_2,
+        backend=p.get('obstacle_dist_backend', 'fmm'))
+    return p.obstacle_map.from_precomputed(p, arrays['occupancy_grid_map'],
+                                           arrays['free_xy_map_m2'], fmm_map,
+                                           building_name=descriptor['building_name'])
+
+
+def _attach_block(shm_name: str):
+    try:
+        # the exporting process is responsible for unlinking the block
+        return shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:  # python < 3.13 does not have the track argument
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=shm_name)
+        exported_names = [b.name for _, blocks in exported_blocks.values()
+                          for b in blocks]
+        if shm.name not in exported_names:
+            # otherwise the resource tracker unlinks the block when this process exits
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _close_block(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # arrays still reference the block, it is freed on process exit
+        pass
+
+
+def release_shared_memory():
+    """Closes all the attached blocks and unlinks the exported ones"""
+    while attached_blocks:
+        _close_block(attached_blocks.pop())
+    for _, blocks in exported_blocks.values():
+        for shm in blocks:
+            _close_block(shm)
+            shm.unlink()
+    exported_blocks.clear()
+
+
+atexit.register(release_shared_memory)
@@ -18,6 +18,13 @@ class ObstacleMap(object):
         """
         raise NotImplementedError
 
+    def get_obstacle_dist_backend(self):
+        """
+        Return the backend used to compute the distance to the
+        nearest obstacle, either 'fmm' or 'edt'.
+        """
+        raise NotImplementedError
+
     def create_occupancy_grid_for_map(self, xs_nn, ys_nn):
         """
         Return an occupancy grid for the entire obstacle map where
@@ -1,13 +1,14 @@
 from obstacles.obstacle_map import ObstacleMap
 import numpy as np
 from utils.fmm_map import FmmMap
+from obstacles import map_bundle as mb
 from systems.dubins_car import DubinsCar
 
 
 class SBPDMap(ObstacleMap):
     name = 'SBPDMap'
 
-    def __init__(self, params, renderer=None, res=None, map_trav=None):
+    def __init__(self, params, renderer=None, res=None, map_trav=None, building_name=None):
         """
         Initialize a map for Stanford Building Parser Dataset (SBPD)
         """
@@ -17,10 +18,36 @@ class SBPDMap(ObstacleMap):
             self._r = SBPDRenderer.get_renderer(self.p.base_params)
         else:
             self._r = renderer
+        self.building_name = building_name
+        # preprocessed (memory-mapped) map data for this building, if enabled
+        self.bundle_dir = None
+        if self.p.get('use_map_bundle', False) and building_name is not None:
+            self.bundle_dir = mb.get_map_bundle_dir(building_name,
+                                                    self.p.get('traversible_dir', None))
         self._initialize_occupancy_grid_for_map(
             resolution=res, traversible=map_trav)
         self._initialize_fmm_map()
 
+    @classmethod
+    def from_precomputed(cls, params, occupancy_grid_map, free_xy_map_m2, fmm_map,
+                         building_name=None, renderer=0):
+        """
+        Construct a map around already computed (i.e. shared) arrays
+        without recomputing the occupancy grid or obstacle distances.
+        """
+        obstacle_map = cls.__new__(cls)
+        obstacle_map.p = params
+        obstacle_map._r = renderer
+        obstacle_map.building_name = building_name
+        obstacle_map.bundle_dir = None
+        params.map_size_2 = np.array(occupancy_grid_map.shape[::-1])
+        obstacle_map.map_bounds = np.array([[0., 0.],
+                                            params.map_size_2 * params.dx])
+        obstacle_map.free_xy_map_m2 = free_xy_map_m2
+        obstacle_map.occupancy_grid_map = occupancy_grid_map
+        obstacle_map.fmm_map = fmm_map
+        return obstacle_map
+
     def get_map_size_2(self):
         return self.p.map_size_2
 
@@ -46,27 +73,85 @@ class SBPDMap(ObstacleMap):
         # [[min_x, min_y], [max_x, max_y]]
         self.map_bounds = np.array([[0., 0.], self.p.map_size_2 * self.p.dx])
 
-        free_xy = np.array(np.where(traversible)).T
-        self.free_xy_map_m2 = free_xy[:, ::-1]
+        self.free_xy_map_m2 = None
+        if self.bundle_dir is not None:
+            stale = mb.save_bundle_metadata(self.bundle_dir, resolution,
+                                            self.p.map_size_2,
+                                            self.p.map_origin_2, traversible)
+            if stale or mb.load_bundle_array(self.bundle_dir, 'traversible') is None:
+                # (re)generate the bundle for this traversible and resolution
+                mb.save_bundle_array(self.bundle_dir, 'traversible',
+                                     np.asarray(traversible) > 0)
+            self.free_xy_map_m2 = mb.load_bundle_array(self.bundle_dir,
+                                                       'free_xy_map_m2')
+        if self.free_xy_map_m2 is None:
+            free_xy = np.array(np.where(traversible)).T
+            self.free_xy_map_m2 = free_xy[:, ::-1]
+            if self.bundle_dir is not None:
+                mb.save_bundle_array(self.bundle_dir, 'free_xy_map_m2',
+                                     self.free_xy_map_m2)
         # Swap the traversible to have 1's where the building is traversable
         self.occupancy_grid_map = np.logical_not(traversible) * 1.
 
+    def get_obstacle_dist_backend(self):
+        # the original (and default) backend is the fast marching method
+        return self.p.get('obstacle_dist_backend', 'fmm')
+
     def _initialize_fmm_map(self):
         """
         Initialize an FMM Map where 0 level set encodes the obstacle
-        positions.
+        positions. With the 'edt' backend the distances are computed with
+        an exact euclidean distance transform of the occupancy grid.
+        (The maps are shared per building, resolution and backend through
+        obstacles.map_registry.)
         """
         p = self.p
-        occupied_xy_m2 = np.array(np.where(self.occupancy_grid_map)).T
-        # Reverse the shape as indexing into the traverible is reversed ([y, x] indexing)
-        occupied_xy_m2 = occupied_xy_m2[:, ::-1]
-        occupied_xy_m2_world = self._map_to_point(occupied_xy_m2)
-        self.fmm_map = FmmMap.create_fmm_map_based_on_goal_position(
-            goal_positions_n2=occupied_xy_m2_world,
-            map_size_2=p.map_size_2,
-            dx=p.dx,
-            map_origin_2=p.map_origin_2,
-            mask_grid_mn=None)
+        backend = self.get_obstacle_dist_backend()
+        if self._load_fmm_map_from_bundle(backend):
+            return
+        if backend == 'edt':
+            # obstacles are the subzero level set
+            goal_grid_mn = np.where(self.occupancy_grid_map, -1., 1.)
+            self.fmm_map = FmmMap(goal_grid_mn=goal_grid_mn,
+                                  dx=p.dx,
+                                  map_origin_2=p.map_origin_2,
+                                  mask_grid_mn=None,
+                                  backend='edt')
+        else:
+            occupied_xy_m2 = np.array(np.where(self.occupancy_grid_map)).T
+            # Reverse the shape as indexing into the traverible is reversed ([y, x] indexing)
+            occupied_xy_m2 = occupied_xy_m2[:, ::-1]
+            occupied_xy_m2_world = self._map_to_point(occupied_xy_m2)
+            self.fmm_map = FmmMap.create_fmm_map_based_on_goal_position(
+                goal_positions_n2=occupied_xy_m2_world,
+                map_size_2=p.map_size_2,
+                dx=p.dx,
+                map_origin_2=p.map_origin_2,
+                mask_grid_mn=None)
+        if self.bundle_dir is not None:
+            mb.save_bundle_array(self.bundle_dir, 'obstacle_dist_' + backend,
+                                 self.fmm_map.fmm_distance_map.voxel_function_mn)
+            mb.save_bundle_array(self.bundle_dir, 'obstacle_angle_' + backend,
+                                 self.fmm_map.fmm_angle_map.voxel_function_mn)
+
+    def _load_fmm_map_from_bundle(self, backend):
+        """
+        Load the (read-only) obstacle distance and angle fields from the
+        map bundle. Returns False if they have not been generated yet.
+        """
+        if self.bundle_dir is None:
+            return False
+        dist_mn = mb.load_bundle_array(self.bundle_dir, 'obstacle_dist_' + backend)
+        angle_mn = mb.load_bundle_array(self.bundle_dir, 'obstacle_angle_' + backend)
+        if dist_mn is None or angle_mn is None:
+            return False
+        self.fmm_map = FmmMap.create_fmm_map_from_precomputed(
+            fmm_distance_mn=dist_mn,
+            fmm_angle_mn=angle_mn,
+            dx=self.p.dx,
+            map_origin_2=self.p.map_origin_2,
+            backend=backend)
+        return True
 
     def dist_to_nearest_obs(self, pos_nk2):
         """
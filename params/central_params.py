@@ -2,6 +2,7 @@ import configparser
 from dotmap import DotMap
 import numpy as np
 import os
+from params.frozen_params import freeze_params
 
 # first thing to do is create a config parser
 cwd = os.getcwd()
@@ -24,6 +25,9 @@ episodes_config.read(os.path.join(cwd, 'params/episode_params_val.ini'))
 dataset_config = configparser.ConfigParser()
 dataset_config.read(os.path.join(cwd, 'params/dataset_params.ini'))
 
+# the frozen params snapshots (see get_agent_params) indexed by their arguments
+frozen_params = {}
+
 
 def create_socnav_params():
     p = DotMap()
@@ -48,7 +52,13 @@ def create_socnav_params():
                    compute_human_traversible=surr_p.getboolean(
                        'compute_human_traversible'),
                    render_humans_in_gray_only=surr_p.getboolean(
-                       'render_humans_in_gray_only')
+                       'render_humans_in_gray_only'),
+                   human_mesh_cache_size=surr_p.getint(
+                       'human_mesh_cache_size', 64),
+                   human_mesh_poses_per_bin=surr_p.getint(
+                       'human_mesh_poses_per_bin', 4),
+                   reload_human_meshes=surr_p.getboolean(
+                       'reload_human_meshes', True)
                    )
     p.camera_params = create_camera_params()
     p.building_params = create_building_params(p.render_3D)
@@ -85,6 +95,8 @@ def create_joystick_params():
     p.use_random_planner = joystick_p.getboolean('use_random_planner')
     p.episode_horizon_s = joystick_p.getint('episode_horizon')
     p.control_horizon_s = joystick_p.getfloat('control_horizon_s')
+    p.replan_interval = joystick_p.getint('replan_interval', fallback=1)
+    p.replan_clearance = joystick_p.getfloat('replan_clearance', fallback=0.5)
     p.track_vel_accel = joystick_p.getboolean('track_vel_accel')
     p.print_data = joystick_p.getboolean('print_data')
     p.track_sim_states = joystick_p.getboolean('track_sim_states')
@@ -158,6 +170,32 @@ def create_planner_params():
     from planners.sampling_planner import SamplingPlanner
     # Default of a planner
     p.planner = SamplingPlanner
+
+    planner_p = user_config['planner_params']
+    # Plan online (without the precomputed control pipeline)
+    if planner_p.getboolean('online_planning', fallback=False):
+        from control_pipelines.control_pipeline_online import ControlPipelineOnline
+        p.control_pipeline_params.pipeline = ControlPipelineOnline
+        p.control_pipeline_params.online_params = \
+            DotMap(latency_budget_s=planner_p.getfloat('online_latency_budget'),
+                   min_waypoints=planner_p.getint('online_min_waypoints'),
+                   max_waypoints=planner_p.getint('online_max_waypoints'))
+        # Sample the waypoints around the direction of the goal in free space
+        if planner_p.getboolean('goal_directed_waypoints', fallback=False):
+            from waypoint_grids.goal_directed_grid import GoalDirectedGrid
+            p.control_pipeline_params.waypoint_params.grid = GoalDirectedGrid
+
+    # Reuse the previous plan (see SamplingPlanner)
+    p.warm_start_params = DotMap(
+        enabled=planner_p.getboolean('warm_start', fallback=False),
+        # Radius (in meters) of the neighborhood of the previous optimal
+        # waypoint which is evaluated first
+        neighborhood_radius=planner_p.getfloat('warm_start_radius', fallback=0.5),
+        # Relative increase of the cost of the previous optimum above which
+        # all the waypoints are evaluated
+        cost_tolerance=planner_p.getfloat('warm_start_tolerance', fallback=0.1),
+        # All the waypoints are evaluated at least every so many plans
+        full_replan_interval=planner_p.getint('warm_start_full_interval', fallback=10))
     return p
 
 
@@ -175,6 +213,26 @@ def create_waypoint_params():
     p.bound_min = eval(wayp_p.get('bound_min'))
     p.bound_max = eval(wayp_p.get('bound_max'))
 
+    # Parameters for the goal directed grid (see GoalDirectedGrid)
+    p.goal_directed_params = DotMap(
+        # Fixed number of waypoints (candidates) of every plan
+        num_waypoints=wayp_p.getint('num_goal_directed_waypoints', fallback=500),
+        # Spread of the waypoint directions (1 is the free cone) and headings
+        direction_std=0.4,
+        heading_std=np.deg2rad(30.),
+        # Maximum half-width of the free cone (in radians)
+        max_cone=np.deg2rad(90.),
+        # Range of distances of the waypoints (in meters)
+        min_distance=0.3,
+        max_distance=p.bound_max[0],
+        # The free space is measured along num_rays rays (every ray_step
+        # meters) up to obstacle_margin meters from the obstacles
+        num_rays=72,
+        ray_step=0.1,
+        obstacle_margin=0.3,
+        angular_speed_max=eval(user_config['dynamics_params'].get('w_bounds'))[1],
+        seed=seed)
+
     camera_params = create_camera_params()
     robot_params = create_robot_params().physical_params
 
@@ -259,7 +317,9 @@ def create_control_pipeline_params():
     p.spline_params = \
         DotMap(spline=Spline3rdOrder,
                max_final_time=cp_p.getfloat('max_final_time'),
-               epsilon=1e-5)
+               epsilon=1e-5,
+               dtype=np.float32 if cp_p.getboolean('single_precision_splines', fallback=False)
+               else np.float64)
     p.minimum_spline_horizon = cp_p.getfloat('minimum_spline_horizon')
 
     # LQR setting parameters
@@ -319,8 +379,28 @@ def create_simulator_params(verbose=True):
             print("%sRender mode: Schematic view (TOPVIEW only)%s" %
                   (color_blue, color_reset))
     p.verbose_printing = sim_p.getboolean('verbose_printing')
-    p.clear_files = sim_p.getboolean('clear_files')
+    p.video_format = sim_p.get('video_format', 'gif')
+    assert(p.video_format in ['gif', 'mp4'])
     p.record_video = sim_p.getboolean('record_video')
+    p.keep_sim_history = sim_p.getboolean('keep_sim_history', True)
+    # without the history only the online metrics can be scored (with it the
+    # same metrics are computed from the history after the episode)
+    p.online_metrics = sim_p.getboolean('online_metrics', False) or \
+        not p.keep_sim_history
+    p.record_episode = sim_p.getboolean('record_episode', False)
+    return p
+
+
+def create_render_params():
+    """The simulator params needed to render recorded episodes (which, unlike
+    create_simulator_params, do not need the datasets)"""
+    p = DotMap()
+    sim_p = user_config['simulator_params']
+    p.img_scale = sim_p.getfloat('img_scale')
+    p.fps_scale_down = max(0.0, min(1.0, sim_p.getfloat('fps_scale_down')))
+    p.verbose_printing = sim_p.getboolean('verbose_printing')
+    p.video_format = sim_p.get('video_format', 'gif')
+    assert(p.video_format in ['gif', 'mp4'])
     return p
 
 
@@ -341,6 +421,10 @@ def create_agent_params(with_planner=False, with_obstacle_map=False):
     if with_planner:
         p.episode_horizon_s = agent_p.getfloat('episode_horizon')
         p.control_horizon_s = agent_p.getfloat('control_horizon_s')
+        # Number of updates between plans, the agent replans right away when
+        # another agent is closer than replan_clearance (or its goal changes)
+        p.replan_interval = agent_p.getint('replan_interval', fallback=1)
+        p.replan_clearance = agent_p.getfloat('replan_clearance', fallback=0.5)
 
         # Load the dependencies
         p.planner_params = create_planner_params()
@@ -396,6 +480,25 @@ def create_agent_params(with_planner=False, with_obstacle_map=False):
     return p
 
 
+def get_agent_params(with_planner=False, with_obstacle_map=False, with_robot=False):
+    """
+    The frozen snapshot of create_agent_params (and of create_robot_params if
+    with_robot), built once per process and shared by all the agents. The
+    planner params (and its control pipeline and waypoint grid params) are
+    parsed before they are frozen.
+    """
+    key = ('agent_params', with_planner, with_obstacle_map, with_robot)
+    if key not in frozen_params:
+        p = create_agent_params(with_planner=with_planner,
+                                with_obstacle_map=with_obstacle_map)
+        if with_planner:
+            p.planner_params.planner.parse_params(p.planner_params)
+        if with_robot:
+            p.robot_params = create_robot_params()
+        frozen_params[key] = freeze_params(p)
+    return frozen_params[key]
+
+
 def create_obstacle_map_params():
     p = DotMap()
 
@@ -421,6 +524,19 @@ def create_obstacle_map_params():
 
     # Number of grid steps around the start position to use for plotting
     p.plotting_grid_steps = obst_p.getint('plotting_grid_steps')
+
+    # Backend for computing the distance to the nearest obstacle (fmm or edt)
+    p.obstacle_dist_backend = obst_p.get('obstacle_dist_backend')
+    assert(p.obstacle_dist_backend in ['fmm', 'edt'])
+
+    # Load/save preprocessed maps from the building's map bundle
+    p.use_map_bundle = obst_p.getboolean('use_map_bundle')
+
+    # Export the obstacle map to the joystick through shared memory
+    p.share_with_joystick = obst_p.getboolean('share_with_joystick')
+
+    # Number of (most recently used) obstacle maps kept in the map registry
+    p.max_cached_maps = obst_p.getint('max_cached_maps', fallback=2)
     return p
 
 
@@ -466,6 +582,10 @@ def create_building_params(full_render: bool = False):
         p.load_meshes = build_p2.getboolean('load_meshes')
     p.load_traversible_from_pickle_file = \
         build_p2.getboolean('load_traversible')
+    p.traversible_num_workers = \
+        build_p2.getint('traversible_num_workers', fallback=1)
+    p.traversible_cache_size = \
+        build_p2.getint('traversible_cache_size', fallback=4)
     p.flip = False
     return p
 
@@ -0,0 +1,92 @@
+import numpy as np
+
+"""
+Read-only snapshots of the (DotMap) params. The snapshot of a set of params is
+built once per process (see central_params.get_agent_params) and shared by
+every agent without copying it, and its fields are plain attributes which are
+much faster to look up than the ones of a DotMap.
+"""
+
+
+class FrozenParams(object):
+    """An immutable DotMap, only the getters of a DotMap are supported"""
+
+    def __init__(self, fields: dict):
+        # (writing to __dict__ directly skips __setattr__)
+        self.__dict__.update(fields)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Params are frozen, unable to set %s" % name)
+
+    def __delattr__(self, name):
+        raise AttributeError("Params are frozen, unable to delete %s" % name)
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def __contains__(self, key):
+        return key in self.__dict__
+
+    def __iter__(self):
+        return iter(self.__dict__)
+
+    def __len__(self):
+        return len(self.__dict__)
+
+    def get(self, key, default=None):
+        return self.__dict__.get(key, default)
+
+    def keys(self):
+        return self.__dict__.keys()
+
+    def values(self):
+        return self.__dict__.values()
+
+    def items(self):
+        return self.__dict__.items()
+
+    def empty(self):
+        return len(self.__dict__) == 0
+
+    def toDict(self):
+        return {key: value.toDict() if isinstance(value, FrozenParams) else value
+                for key, value in self.__dict__.items()}
+
+    def __copy__(self):
+        # nothing can change, so the snapshot is shared instead of copied
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenParams, (self.__dict__,))
+
+    def __repr__(self):
+        return "FrozenParams(%s)" % ", ".join(
+            "%s=%r" % (key, value) for key, value in self.__dict__.items())
+
+
+def freeze_params(p):
+    """
+    Recursively converts the params p (DotMaps, dicts, lists and numpy arrays)
+    into their immutable counterparts (FrozenParams, tuples and read-only
+    arrays). Anything else (numbers, strings, classes) is kept as is.
+    """
+    if isinstance(p, FrozenParams):
+        return p
+    if isinstance(p, dict):
+        return FrozenParams({key: freeze_params(value)
+                             for key, value in p.items()})
+    if isinstance(p, (list, tuple)):
+        return tuple(freeze_params(value) for value in p)
+    if isinstance(p, np.ndarray):
+        p = p.copy()
+        p.flags.writeable = False
+    return p
+
+
+def is_frozen(p):
+    """Frozen params were parsed before they were frozen (see
+    central_params.get_agent_params) so they must not be parsed again"""
+    return isinstance(p, FrozenParams)
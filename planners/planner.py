@@ -1,6 +1,7 @@
 import numpy as np
 from trajectory.trajectory import Trajectory, SystemConfig
 import threading
+from params.frozen_params import is_frozen
 # used for when there is a single control pipeline
 lock = threading.Lock()
 
@@ -11,7 +12,11 @@ class Planner(object):
 
     def __init__(self, obj_fn, params):
         self.obj_fn = obj_fn
-        self.params = params.planner.parse_params(params)
+        if is_frozen(params):
+            # (already parsed)
+            self.params = params
+        else:
+            self.params = params.planner.parse_params(params)
 
         self.opt_waypt = SystemConfig(dt=params.dt, n=1, k=1, variable=True)
         self.opt_traj = Trajectory(dt=params.dt,
@@ -38,22 +43,43 @@ class Planner(object):
     def eval_objective(self, start_config, goal_config=None, sim_state_hist=None):
         """ Evaluate the objective function on a trajectory
         generated through the control pipeline from start_config (world frame)."""
+        plan_kwargs = {}
+        if self.control_pipeline.goal_directed:
+            plan_kwargs = self._get_goal_directed_maps()
         if self.control_pipeline.params.only_one_system:
             with lock:
                 # NOTE: these functions are not reentrant
                 waypts, horizons, trajectories_lqr, trajectories_spline, controllers = \
-                    self.control_pipeline.plan(start_config, goal_config)
-                obj_val = self.obj_fn.evaluate_function(
-                    trajectories_lqr, sim_state_hist)
+                    self.control_pipeline.plan(start_config, goal_config,
+                                               **plan_kwargs)
+                obj_val = self._evaluate_trajectories(
+                    waypts, trajectories_lqr, sim_state_hist)
         else:
             waypts, horizons, trajectories_lqr, trajectories_spline, controllers = \
-                self.control_pipeline.plan(start_config, goal_config)
-            obj_val = self.obj_fn.evaluate_function(trajectories_lqr)
+                self.control_pipeline.plan(start_config, goal_config,
+                                           **plan_kwargs)
+            obj_val = self._evaluate_trajectories(waypts, trajectories_lqr)
         return obj_val, [
             waypts, horizons, trajectories_lqr, trajectories_spline,
             controllers
         ]
 
+    def _evaluate_trajectories(self, waypts, trajectories, sim_state_hist=None):
+        """The objective of every trajectory (to the waypoints waypts), a
+        planner may only evaluate some of them (the others cost np.inf)"""
+        return self.obj_fn.evaluate_function(trajectories, sim_state_hist)
+
+    def _get_goal_directed_maps(self):
+        """The fmm map (of the goal) and obstacle map of the objectives, which
+        the goal directed waypoint grid samples its waypoints from"""
+        maps = {}
+        for objective in self.obj_fn.objectives:
+            if hasattr(objective, 'fmm_map'):
+                maps['fmm_map'] = objective.fmm_map
+            if hasattr(objective, 'obstacle_map'):
+                maps['obstacle_map'] = objective.obstacle_map
+        return maps
+
     def _init_control_pipeline(self):
         """If the control pipeline has exists already (i.e. precomputed),
         load it. Otherwise generate create it from scratch and save it."""
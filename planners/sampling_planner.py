@@ -1,6 +1,7 @@
 import numpy as np
 from planners.planner import Planner
 from trajectory.trajectory import Trajectory, SystemConfig
+from utils.angle_utils import angle_normalize
 
 
 class SamplingPlanner(Planner):
@@ -10,7 +11,21 @@ class SamplingPlanner(Planner):
         1. Uses a control pipeline to plan paths from start_config
             to a fixed set of waypoint configurations
         2. Evaluates the objective function on the resulting trajectories
-        3. Returns the minimum cost waypoint and associated trajectory"""
+        3. Returns the minimum cost waypoint and associated trajectory
+    When warm started (see warm_start_params) only the waypoints around the
+    previous optimal waypoint are evaluated, as long as the cost of the
+    previous optimum stays within a tolerance (with a full evaluation every
+    full_replan_interval plans)"""
+
+    def __init__(self, obj_fn, params):
+        super(SamplingPlanner, self).__init__(obj_fn, params)
+        # the (world frame) pos_3 and cost of the previous optimal waypoint
+        self.incumbent_pos_3 = None
+        self.incumbent_cost = None
+        # the goal the incumbent was planned to
+        self.incumbent_goal_3 = None
+        # the number of warm started plans since the last full evaluation
+        self.num_warm_plans = 0
 
     @staticmethod
     def parse_params(p):
@@ -71,3 +86,73 @@ class SamplingPlanner(Planner):
                 'img_nmkd': []}  # Dont think we need for our purposes
 
         return data
+
+    def eval_objective(self, start_config, goal_config=None, sim_state_hist=None):
+        self._check_incumbent_goal(goal_config)
+        return super(SamplingPlanner, self).eval_objective(
+            start_config, goal_config, sim_state_hist=sim_state_hist)
+
+    def _evaluate_trajectories(self, waypts, trajectories, sim_state_hist=None):
+        """Evaluates the trajectories to the neighborhood of the incumbent
+        (the previous optimal waypoint) first and all of them only if the
+        cost of the incumbent went up by more than the tolerance"""
+        candidate_idxs = self._warm_start_candidates(waypts)
+        if candidate_idxs is not None:
+            candidates = Trajectory.gather_across_batch_dim_and_create(
+                trajectories, candidate_idxs)
+            candidates.update_valid_mask_nk()
+            obj_vals = np.full(waypts.n, np.inf)
+            obj_vals[candidate_idxs] = self.obj_fn.evaluate_function(
+                candidates, sim_state_hist)
+            # (the first candidate is the closest waypoint to the incumbent)
+            incumbent_cost = obj_vals[candidate_idxs[0]]
+            p = self.params.warm_start_params
+            if np.isfinite(incumbent_cost) and \
+                    incumbent_cost <= self.incumbent_cost + \
+                    p.cost_tolerance * np.abs(self.incumbent_cost):
+                self.num_warm_plans += 1
+                self._update_incumbent(waypts, obj_vals)
+                return obj_vals
+        obj_vals = self.obj_fn.evaluate_function(trajectories, sim_state_hist)
+        self.num_warm_plans = 0
+        self._update_incumbent(waypts, obj_vals)
+        return obj_vals
+
+    def _warm_start_candidates(self, waypts):
+        """The indices of the waypoints within neighborhood_radius of the
+        incumbent (the closest one first) or None for a full evaluation
+        (also when the incumbent is infeasible, i.e. its cost is infinite)"""
+        p = self.params.warm_start_params
+        if not p.enabled or self.incumbent_pos_3 is None or \
+                not np.isfinite(self.incumbent_cost) or \
+                self.num_warm_plans + 1 >= p.full_replan_interval:
+            return None
+        dists_n = np.linalg.norm(waypts.position_nk2()[:, 0] -
+                                 self.incumbent_pos_3[:2], axis=1)
+        if np.min(dists_n) > p.neighborhood_radius:
+            # the incumbent can not be reached anymore
+            return None
+        # (the waypoints at the same position differ by their heading)
+        heading_diffs_n = np.abs(angle_normalize(
+            waypts.heading_nk1()[:, 0, 0] - self.incumbent_pos_3[2]))
+        closest_idxs = np.nonzero(dists_n <= np.min(dists_n) + 1e-3)[0]
+        closest_idx = closest_idxs[np.argmin(heading_diffs_n[closest_idxs])]
+        neighbor_idxs = np.nonzero(dists_n <= p.neighborhood_radius)[0]
+        return np.concatenate([[closest_idx],
+                               neighbor_idxs[neighbor_idxs != closest_idx]])
+
+    def _update_incumbent(self, waypts, obj_vals):
+        min_idx = np.argmin(obj_vals)
+        self.incumbent_pos_3 = waypts.position_and_heading_nk3()[min_idx, 0]
+        self.incumbent_cost = obj_vals[min_idx]
+
+    def _check_incumbent_goal(self, goal_config):
+        """The incumbent is discarded when the goal changes"""
+        goal_3 = None
+        if goal_config is not None:
+            goal_3 = goal_config.position_and_heading_nk3()[0, 0]
+        if (goal_3 is None) != (self.incumbent_goal_3 is None) or \
+                (goal_3 is not None and not np.allclose(goal_3, self.incumbent_goal_3)):
+            self.incumbent_pos_3 = None
+            self.incumbent_cost = None
+        self.incumbent_goal_3 = goal_3
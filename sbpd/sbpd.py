@@ -77,18 +77,23 @@ class Loader():
         mesh. Assumes the human mesh data is stored in this fasion:
             surreal_dir/pose_dir/body_shape_dir/gender/human_mesh_{:d}.obj
         """
+        human_mesh_info = self.sample_human_mesh_info(
+            speed, gender, body_shape, rng)
+        shapess, center_pos_3 = self.load_human_mesh(
+            human_materials=human_materials, **human_mesh_info)
+        return shapess, center_pos_3, human_mesh_info
 
+    def sample_human_mesh_info(self, speed, gender, body_shape, rng):
+        """
+        Sample the (directory and frame of the) mesh of a random pose of
+        the human, without loading it (see load_human_mesh)
+        """
         # Find the closest velocity bin
-        velocity_dirs = [x for x in os.listdir(self.surreal_params.data_dir) if os.path.isdir(
-            os.path.join(self.surreal_params.data_dir, x))]
-        velocities_float = [float(velocity_str.split('velocity_')[1].split('_m_s')[
-                                  0]) for velocity_str in velocity_dirs]
-        idx = np.argmin(np.abs(np.array(velocities_float) - speed))
-        velocity_dir = os.path.join(
-            self.surreal_params.data_dir, velocity_dirs[idx])
+        velocity_dir = self.get_velocity_dir(speed)
 
         # Sample A Random Pose
-        poses = [x for x in os.listdir(velocity_dir) if not x.startswith('.')]
+        poses = [x for x in self._listdir(velocity_dir)
+                 if not x.startswith('.')]
         poses.sort()
         pose = rng.choice(poses)
         pose_dir = os.path.join(velocity_dir, pose)
@@ -103,17 +108,28 @@ class Loader():
         assert os.path.isdir(gender_dir)
 
         # Sample a frame number
-        frames = os.listdir(gender_dir)
+        frames = self._listdir(gender_dir)
         frames = list(filter(lambda x: 'obj' in x, frames))
         frame_numbers = [int(x.strip('.obj').split('_')[-1]) for x in frames]
         frame_numbers.sort()
         frame = rng.choice(frame_numbers)
 
-        human_mesh_info = {'mesh_dir': gender_dir,
-                           'frame': frame, 'gender': gender}
-        shapess, center_pos_3 = self.load_human_mesh(
-            human_materials=human_materials, **human_mesh_info)
-        return shapess, center_pos_3, human_mesh_info
+        return {'mesh_dir': gender_dir, 'frame': frame, 'gender': gender}
+
+    def get_velocity_dir(self, speed):
+        """The directory of the velocity bin closest to speed"""
+        velocity_dirs = [x for x in self._listdir(self.surreal_params.data_dir) if os.path.isdir(
+            os.path.join(self.surreal_params.data_dir, x))]
+        velocities_float = [float(velocity_str.split('velocity_')[1].split('_m_s')[
+                                  0]) for velocity_str in velocity_dirs]
+        idx = np.argmin(np.abs(np.array(velocities_float) - speed))
+        return os.path.join(self.surreal_params.data_dir, velocity_dirs[idx])
+
+    def _listdir(self, path):
+        """os.listdir of the (static) surreal directories, cached"""
+        if path not in self.listdir_cache:
+            self.listdir_cache[path] = os.listdir(path)
+        return self.listdir_cache[path]
 
     def load_human_mesh(self, human_materials, mesh_dir, frame, gender):
         """
@@ -143,6 +159,8 @@ class StanfordBuildingParserDataset(Loader):
         self.data_dir = data_dir
 
         self.surreal_params = surreal_params
+        # contents of the surreal directories indexed by path
+        self.listdir_cache = {}
 
     def get_data_dir(self):
         return self.data_dir
@@ -0,0 +1,242 @@
+import os
+import argparse
+import numpy as np
+from simulators.sim_state import SimState
+from utils.utils import color_green, color_red, color_reset, touch
+from utils.image_utils import AgentFrame, render_topview_frames, \
+    open_movie_writer, save_image
+
+"""
+Compact recording of an episode: the per-step agent arrays (positions and
+collisions) plus the static environment metadata (traversible, scale, ...).
+Recordings are saved by the simulator (see record_episode) so episodes can be
+rendered later, on any machine, without rerunning them, e.g.:
+    PYTHONPATH='.' python3 simulators/episode_recording.py <recording.npz> [--frames 0 10 20]
+"""
+
+recording_filename = 'episode_recording.npz'
+
+
+class EpisodeRecorder(object):
+    """Records every new SimState of an episode into flat lists"""
+
+    def __init__(self, environment: dict, episode_name: str, dt: float):
+        self.environment = environment
+        self.episode_name = episode_name
+        self.dt = dt
+        # per agent (indexed by name): [index, radius, color, is_robot, start_3, goal_3]
+        self.agents = {}
+        # per step
+        self.sim_steps = []
+        self.sim_ts = []
+        self.wall_ts = []
+        # per (step, agent) row
+        self.row_steps = []
+        self.row_agents = []
+        self.row_pos_3 = []
+        self.row_collided = []
+
+    def record(self, sim_step: int, sim_state: SimState):
+        step_idx = len(self.sim_steps)
+        self.sim_steps.append(sim_step)
+        self.sim_ts.append(sim_state.get_sim_t())
+        wall_t = sim_state.get_wall_t()
+        self.wall_ts.append(wall_t if wall_t is not None else 0.0)
+        robots = sim_state.get_robots()
+        for name, a in sim_state.get_all_agents(include_robot=True).items():
+            if name not in self.agents:
+                self.agents[name] = self.get_agent_info(a, name in robots)
+            self.row_steps.append(step_idx)
+            self.row_agents.append(self.agents[name][0])
+            self.row_pos_3.append(a.get_current_config().to_3D_numpy())
+            self.row_collided.append(a.get_collided() or
+                                     (a.get_collision_cooldown() > 0))
+
+    def get_agent_info(self, a, is_robot: bool):
+        start_3 = np.full(3, np.nan)
+        goal_3 = np.full(3, np.nan)
+        if a.get_start_config() is not None:
+            start_3 = a.get_start_config().to_3D_numpy()
+        if a.get_goal_config() is not None:
+            goal_3 = a.get_goal_config().to_3D_numpy()
+        color = a.get_color() if a.get_color() is not None else ''
+        return [len(self.agents), a.get_radius(), color, is_robot,
+                start_3, goal_3]
+
+    def save(self, filename: str):
+        touch(filename)
+        agents = sorted(self.agents.items(), key=lambda item: item[1][0])
+        traversible = np.asarray(self.environment["map_traversible"]) > 0
+        np.savez_compressed(
+            filename,
+            episode_name=self.episode_name,
+            building_name=str(self.environment.get("building_name", "")),
+            dt=self.dt,
+            # the traversible is stored as bits
+            map_traversible_bits=np.packbits(traversible),
+            map_traversible_shape=np.array(traversible.shape),
+            map_scale=self.environment["map_scale"],
+            room_center=np.asarray(self.environment["room_center"]),
+            agent_names=np.array([name for name, _ in agents], dtype=str),
+            agent_radius=np.array([info[1] for _, info in agents]),
+            agent_color=np.array([info[2] for _, info in agents], dtype=str),
+            agent_is_robot=np.array([info[3] for _, info in agents], dtype=bool),
+            agent_start_3=np.array([info[4] for _, info in agents]).reshape(-1, 3),
+            agent_goal_3=np.array([info[5] for _, info in agents]).reshape(-1, 3),
+            sim_steps=np.array(self.sim_steps, dtype=np.int32),
+            sim_ts=np.array(self.sim_ts),
+            wall_ts=np.array(self.wall_ts),
+            row_steps=np.array(self.row_steps, dtype=np.int32),
+            row_agents=np.array(self.row_agents, dtype=np.int32),
+            row_pos_3=np.array(self.row_pos_3, dtype=np.float32).reshape(-1, 3),
+            row_collided=np.array(self.row_collided, dtype=bool))
+
+
+class EpisodeRecording(object):
+    """An episode recording (loaded from disk) whose frames can be rendered"""
+
+    def __init__(self, filename: str):
+        with np.load(filename, allow_pickle=False) as data:
+            self.data = {key: data[key] for key in data.files}
+        self.episode_name = str(self.data["episode_name"])
+        self.dt = float(self.data["dt"])
+        self.num_steps = len(self.data["sim_steps"])
+        # the rows of every agent (recorded in order of the steps)
+        row_agents = self.data["row_agents"]
+        self.agent_rows = [np.nonzero(row_agents == i)[0]
+                           for i in range(len(self.data["agent_names"]))]
+        self.step_rows = np.searchsorted(self.data["row_steps"],
+                                         np.arange(self.num_steps + 1))
+
+    def get_environment(self):
+        shape = tuple(self.data["map_traversible_shape"])
+        bits = np.unpackbits(self.data["map_traversible_bits"],
+                             count=int(np.prod(shape)))
+        return {"map_traversible": bits.reshape(shape).astype(bool),
+                "map_scale": float(self.data["map_scale"]),
+                "room_center": self.data["room_center"],
+                "building_name": str(self.data["building_name"])}
+
+    def get_frame(self, step_idx: int):
+        """The lightweight topview frame (see get_topview_frame) of a step"""
+        pedestrians = {}
+        robots = {}
+        for row in range(self.step_rows[step_idx], self.step_rows[step_idx + 1]):
+            agent = self.data["row_agents"][row]
+            is_robot = self.data["agent_is_robot"][agent]
+            # the trajectories are drawn from the recorded positions with
+            # the same clipping as get_topview_frame
+            agent_rows = self.agent_rows[agent]
+            past_rows = agent_rows[:np.searchsorted(agent_rows, row) + 1]
+            traj_clip = 0 if is_robot else 50
+            traj_xy_k2 = self.data["row_pos_3"][past_rows, :2][-1:-1 * traj_clip:-1]
+            start_3 = self.data["agent_start_3"][agent]
+            goal_3 = self.data["agent_goal_3"][agent]
+            color = str(self.data["agent_color"][agent])
+            frame = AgentFrame.from_arrays(
+                pos_3=self.data["row_pos_3"][row].astype(np.float64),
+                radius=float(self.data["agent_radius"][agent]),
+                color=color if color != '' else None,
+                collided=bool(self.data["row_collided"][row]),
+                start_3=start_3 if not np.any(np.isnan(start_3)) else None,
+                goal_3=goal_3 if not np.any(np.isnan(goal_3)) else None,
+                traj_xy_k2=traj_xy_k2)
+            name = str(self.data["agent_names"][agent])
+            if is_robot:
+                robots[name] = frame
+            else:
+                pedestrians[name] = frame
+        return {"camera_pos_13": None,
+                "pedestrians": pedestrians,
+                "robots": robots,
+                "sim_t": float(self.data["sim_ts"][step_idx]),
+                "wall_t": float(self.data["wall_ts"][step_idx])}
+
+
+def render_recording(filename: str, output_directory: str = None,
+                     frames: list = None, p=None):
+    """
+    Renders a recorded episode (in parallel) into a movie, or only the
+    selected frames (step indices) into individual images
+    :param filename: the episode recording (saved by the simulator)
+    :param output_directory: where to render, defaults to next to the recording
+    :param frames: the step indices to render as images (None for the movie)
+    :param p: the render params, defaults to create_render_params()
+    """
+    if p is None:
+        from params.central_params import create_render_params
+        p = create_render_params()
+    if output_directory is None:
+        output_directory = os.path.dirname(os.path.abspath(filename))
+    p.output_directory = output_directory
+    recording = EpisodeRecording(filename)
+    environment = recording.get_environment()
+
+    if frames is not None:
+        def save_frame(image, i):
+            save_image(p, image, "%s_obs%d.png" %
+                       (recording.episode_name, frames[i - 1]))
+        render_topview_frames(p, environment,
+                              (recording.get_frame(step) for step in frames),
+                              len(frames), save_frame)
+        print("%sRendered %d frames in %s%s" %
+              (color_green, len(frames), output_directory, color_reset))
+        return
+
+    # render every (1 / fps_scale_down)'th step (like Simulator.render)
+    fps_scale_down = p.fps_scale_down if p.fps_scale_down > 0 else 1.0
+    steps = range(0, recording.num_steps, int(1.0 / fps_scale_down))
+    fps = (1.0 / recording.dt) * fps_scale_down
+    writer, movie_location = \
+        open_movie_writer(output_directory, "movie_%s" % recording.episode_name,
+                          duration=1.0 / fps, video_format=p.video_format)
+    render_topview_frames(p, environment,
+                          (recording.get_frame(step) for step in steps),
+                          len(steps), lambda image, _: writer.append_data(image))
+    writer.close()
+    print("%sRendered movie at" % color_green, movie_location, color_reset)
+
+
+def render_failures(results_dir: str, p=None):
+    """Renders the recordings of all the unsuccessful episodes of a run
+    (the directory holding the episode scores of scoring_utils)"""
+    from utils.scoring_utils import load_scores
+    scores = load_scores(results_dir)
+    if len(scores) == 0:
+        print("%sNo episode scores in %s%s" %
+              (color_red, results_dir, color_reset))
+        return
+    for column in ["episode_name", "success"]:
+        if column not in scores:
+            print("%sNo %s scores in %s%s" %
+                  (color_red, column, results_dir, color_reset))
+            return
+    for episode_name, success in zip(scores["episode_name"], scores["success"]):
+        if success == True:  # (nan if the score is missing)
+            continue
+        filename = os.path.join(results_dir, str(episode_name),
+                                recording_filename)
+        if not os.path.exists(filename):
+            print("%sNo recording of episode %s%s" %
+                  (color_red, episode_name, color_reset))
+            continue
+        render_recording(filename, p=p)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Render recorded episodes without rerunning them')
+    parser.add_argument('recording', type=str,
+                        help='an episode recording (or a run directory with --failures)')
+    parser.add_argument('--frames', type=int, nargs='*', default=None,
+                        help='only render these steps (as images)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='output directory (defaults to the recording\'s)')
+    parser.add_argument('--failures', action='store_true',
+                        help='render every unsuccessful episode of a run directory')
+    args = parser.parse_args()
+    if args.failures:
+        render_failures(args.recording)
+    else:
+        render_recording(args.recording, output_directory=args.output,
+                         frames=args.frames)
@@ -292,6 +292,19 @@ def get_agents_from_type(sim_state, agent_type: str):
     return {}  # empty dict
 
 
+def compute_agent_clearance(sim_state, agent_name: str, pos_3, radius: float):
+    """The smallest gap between an agent (at pos_3, with radius) and all the
+    other agents (and robots) of sim_state, np.inf if there are none"""
+    clearance = np.inf
+    for name, a in get_all_agents(sim_state, include_robot=True).items():
+        if name == agent_name:
+            continue
+        othr_pos = a.get_current_config().to_3D_numpy()
+        clearance = min(clearance, euclidean_dist2(pos_3, othr_pos) -
+                        radius - a.get_radius())
+    return clearance
+
+
 def compute_next_vel(sim_state_prev, sim_state_now, agent_name: str):
     old_agent = sim_state_prev.get_all_agents()[agent_name]
     old_pos = old_agent.get_current_config().to_3D_numpy()
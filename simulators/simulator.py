@@ -43,6 +43,17 @@ class Simulator(SimulatorHelper):
         self.init_prerec_agent_threads(current_state=None)
         # save initial state before the simulator is spawned
         self.sim_t = 0.0
+        # accumulate the episode metrics while simulating
+        self.online_metrics = None
+        if self.params.online_metrics:
+            from metrics.online_metrics import OnlineEpisodeMetrics
+            self.online_metrics = OnlineEpisodeMetrics(self.dt)
+        # record the episode (compactly) to be rendered later
+        self.recorder = None
+        if self.params.record_episode:
+            from simulators.episode_recording import EpisodeRecorder
+            self.recorder = EpisodeRecorder(self.environment,
+                                            self.episode_params.name, self.dt)
         if self.dt < self.params.dt:
             print("%sSimulation dt is too small; either lower the gen_agents' dt's" % color_red,
                   self.params.dt, "or increase simulation delta_t%s" % color_reset)
@@ -133,11 +144,16 @@ class Simulator(SimulatorHelper):
                   (term_color, self.robot.termination_cause, color_reset))
         if(self.episode_params.write_episode_log):
             self.generate_sim_log()
+        if self.recorder is not None:
+            from simulators.episode_recording import recording_filename
+            self.recorder.save(os.path.join(self.params.output_directory,
+                                            recording_filename))
         if self.robot is not None:
             # TODO generate + write the score report
             from simulators.simulator_helper import sim_states_to_dataframe
-            self.sim_df, self.agent_info = \
-                sim_states_to_dataframe(self.sim_states)
+            if self.params.keep_sim_history:
+                self.sim_df, self.agent_info = \
+                    sim_states_to_dataframe(self.sim_states)
             self.generate_episode_score_report()
             # finally close the robot listener thread
             self.decommission_robot(r_t)
@@ -170,7 +186,14 @@ class Simulator(SimulatorHelper):
                                  self.episode_params.max_time, last_robot_collision)
         # Save current state to a class dictionary indexed by simulator time
         sim_t_step = round(self.sim_t / self.dt)
+        if not self.params.keep_sim_history:
+            # only keep the most recent state
+            self.sim_states.clear()
         self.sim_states[sim_t_step] = current_state
+        if self.online_metrics is not None:
+            self.online_metrics.update(sim_t_step, current_state)
+        if self.recorder is not None:
+            self.recorder.record(sim_t_step, current_state)
         # debug prints
         return current_state
 
@@ -179,7 +202,6 @@ class Simulator(SimulatorHelper):
     def generate_episode_score_report(self, filename='episode_score'):
         # should do this in some formal format
         # json? pandas? how to aggregate per episode?
-        import pandas as pd
         # TODO how to have a list of metrics? for now hardcoded
         # different analysis based on success and failure
         metrics_list = [
@@ -213,22 +235,24 @@ class Simulator(SimulatorHelper):
             "goal_traversal_ratio"
         ]
 
-        score_df = pd.DataFrame(columns=metrics_list)
-
         ep_params = self.episode_params
-        filename = "episode_score_%s.pkl" % ep_params.name
-        abs_filename = os.path.join(self.params.output_directory, filename)
-        touch(abs_filename)
-        metrics_out = {}
+        metrics_out = {"episode_name": ep_params.name,
+                       "algo_name": self.algo_name,
+                       "seed": self.params.socnav_params.seed}
 
         from metrics import metrics_sim_utils
-        for metric in metrics_list:
-            try:
-                metric_fn = eval("metrics_sim_utils." + metric)
-            except (AttributeError, NameError):
-                print("The metric %s is not implemented yet" % metric)
-                continue
-            metrics_out[metric] = metric_fn(self)
+        if not self.params.keep_sim_history:
+            # these need every sim_state (the online scores are used instead)
+            metrics_list = [m for m in metrics_list
+                            if m not in metrics_sim_utils.sim_history_metrics]
+        online_scores = None
+        if self.online_metrics is not None:
+            # these scores were already accumulated during the simulation
+            online_scores = self.online_metrics.get_scores()
+
+        # the metrics share their intermediate inputs (computed only once)
+        metrics_out.update(metrics_sim_utils.compute_metrics(self, metrics_list,
+                                                             online_scores))
 
         # other ROBOT INFO
 
@@ -237,14 +261,17 @@ class Simulator(SimulatorHelper):
         metrics_out["num_exec_robot"] = \
             self.robot.num_executed
 
+        from utils import scoring_utils
+        # scalar scores are appended to the store of the whole run (one per
+        # algorithm) while the per-step scores are saved per episode
+        results_dir = os.path.dirname(self.params.output_directory)
+        scalars, per_step = scoring_utils.split_episode_scores(metrics_out)
         try:
-            with open(abs_filename, 'wb') as f:
-                # f.write(metrics_out)
-                import pickle
-                pickle.dump(metrics_out, f)
-
+            scoring_utils.append_episode_scores(results_dir, scalars)
+            scoring_utils.save_per_step_scores(results_dir, ep_params.name,
+                                               per_step)
             print("%sSuccessfully wrote episode metrics to %s%s" %
-                  (color_green, abs_filename, color_reset))
+                  (color_green, results_dir, color_reset))
         except:
             print("%sWriting episode metrics failed%s" %
                   (color_red, color_reset))
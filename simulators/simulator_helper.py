@@ -1,4 +1,5 @@
 import numpy as np
+import json
 import multiprocessing
 import threading
 from utils.utils import *
@@ -7,7 +8,6 @@ from agents.agent import Agent
 from simulators.sim_state import SimState
 from socnav.socnav_renderer import SocNavRenderer
 from params.central_params import create_simulator_params
-import pandas as pd
 
 
 class SimulatorHelper(object):
@@ -96,11 +96,18 @@ class SimulatorHelper(object):
         return not (not self.backstage_prerecs)
 
     def init_obstacle_map(self, renderer=None, ):
-        """ Initializes the sbpd map."""
+        """ Initializes the sbpd map (shared by all the agents)."""
+        from obstacles.map_registry import get_obstacle_map, export_to_shared_memory
         p = self.params.obstacle_map_params
-        return p.obstacle_map(p, renderer,
-                              res=self.environment["map_scale"] * 100,
-                              map_trav=self.environment["map_traversible"])
+        obstacle_map = get_obstacle_map(p, renderer,
+                                        res=self.environment["map_scale"] * 100,
+                                        map_trav=self.environment["map_traversible"],
+                                        building_name=self.environment.get("building_name"))
+        if p.share_with_joystick:
+            # the joystick can attach to this map instead of rebuilding it
+            self.environment["shared_obstacle_map"] = \
+                json.dumps(export_to_shared_memory(obstacle_map))
+        return obstacle_map
 
     def loop_condition(self):
         raise NotImplementedError
@@ -125,6 +132,13 @@ class SimulatorHelper(object):
               "\r", end="")
 
     def gather_robot_collisions(self, max_iter: int):
+        if not self.params.keep_sim_history:
+            # the collisions were recorded during the simulation
+            agent_collisions = self.online_metrics.get_robot_colliders(max_iter)
+            last_collider = self.robot.latest_collider
+            if(last_collider != ""):
+                agent_collisions.append(last_collider)
+            return agent_collisions
         agent_collisions = []
         for i in range(max_iter):
             collider = self.sim_states[i].get_collider()
@@ -232,89 +246,87 @@ class SimulatorHelper(object):
             del(t)
 
     def render(self, renderer, camera_pose, filename: str = "obs"):
-        """Generates a png frame for each world state saved in self.sim_states. Note, based off the
-        render_3D options, the function will generate the frames in multiple separate processes to
-        optimize performance on multicore machines, else it can also be done sequentially.
+        """Generates a frame for each world state saved in self.sim_states and streams them (in
+        order) into the movie as soon as they are rendered. Note, based off the render_3D options,
+        the function will generate the frames in a pool of worker processes to optimize
+        performance on multicore machines (encoding overlaps with rendering), else it can also be
+        done sequentially.
         NOTE: the 3D renderer can currently only be run sequentially
         Args:
-            filename (str, optional): name of each png frame (unindexed). Defaults to "obs".
+            filename (str, optional): unused, the movie is named after the episode. Defaults to "obs".
         """
         if self.params.fps_scale_down == 0 or not self.params.record_video:
             print("%sNot rendering movie%s" % (color_orange, color_reset))
             return
+        if not self.params.keep_sim_history:
+            print("%sNot rendering movie (sim_states were not kept)%s" %
+                  (color_orange, color_reset))
+            return
 
         # Rendering movie
         fps = (1.0 / self.dt) * self.params.fps_scale_down
         print("%sRendering movie with fps=%d%s" %
               (color_orange, fps, color_reset))
-        num_frames = \
-            int(np.ceil(len(self.sim_states) * self.params.fps_scale_down))
         np.set_printoptions(precision=3)
+        # render every (1 / fps_scale_down)'th state
+        states = \
+            list(self.sim_states.values())[::int(1.0 / self.params.fps_scale_down)]
+        num_frames = len(states)
+        writer, movie_location = \
+            open_movie_writer(self.params.output_directory,
+                              "movie_%s" % self.episode_params.name,
+                              duration=1.0 / fps,
+                              video_format=self.params.video_format)
+
+        def encode(image, frame):
+            writer.append_data(image)
+            print("Encoded frames: %d out of %d, %.3f%% \r" %
+                  (frame, num_frames, 100.0 * (frame / num_frames)), end="")
 
         if not self.params.render_3D:
-            # optimized to use multiple processes
-            # TODO: put a limit on the maximum number of processes that can be run at once
-            gif_processes = []
-            skip = 0
-            frame = 0
-            for p, s in enumerate(self.sim_states.values()):
-                if skip == 0:
-                    # pool.apply_async(self.render_sim_state, args=(s, filename + str(p) + ".png"))
-                    frame += 1
-                    gif_processes.append(multiprocessing.Process(
-                        target=self.render_sim_state,
-                        args=(renderer, camera_pose, s, filename + str(p) + ".png"))
-                    )
-                    gif_processes[-1].start()
-                    print("Started processes: %d out of %d, %.3f%% \r" %
-                          (frame, num_frames, 100.0 * (frame / num_frames)), end="")
-                    # reset skip counter for frames
-                    skip = int(1.0 / self.params.fps_scale_down) - 1
-                else:
-                    # skip certain other frames as directed by the fps_scale_down
-                    skip -= 1
-            print()  # not overwrite next line
-            for frame, p in enumerate(gif_processes):
-                p.join()
-                print("Finished processes: %d out of %d, %.3f%% \r" %
-                      (frame + 1, num_frames, 100.0 * ((frame + 1) / num_frames)), end="")
-            print()  # not overwrite next line
+            # optimized to use a bounded pool of processes (one per cpu)
+            static_env = {key: self.environment[key] for key in
+                          ["map_traversible", "map_scale", "room_center"]}
+            render_topview_frames(self.params, static_env,
+                                  (self.get_topview_frame(s, camera_pose)
+                                   for s in states),
+                                  num_frames, encode)
         else:
             # generate frames sequentially (non multiproceses)
-            skip = 0
-            frame = 0
-            for s in self.sim_states.values():
-                if skip == 0:
-                    self.render_sim_state(renderer, camera_pose, s,
-                                          filename + str(frame) + ".png")
-                    frame += 1
-                    print("Generated Frames: %d out of %d, %.3f%% \r" %
-                          (frame, num_frames, 100.0 * (frame / num_frames)), end="")
-                    del s  # free the state from memory
-                    skip = int(1.0 / self.params.fps_scale_down) - 1
-                else:
-                    skip -= 1.0
-            print()
+            frame_shape_2 = None
+            for frame, s in enumerate(states):
+                image = self.render_sim_state(renderer, camera_pose, s)
+                if frame_shape_2 is None:
+                    frame_shape_2 = image.shape[:2]
+                # every frame is tightly cropped (e.g. to its own title) but the
+                # movie needs them all to have the size of the first one
+                encode(fit_image(image, frame_shape_2), frame + 1)
+        print()  # not overwrite next line
+        writer.close()
+        print("%sRendered movie at" % color_green, movie_location, color_reset)
+
+    def get_camera_pos_13(self, state: SimState, camera_pose: list):
+        if self.robot:
+            robot = list(state.get_robots().values())[0]
+            return robot.get_current_config().to_3D_numpy()
+        if camera_pose is not None:
+            return camera_pose
+        return state.get_environment()["room_center"]
 
-        # convert all the generated frames into a gif file
-        self.save_frames_to_gif(filename=self.episode_params.name)
+    def get_topview_frame(self, state: SimState, camera_pose: list):
+        """Converts a state into the lightweight frame drawn by the render workers"""
+        return get_topview_frame(self.get_camera_pos_13(state, camera_pose),
+                                 state.get_pedestrians(), state.get_robots(),
+                                 state.get_sim_t(), state.get_wall_t())
 
     def render_sim_state(self, renderer: SocNavRenderer, camera_pose: list,
-                         state: SimState, filename: str):
-        """Converts a state into an image to be later converted to a gif movie
+                         state: SimState, filename: str = None):
+        """Converts a state into an image to be later converted to a movie
         Args:
             state (SimState): the state of the world to convert to an image
-            filename (str): the name of the resulting image (unindexed)
+            filename (str): the name of the resulting image (None to return the image)
         """
-        if self.robot:
-            robot = list(state.get_robots().values())[0]
-            camera_pos_13 = robot.get_current_config().to_3D_numpy()
-        else:
-            robot = None
-            if camera_pose is not None:
-                camera_pos_13 = camera_pose
-            else:
-                camera_pos_13 = state.get_environment()["room_center"]
+        camera_pos_13 = self.get_camera_pos_13(state, camera_pose)
 
         rgb_image_1mk3 = None
         depth_image_1mk1 = None
@@ -323,10 +335,13 @@ class SimulatorHelper(object):
             # TODO: Fix multiprocessing for properly deepcopied renderers
             # only when rendering with opengl
             assert("human_traversible" in state.get_environment().keys())
-            # remove the "old" humans
-            renderer.remove_all_humans()
-            # update pedestrians humans
-            for a in state.get_pedestrians().values():
+            # remove the humans that left the scene
+            pedestrians = state.get_pedestrians()
+            for name in list(renderer.humans.keys()):
+                if name not in pedestrians:
+                    renderer.remove_human(name)
+            # update (move or reload) the pedestrians humans
+            for a in pedestrians.values():
                 renderer.update_human(a)
             # Update human traversible
             # NOTE: this is technically not R-O since it modifies the human trav
@@ -339,28 +354,10 @@ class SimulatorHelper(object):
                                      state.get_environment()["map_scale"],
                                      human_visible=True)
         # plot the rbg, depth, and topview images if applicable
-        render_scene(self.params, rgb_image_1mk3, depth_image_1mk1,
-                     state.get_environment(), camera_pos_13,
-                     state.get_pedestrians(), state.get_robots(),
-                     state.get_sim_t(), state.get_wall_t(), filename)
-        # Delete state to save memory after frames are generated
-        del state
-
-    def save_frames_to_gif(self, filename=""):
-        """Convert a directory full of png's to a gif movie
-        NOTE: One can also save to mp4 using imageio-ffmpeg or this bash script:
-              "ffmpeg -r 10 -i simulate_obs%01d.png -vcodec mpeg4 -y movie.mp4"
-        Args:
-            clear_old_files (bool, optional): Whether or not to clear old image files. Defaults to True.
-        """
-        if self.params.fps_scale_down == 0 or not self.params.record_video:
-            return
-        duration = self.dt * (1.0 / self.params.fps_scale_down)
-        # sequentially
-        gif_filename = "movie_%s" % filename
-        save_to_gif(self.params.output_directory, duration,
-                    gif_filename=gif_filename,
-                    clear_old_files=self.params.clear_files)
+        return render_scene(self.params, rgb_image_1mk3, depth_image_1mk1,
+                            state.get_environment(), camera_pos_13,
+                            state.get_pedestrians(), state.get_robots(),
+                            state.get_sim_t(), state.get_wall_t(), filename)
 
 
 """central sim - pandas utils"""
@@ -368,45 +365,53 @@ class SimulatorHelper(object):
 
 def sim_states_to_dataframe(sim):
     """
-    Convert all states for non-robot agents into df
-    :param sim:
-    :return:
+    Convert all states for all agents (including the robot) into a df
+    with one row per agent per sim_step. The columns are gathered into
+    flat arrays and the df is allocated once at the end.
+    :param sim: the Simulator or its dictionary of sim_states
+    :return: the df and a dictionary of agent radii indexed by name
     """
+    import pandas as pd
     from simulators.simulator import Simulator
     if isinstance(sim, Simulator):
-        all_states = sim.states
+        all_states = sim.sim_states
     elif isinstance(sim, dict):
         all_states = sim
 
-    cols = ["sim_step", "agent_name", "x", "y", "theta"]
     agent_info = {}  # for now store radius, later store traversibles
-    df = pd.DataFrame(columns=cols)
+    sim_steps = []
+    agent_names = []
+    xytheta = []
 
     for sim_step, sim_state in all_states.items():
         for agent_name, agent in sim_state.get_all_agents(True).items():
 
             if not isinstance(agent, dict):
-                # traj = np.squeeze(agent.vehicle_trajectory.position_and_heading_nk3())
-                traj = np.squeeze(
-                    agent.current_config.position_and_heading_nk3())
-                agent_info[agent_name] = [agent.get_radius()]
+                pos_3 = agent.current_config.position_and_heading_nk3()
+                if agent_name not in agent_info:
+                    agent_info[agent_name] = [agent.get_radius()]
             else:
-                traj = np.squeeze(agent["trajectory"])
-                agent_info[agent_name] = [agent["radius"]]
+                pos_3 = agent["trajectory"]
+                if agent_name not in agent_info:
+                    agent_info[agent_name] = [agent["radius"]]
 
-            if len(traj) == 0:
+            pos_3 = np.asarray(pos_3).reshape(-1)
+            if len(pos_3) == 0:
                 continue
-            # elif len(traj) > 1 and len(traj.shape) > 1:
-            #     traj = traj[-1]
-            #
-            if len(traj) != 3:
-                print(sim_step, traj)
+            if len(pos_3) != 3:
+                print(sim_step, pos_3)
                 raise NotImplementedError
 
-            x, y, th = traj
-
-            df.loc[len(df)] = [sim_step, agent_name, x, y, th]
+            sim_steps.append(sim_step)
+            agent_names.append(agent_name)
+            xytheta.append(pos_3)
 
+    xytheta = np.array(xytheta, dtype=np.float64).reshape(-1, 3)
+    df = pd.DataFrame({"sim_step": np.array(sim_steps, dtype=np.int64),
+                       "agent_name": pd.Categorical(agent_names),
+                       "x": xytheta[:, 0],
+                       "y": xytheta[:, 1],
+                       "theta": xytheta[:, 2]})
     return df, agent_info
 
 
@@ -1,7 +1,6 @@
-from mp_env import map_utils as mu
 from utils import depth_utils as du
-from sbpd import sbpd
 from utils.utils import mkdir_if_missing
+from obstacles import map_bundle as mb
 import numpy as np
 import sys
 import os
@@ -24,8 +23,12 @@ class SocNavRenderer():
         # Making use of a dictionary mapping Human's names to humans
         self.humans = {}  # to keep track of the Humans
         self.human_traversible = None
+        # depth projectors indexed by their (map_size, z_bins, xy_resolution)
+        self.depth_projectors = {}
 
         if self.p.building_params.load_meshes:
+            # the dataset (and its mesh loading) is only imported when needed
+            from sbpd import sbpd
             self.d = sbpd.get_dataset(self.p.building_params.dataset_name, 'all',
                                       data_dir=self.p.sbpd_data_dir,
                                       surreal_params=self.p.surreal)
@@ -153,20 +156,111 @@ class SocNavRenderer():
             imgs_nmk3 = self.building.render_nodes(
                 nodes_n3, modality='rgb', human_visible=human_visible)
         else:
-            width = self.p.camera_params.width
-            height = self.p.camera_params.height
-            resize = self.p.camera_params.im_resize
-            width = int(width * resize)
-            height = int(height * resize)
-            n = len(starts_n2)
-            imgs_nmk3 = np.zeros((n, width, height, 3), dtype=np.float32)
+            imgs_nmk3 = self._get_empty_images(len(starts_n2), 3)
         return np.array(imgs_nmk3)
 
+    def _get_empty_images(self, n, num_channels):
+        # placeholder images when the meshes are not loaded
+        width = self.p.camera_params.width
+        height = self.p.camera_params.height
+        resize = self.p.camera_params.im_resize
+        width = int(width * resize)
+        height = int(height * resize)
+        return np.zeros((n, width, height, num_channels), dtype=np.float32)
+
+    def render_rgb_and_disparity(self, starts_n2, thetas_n1, human_visible=True):
+        """
+        Render the rgb and disparity images from all the x, y, theta
+        locations in starts and thetas in a single batched call, so the
+        camera is positioned once per location for both modalities.
+        """
+        if not self.p.building_params.load_meshes:
+            n = len(starts_n2)
+            return self._get_empty_images(n, 3), self._get_empty_images(n, 2)
+        nodes_n3 = np.concatenate([starts_n2 * 1.,
+                                   thetas_n1 / self.building.robot.delta_theta], axis=1)
+        imgs = self.building.render_nodes_batch(
+            nodes_n3, ['rgb', 'disparity'], human_visible=human_visible)
+        return imgs['rgb'], imgs['disparity']
+
+    def render_depth_occupancy(self, starts_n2, thetas_n1, xy_resolution, map_size,
+                               pos_3, human_visible=True, disparity_imgs_cm=None,
+                               copy_counts=True):
+        """
+        Render analytically projected depth images at the locations in
+        starts, thetas (all of them in a single batched call). Bin data inside
+        bins in a resolution of xy_resolution along x and y axis and z_bins in
+        the z direction around the robot's location(s) pos_3 (x, y in meters
+        and theta, either a single location or one per image). Z Direction is
+        the vertical z = 0 is floor. The disparity images are only rendered if
+        they are not given (see render_rgb_and_disparity).
+        Returns the disparity images n x H x W x 2, the counts
+        n x map_size x map_size x (len(z_bins)+1) and the isvalid masks
+        n x H x W x 1. With copy_counts=False the counts are a view of the
+        depth projector's reusable buffer (see du.DepthProjector) that is
+        overwritten by the next call with the same bins.
+        """
+        # (the physical params the building's robot is loaded with)
+        robot = self.p.robot_params.physical_params
+        z_bins = [-10, robot.base, robot.base + robot.height]
+        if disparity_imgs_cm is None:
+            if not self.p.building_params.load_meshes:
+                disparity_imgs_cm = self._get_empty_images(len(starts_n2), 2)
+            else:
+                nodes_n3 = np.concatenate(
+                    [starts_n2 * 1., thetas_n1 / robot.delta_theta], axis=1)
+                disparity_imgs_cm = self.building.render_nodes_batch(
+                    nodes_n3, ['disparity'], human_visible=human_visible)['disparity']
+        disparity_imgs_cm = np.asarray(disparity_imgs_cm)
+        n = len(disparity_imgs_cm)
+        if not self.p.building_params.load_meshes:
+            # nothing is seen without the meshes
+            return disparity_imgs_cm, \
+                np.zeros((n, map_size, map_size, len(z_bins) + 1)), \
+                np.zeros(disparity_imgs_cm.shape[:3] + (1,), dtype=bool)
+
+        depth_imgs_meters = 100. / \
+            (disparity_imgs_cm[..., 1] + 0.000001)  # no divide by 0 error
+
+        # Optionally Clip Depth Readings
+        if self.p.camera_params.max_depth_meters < np.inf:
+            inf_mask = np.isinf(depth_imgs_meters)
+            max_depth_mask = depth_imgs_meters >= self.p.camera_params.max_depth_meters
+            mask = np.logical_and(np.logical_not(inf_mask), max_depth_mask)
+            depth_imgs_meters[mask] = self.p.camera_params.max_depth_meters
+
+        # Project the depth images into the (x, y, z) bins around the
+        # robot's location(s) in the map (without materializing the point cloud)
+        depth_projector = self.get_depth_projector(
+            map_size, z_bins, xy_resolution)
+        count, isvalid = depth_projector.project(depth_imgs_meters, pos_3)
+        if copy_counts:
+            count = count.copy()
+        return disparity_imgs_cm, count, isvalid
+
+    def get_depth_projector(self, map_size, z_bins, xy_resolution):
+        """
+        The depth projector (with the precomputed rays of the camera)
+        for these bins, only constructed the first time it is needed.
+        """
+        key = (map_size, tuple(z_bins), xy_resolution)
+        if key not in self.depth_projectors:
+            r_obj = self.building.r_obj
+            robot = self.p.robot_params.physical_params
+            assert (r_obj.fov_horizontal == r_obj.fov_vertical)
+            cm = du.get_camera_matrix(
+                r_obj.width, r_obj.height, r_obj.fov_vertical)
+            self.depth_projectors[key] = du.DepthProjector(
+                cm, r_obj.height, r_obj.width, robot.sensor_height,
+                robot.camera_elevation_degree, map_size, z_bins, xy_resolution)
+        return self.depth_projectors[key]
+
     def _get_topview(self, starts_n2, thetas_n1, crop_size=[64, 64]):
         """
         Render crop_size  topview(s) from the x, y, theta locations
         in starts and thetas.
         """
+        from mp_env import map_utils as mu
         # SBPD only supports square top views currently
         assert(crop_size[0] == crop_size[1])
 
@@ -191,57 +285,6 @@ class SocNavRenderer():
             crop_mk[:, :, None]) * 1.0 for crop_mk in crops_nmk]
         return np.array(crops_nmk1)
 
-    def _get_depth_image(self, starts_n2, thetas_n1, xy_resolution, map_size, pos_3, human_visible=True):
-        """
-        Render analytically projected depth images at the locations in
-        starts, thetas. Bin data inside bins in a resolution of xy_resolution along x and y axis and
-        z_bins in the z direction. Z Direction is the vertical z = 0 is floor. """
-        r_obj = self.building.r_obj
-        robot = self.building.robot
-        z_bins = [-10, robot.base, robot.base + robot.height]
-
-        nodes_n3 = np.concatenate(
-            [starts_n2 * 1., thetas_n1 / self.building.robot.delta_theta], axis=1)
-        # Disparity in centimeters
-        disparity_imgs_cm = np.array(self.building.render_nodes(
-            nodes_n3, 'disparity', human_visible=human_visible))
-
-        depth_imgs_meters = 100. / \
-            (disparity_imgs_cm[..., 1] + 0.000001)  # no divide by 0 error
-
-        # Optionally Clip Depth Readings
-        if self.p.camera_params.max_depth_meters < np.inf:
-            inf_mask = np.isinf(depth_imgs_meters)
-            max_depth_mask = depth_imgs_meters >= self.p.camera_params.max_depth_meters
-            mask = np.logical_and(np.logical_not(inf_mask), max_depth_mask)
-            depth_imgs_meters[mask] = self.p.camera_params.max_depth_meters
-
-        assert (r_obj.fov_horizontal == r_obj.fov_vertical)
-        # Generate a Point Cloud from the Depth Image
-        # (In the Camera Coordinate System)
-        cm = du.get_camera_matrix(
-            r_obj.width, r_obj.height, r_obj.fov_vertical)
-        XYZ = du.get_point_cloud_from_z(depth_imgs_meters, cm)
-        XYZ = XYZ * 100.  # convert to centimeters
-
-        # Transform from the camera coordinate system
-        # to the geocentric coordinate system (align the point cloud to the ground plane)
-        XYZ = du.make_geocentric(
-            XYZ, robot.sensor_height, robot.camera_elevation_degree)
-
-        # Note: Added here to get the depth image in the current frame
-        # Transform from the ground plane to the robots current
-        # location in the map
-        XYZ = self.transform_to_current_frame(XYZ[0], pos_3)
-        XYZ = XYZ[None, :, :, :]
-
-        count, isvalid = du.bin_points(
-            XYZ * 1., map_size, z_bins, xy_resolution)
-        count = [x[0, ...] for x in np.split(count, count.shape[0], 0)]
-        isvalid = [x[0, ...] for x in np.split(isvalid, isvalid.shape[0], 0)]
-
-        return disparity_imgs_cm, count, isvalid
-
     def transform_to_current_frame(self, XYZ, current_loc):
         R = du.get_r_matrix([0., 0., 1.], angle=current_loc[2] - np.pi / 2.)
         XYZ = np.matmul(XYZ.reshape(-1, 3), R.T).reshape(XYZ.shape)
@@ -263,6 +306,15 @@ class SocNavRenderer():
                                        self.p.building_params.building_name)
 
         if self.p.building_params.load_traversible_from_pickle_file or not self.p.building_params.load_meshes:
+            # prefer the memory-mapped traversible of the building's map bundle
+            # (unless data.pkl changed since the bundle was generated)
+            bundle_dir = mb.get_map_bundle_dir(self.p.building_params.building_name,
+                                               self.p.traversible_dir)
+            metadata = mb.load_bundle_metadata(bundle_dir)
+            if metadata is not None and mb.source_matches(bundle_dir, metadata):
+                traversible = mb.load_bundle_array(bundle_dir, 'traversible')
+                if traversible is not None:
+                    return metadata['resolution'], traversible
             filename = os.path.join(traversible_dir, 'data.pkl')
             with open(filename, 'rb') as f:
                 data = pickle.load(f)
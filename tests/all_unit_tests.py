@@ -1,32 +1,66 @@
+from unit_tests.test_control_pipeline_online import main_test as test_control_pipeline_online
 from unit_tests.test_coordinate_transform import main_test as test_coordinate_transform
 from unit_tests.test_cost_function import main_test as test_cost_function
 from unit_tests.test_costs import main_test as test_cost
+from unit_tests.test_depth_utils import main_test as test_depth_utils
 from unit_tests.test_dynamics import main_test as test_dynamics
+from unit_tests.test_episode_recording import main_test as test_episode_recording
 from unit_tests.test_fmm_map import main_test as test_fmm_map
+from unit_tests.test_frozen_params import main_test as test_frozen_params
 from unit_tests.test_goal_angle_objective import main_test as test_goal_angle
+from unit_tests.test_goal_directed_grid import main_test as test_goal_directed_grid
 from unit_tests.test_goal_distance_objective import main_test as test_goal_distance
+from unit_tests.test_human_meshes import main_test as test_human_meshes
+from unit_tests.test_human_occupancy import main_test as test_human_occupancy
 from unit_tests.test_image_space_grid import main_test as test_image_space_grid
+from unit_tests.test_joystick_cadence import main_test as test_joystick_cadence
 from unit_tests.test_lqr import main_test as test_lqr
+from unit_tests.test_map_bundle import main_test as test_map_bundle
+from unit_tests.test_map_registry import main_test as test_map_registry
 from unit_tests.test_obstacle_map import main_test as test_obstacle_map
 from unit_tests.test_obstacle_objective import main_test as test_obstacle_objective
+from unit_tests.test_replan_cadence import main_test as test_replan_cadence
+from unit_tests.test_sampling_planner import main_test as test_sampling_planner
+from unit_tests.test_scoring_utils import main_test as test_scoring_utils
+from unit_tests.test_sim_metrics import main_test as test_sim_metrics
 from unit_tests.test_spline import main_test as test_spline
+from unit_tests.test_topview_render import main_test as test_topview_render
+from unit_tests.test_trajectory import main_test as test_trajectory
+from unit_tests.test_traversibility import main_test as test_traversibility
 from unit_tests.test_voxel_interpolation import main_test as test_voxel_interpolation
 from unit_tests.test_personal_cost import main_test as test_goal_psc
 from utils.utils import color_reset, color_green
 
 if __name__ == '__main__':
+    test_control_pipeline_online()
     test_coordinate_transform()
     test_cost_function()
     test_cost()
+    test_depth_utils()
     test_dynamics()
+    test_episode_recording()
     test_fmm_map()
+    test_frozen_params()
     test_goal_angle()
+    test_goal_directed_grid()
     test_goal_distance()
     test_goal_psc()
+    test_human_meshes()
+    test_human_occupancy()
     test_image_space_grid()
+    test_joystick_cadence()
     test_lqr()
+    test_map_bundle()
+    test_map_registry()
     test_obstacle_map()
     test_obstacle_objective()
+    test_replan_cadence()
+    test_sampling_planner()
+    test_scoring_utils()
+    test_sim_metrics()
     test_spline()
+    test_topview_render()
+    test_trajectory()
+    test_traversibility()
     test_voxel_interpolation()
     print("%s\nAll tests passed!%s" % (color_green, color_reset))
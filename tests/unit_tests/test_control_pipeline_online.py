@@ -0,0 +1,124 @@
+import numpy as np
+from dotmap import DotMap
+from params.central_params import create_control_pipeline_params
+from control_pipelines.control_pipeline_online import ControlPipelineOnline
+from utils.utils import generate_config_from_pos_3, color_green, color_reset
+
+
+def create_pipeline(min_waypoints=100, max_waypoints=300):
+    p = create_control_pipeline_params()
+    p.pipeline = ControlPipelineOnline
+    p.online_params = DotMap(latency_budget_s=10.,
+                             min_waypoints=min_waypoints,
+                             max_waypoints=max_waypoints)
+    control_pipeline = ControlPipelineOnline(p)
+    # nothing is precomputed
+    assert(control_pipeline.does_pipeline_exist())
+    control_pipeline.load_control_pipeline()
+    return control_pipeline
+
+
+def test_online_plan():
+    control_pipeline = create_pipeline()
+    dt = control_pipeline.params.dt
+    # a start speed between the velocity bins
+    start_config = generate_config_from_pos_3(np.array([5., 5., 0.3]), dt=dt,
+                                              v=0.47)
+    goal_config = generate_config_from_pos_3(np.array([8., 9., 0.]), dt=dt)
+    waypts, horizons, trajectories_lqr, trajectories_spline, _ = \
+        control_pipeline.plan(start_config, goal_config)
+    n = waypts.n
+    assert(0 < n <= 300)
+    assert(trajectories_lqr.n == n and trajectories_spline.n == n)
+    assert(horizons.shape == (n,))
+    assert(np.all(horizons <= control_pipeline.params.planning_horizon_s))
+
+    # the splines start at start_config (with its exact speed)
+    assert(np.allclose(trajectories_spline.position_nk2()[:, 0],
+                       start_config.position_nk2()[:, 0], atol=1e-5))
+    assert(np.allclose(trajectories_spline.speed_nk1()[:, 0], 0.47, atol=1e-5))
+    assert(np.allclose(trajectories_lqr.position_nk2()[:, 0],
+                       start_config.position_nk2()[:, 0], atol=1e-5))
+
+    # the waypoints are in the direction of the goal
+    waypt_dirs_n2 = waypts.position_nk2()[:, 0] - start_config.position_nk2()[0]
+    goal_dir_2 = goal_config.position_nk2()[0, 0] - start_config.position_nk2()[0, 0]
+    cos_n = np.sum(waypt_dirs_n2 * goal_dir_2, axis=1) / \
+        (np.linalg.norm(waypt_dirs_n2, axis=1) * np.linalg.norm(goal_dir_2))
+    assert(np.all(cos_n > np.cos(np.deg2rad(30.))))
+
+    # the closest waypoint to the goal
+    waypts, horizons, trajectories_lqr, trajectories_spline, controllers = \
+        control_pipeline.plan(start_config, goal_config, greedy=True)
+    assert(waypts.n == 1 and trajectories_lqr.n == 1 and horizons.shape == (1,))
+    assert(controllers['K_nkfd'].shape[0] == 1)
+
+
+def test_dynamically_feasible():
+    control_pipeline = create_pipeline()
+    dt = control_pipeline.params.dt
+    v_max = control_pipeline.system_dynamics.v_bounds[1]
+    w_max = control_pipeline.system_dynamics.w_bounds[1]
+    tolerance = 1. + control_pipeline.horizon_tolerance
+    goal_config = generate_config_from_pos_3(np.array([8., 9., 0.]), dt=dt)
+    for v0 in [0., 0.47, 0.9, 1.1]:
+        start_config = generate_config_from_pos_3(np.array([5., 5., 0.3]),
+                                                  dt=dt, v=v0)
+        waypts, horizons, _, trajectories_spline, _ = \
+            control_pipeline.plan(start_config, goal_config)
+        assert(waypts.n > 0)
+        # the refit splines respect the speed bounds over their horizons
+        assert(np.max(trajectories_spline.speed_nk1()) <= v_max * tolerance)
+        assert(np.max(np.abs(trajectories_spline.angular_speed_nk1())) <=
+               w_max * tolerance)
+        assert(np.allclose(trajectories_spline.speed_nk1()[:, 0], v0,
+                           atol=1e-5))
+
+
+def test_unconverged_refits():
+    control_pipeline = create_pipeline()
+    # the splines whose horizons have not converged are dropped
+    control_pipeline.max_refits = 1
+    dt = control_pipeline.params.dt
+    v_max = control_pipeline.system_dynamics.v_bounds[1]
+    w_max = control_pipeline.system_dynamics.w_bounds[1]
+    tolerance = 1. + control_pipeline.horizon_tolerance
+    goal_config = generate_config_from_pos_3(np.array([8., 9., 0.]), dt=dt)
+    for v0 in [0., 0.47, 0.9, 1.1]:
+        start_config = generate_config_from_pos_3(np.array([5., 5., 0.3]),
+                                                  dt=dt, v=v0)
+        waypts, horizons, _, trajectories_spline, _ = \
+            control_pipeline.plan(start_config, goal_config)
+        assert(waypts.n > 0 and horizons.shape == (waypts.n,))
+        assert(np.max(trajectories_spline.speed_nk1()) <= v_max * tolerance)
+        assert(np.max(np.abs(trajectories_spline.angular_speed_nk1())) <=
+               w_max * tolerance)
+
+
+def test_latency_budget():
+    control_pipeline = create_pipeline(min_waypoints=50, max_waypoints=20000)
+    dt = control_pipeline.params.dt
+    start_config = generate_config_from_pos_3(np.array([0., 0., 0.]), dt=dt,
+                                              v=0.2)
+    # the first plan is to the minimum number of waypoints
+    assert(len(control_pipeline._select_waypt_idxs(start_config)) == 50)
+    control_pipeline.plan(start_config)
+    assert(control_pipeline.time_per_waypt_s > 0.)
+    # then as many as fit in the budget
+    control_pipeline.time_per_waypt_s = 1e-3
+    assert(len(control_pipeline._select_waypt_idxs(start_config)) == 10000)
+    control_pipeline.time_per_waypt_s = 1.
+    assert(len(control_pipeline._select_waypt_idxs(start_config)) == 50)
+
+
+def main_test():
+    test_online_plan()
+    test_dynamically_feasible()
+    test_unconverged_refits()
+    test_latency_budget()
+    print("%sOnline control pipeline tests passed!%s" %
+          (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
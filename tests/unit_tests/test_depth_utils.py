@@ -0,0 +1,164 @@
+import numpy as np
+from dotmap import DotMap
+from socnav.socnav_renderer import SocNavRenderer
+from utils import depth_utils as du
+from utils.utils import color_green, color_reset
+
+height, width, fov = 60, 80, 45.
+map_size, xy_resolution = 300, 5.
+robot = DotMap(base=5., height=100., sensor_height=80.,
+               camera_elevation_degree=-15., delta_theta=1.)
+z_bins = [-10, robot.base, robot.base + robot.height]
+
+
+def project_depth_image(depth_hw, pos_3, cm, sensor_height, elevation,
+                        map_size, z_bins, xy_resolution):
+    """The (unfused) point cloud pipeline of the SocNavRenderer"""
+    # (the missing readings give nan points)
+    with np.errstate(invalid='ignore'):
+        XYZ = du.get_point_cloud_from_z(depth_hw[None], cm) * 100.
+        XYZ = du.make_geocentric(XYZ, sensor_height, elevation)[0]
+        R = du.get_r_matrix([0., 0., 1.], angle=pos_3[2] - np.pi / 2.)
+        XYZ = np.matmul(XYZ.reshape(-1, 3), R.T).reshape(XYZ.shape)
+        XYZ[:, :, 0] += pos_3[0] * 100.
+        XYZ[:, :, 1] += pos_3[1] * 100.
+        return du.bin_points(XYZ[None], map_size, z_bins, xy_resolution)
+
+
+def test_depth_projector():
+    sensor_height, elevation = 80., -15.
+    cm = du.get_camera_matrix(width, height, fov)
+    depth_nhw = create_depth_images(3)
+    # missing readings
+    depth_nhw[0, :5] = np.inf
+    depth_nhw[1, 10:20, :5] = np.nan
+    pos_n3 = np.array([[4., 5., .3], [10., 3., -2.], [7.5, 7.5, np.pi / 2.]])
+
+    projector = du.DepthProjector(cm, height, width, sensor_height, elevation,
+                                  map_size, z_bins, xy_resolution)
+    for _ in range(2):  # the buffer is reused
+        counts, isvalids = projector.project(depth_nhw, pos_n3)
+        assert(counts.shape == (3, map_size, map_size, len(z_bins) + 1))
+        assert(isvalids.shape == (3, height, width, 1))
+        for i in range(3):
+            count, isvalid = project_depth_image(
+                depth_nhw[i], pos_n3[i], cm, sensor_height, elevation,
+                map_size, z_bins, xy_resolution)
+            assert(np.array_equal(counts[i], count[0]))
+            assert(np.array_equal(isvalids[i], isvalid[0]))
+            assert(counts[i].sum() == isvalids[i].sum())
+
+    # a single image and location
+    counts, isvalids = projector.project(depth_nhw[2], pos_n3[2])
+    assert(len(counts) == 1)
+    count, _ = project_depth_image(depth_nhw[2], pos_n3[2], cm, sensor_height,
+                                   elevation, map_size, z_bins, xy_resolution)
+    assert(np.array_equal(counts[0], count[0]))
+
+
+def create_depth_images(n):
+    rng = np.random.RandomState(0)
+    return rng.uniform(.3, 8., (n, height, width))
+
+
+class StubBuilding(object):
+    """Renders the given depth images (as disparity) in a single batch"""
+
+    def __init__(self, depth_nhw):
+        self.depth_nhw = depth_nhw
+        self.robot = robot
+        self.r_obj = DotMap(width=width, height=height, fov_horizontal=fov,
+                            fov_vertical=fov)
+        self.batches = []
+
+    def render_nodes_batch(self, nodes, modalities, human_visible=True):
+        self.batches.append((nodes, modalities))
+        disparity_nhw2 = np.stack([np.zeros_like(self.depth_nhw),
+                                   100. / self.depth_nhw], axis=3)
+        return {'disparity': disparity_nhw2[:len(nodes)]}
+
+
+def create_renderer(depth_nhw, load_meshes=True, max_depth_meters=np.inf):
+    renderer = SocNavRenderer.__new__(SocNavRenderer)
+    renderer.p = DotMap(building_params=DotMap(load_meshes=load_meshes),
+                        camera_params=DotMap(width=width, height=height,
+                                             im_resize=1.,
+                                             max_depth_meters=max_depth_meters),
+                        robot_params=DotMap(physical_params=robot))
+    renderer.building = StubBuilding(depth_nhw)
+    renderer.depth_projectors = {}
+    return renderer
+
+
+def test_render_depth_occupancy():
+    depth_nhw = create_depth_images(3)
+    cm = du.get_camera_matrix(width, height, fov)
+    starts_n2 = np.array([[80., 100.], [200., 60.], [150., 150.]])
+    thetas_n1 = np.array([[.3], [-2.], [np.pi / 2.]])
+    pos_n3 = np.concatenate([starts_n2 * .05, thetas_n1], axis=1)
+
+    # all the poses are rendered and projected in one call
+    renderer = create_renderer(depth_nhw)
+    disparity_nhw2, counts, isvalids = renderer.render_depth_occupancy(
+        starts_n2, thetas_n1, xy_resolution, map_size, pos_n3)
+    assert(len(renderer.building.batches) == 1)
+    assert(renderer.building.batches[0][1] == ['disparity'])
+    assert(disparity_nhw2.shape == (3, height, width, 2))
+    assert(counts.shape == (3, map_size, map_size, len(z_bins) + 1))
+    assert(isvalids.shape == (3, height, width, 1))
+    for i in range(3):
+        count, isvalid = project_depth_image(
+            100. / (disparity_nhw2[i, ..., 1] + 0.000001), pos_n3[i], cm,
+            robot.sensor_height, robot.camera_elevation_degree, map_size,
+            z_bins, xy_resolution)
+        assert(np.array_equal(counts[i], count[0]))
+        assert(np.array_equal(isvalids[i], isvalid[0]))
+        assert(counts[i].sum() > 0)
+
+    # the counts are copies of the projector's buffer unless asked otherwise
+    assert(len(renderer.depth_projectors) == 1)
+    _, counts_view, _ = renderer.render_depth_occupancy(
+        starts_n2, thetas_n1, xy_resolution, map_size, pos_n3,
+        copy_counts=False)
+    assert(np.array_equal(counts_view, counts))
+    projector = renderer.get_depth_projector(map_size, z_bins, xy_resolution)
+    assert(np.shares_memory(counts_view, projector.counts))
+    assert(not np.shares_memory(counts, projector.counts))
+    assert(len(renderer.depth_projectors) == 1)
+    renderer.building.batches = renderer.building.batches[:1]
+
+    # the given disparity images are projected from a single location
+    _, counts_2, _ = renderer.render_depth_occupancy(
+        starts_n2, thetas_n1, xy_resolution, map_size, pos_n3[0],
+        disparity_imgs_cm=disparity_nhw2)
+    assert(len(renderer.building.batches) == 1)
+    assert(np.array_equal(counts_2[0], counts[0]))
+    assert(not np.array_equal(counts_2[1], counts[1]))
+
+    # the depth readings are clipped
+    renderer = create_renderer(depth_nhw, max_depth_meters=1.)
+    _, counts, _ = renderer.render_depth_occupancy(
+        starts_n2, thetas_n1, xy_resolution, map_size, pos_n3)
+    count, _ = project_depth_image(
+        np.minimum(100. / (disparity_nhw2[0, ..., 1] + 0.000001), 1.),
+        pos_n3[0], cm, robot.sensor_height, robot.camera_elevation_degree,
+        map_size, z_bins, xy_resolution)
+    assert(np.array_equal(counts[0], count[0]))
+
+    # nothing is seen without the meshes
+    renderer = create_renderer(depth_nhw, load_meshes=False)
+    disparity_nhw2, counts, isvalids = renderer.render_depth_occupancy(
+        starts_n2, thetas_n1, xy_resolution, map_size, pos_n3)
+    assert(len(disparity_nhw2) == 3 and not np.any(disparity_nhw2))
+    assert(counts.shape == (3, map_size, map_size, len(z_bins) + 1))
+    assert(not np.any(counts) and not np.any(isvalids))
+
+
+def main_test():
+    test_depth_projector()
+    test_render_depth_occupancy()
+    print("%sDepth utils tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
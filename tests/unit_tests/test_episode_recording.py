@@ -0,0 +1,91 @@
+import os
+import tempfile
+import numpy as np
+import imageio.v2 as imageio
+from dotmap import DotMap
+from simulators.episode_recording import EpisodeRecorder, EpisodeRecording, \
+    render_recording, render_failures
+from utils import scoring_utils
+from utils.image_utils import get_topview_frame
+from utils.utils import color_green, color_reset
+from unit_tests.test_topview_render import create_topview_scene
+
+
+def record_episode(filename, num_steps=12):
+    environment, sim_states = create_topview_scene(num_steps=num_steps)
+    environment["building_name"] = "area3"
+    recorder = EpisodeRecorder(environment, "episode", dt=0.1)
+    for sim_step, sim_state in sim_states.items():
+        recorder.record(sim_step, sim_state)
+    recorder.save(filename)
+    return environment, sim_states
+
+
+def test_episode_recording():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "episode", "episode_recording.npz")
+        environment, sim_states = record_episode(filename)
+        recording = EpisodeRecording(filename)
+        assert(recording.num_steps == len(sim_states))
+        rec_env = recording.get_environment()
+        assert(np.array_equal(rec_env["map_traversible"],
+                              environment["map_traversible"] > 0))
+        assert(rec_env["building_name"] == "area3")
+
+        for step, s in sim_states.items():
+            frame = get_topview_frame(None, s.get_pedestrians(),
+                                      s.get_robots(), s.get_sim_t(), 0.0)
+            rec_frame = recording.get_frame(step)
+            assert(np.isclose(rec_frame["sim_t"], frame["sim_t"]))
+            for agents in ["pedestrians", "robots"]:
+                assert(rec_frame[agents].keys() == frame[agents].keys())
+                for name, a in frame[agents].items():
+                    rec_a = rec_frame[agents][name]
+                    assert(np.allclose(rec_a.pos_3, a.pos_3, atol=1e-6))
+                    assert(rec_a.collided == a.collided)
+                    assert(rec_a.radius == a.radius)
+                    if agents == "robots":
+                        assert(np.allclose(rec_a.goal_3, a.goal_3))
+                    # the trajectory is the recorded positions (newest first)
+                    if len(rec_a.traj_xy_k2) > 0:
+                        assert(np.allclose(rec_a.traj_xy_k2[0], a.pos_3[:2],
+                                           atol=1e-6))
+            # (same clipping as Trajectory.render, without the first point)
+            robot = rec_frame["robots"]["robot_agent"]
+            assert(len(robot.traj_xy_k2) == step)
+
+
+def test_render_recording():
+    p = DotMap(img_scale=0.6, verbose_printing=False, fps_scale_down=0.5,
+               video_format='gif')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "episode", "episode_recording.npz")
+        record_episode(filename)
+        # selected frames
+        render_recording(filename, output_directory=tmp_dir, frames=[3, 7],
+                         p=p)
+        assert(os.path.exists(os.path.join(tmp_dir, "episode_obs3.png")))
+        assert(os.path.exists(os.path.join(tmp_dir, "episode_obs7.png")))
+        # (nothing is rendered without the success scores)
+        scoring_utils.append_episode_scores(os.path.join(tmp_dir, "no_success"),
+                                            {"episode_name": "episode"})
+        render_failures(os.path.join(tmp_dir, "no_success"), p=p)
+        assert(not os.path.exists(os.path.join(tmp_dir, "episode",
+                                               "movie_episode.gif")))
+        # only the failed episodes of a run are rendered
+        scoring_utils.append_episode_scores(tmp_dir, {"episode_name": "episode",
+                                                      "success": False})
+        render_failures(tmp_dir, p=p)
+        movie = imageio.mimread(os.path.join(tmp_dir, "episode",
+                                             "movie_episode.gif"))
+        assert(len(movie) == 6)
+
+
+def main_test():
+    test_episode_recording()
+    test_render_recording()
+    print("%sEpisode recording tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
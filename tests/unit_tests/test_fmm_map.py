@@ -37,9 +37,35 @@ def test_fmm_map():
     assert np.sum(abs(expected_angles - angles) <= 0.01) == 6
 
 
+def test_obstacle_distance_backends():
+    from utils.fmm_map import FmmMap
+    # Create an occupancy grid with a wall along the bottom and a box in the middle
+    scale = 0.05
+    occupancy_grid_mn = np.zeros((60, 80))
+    occupancy_grid_mn[:5, :] = 1.
+    occupancy_grid_mn[25:35, 30:50] = 1.
+    goal_grid_mn = np.where(occupancy_grid_mn, -1., 1.)
+
+    fmm_map = FmmMap(goal_grid_mn=goal_grid_mn, dx=scale, backend='fmm')
+    edt_map = FmmMap(goal_grid_mn=goal_grid_mn, dx=scale, backend='edt')
+
+    fmm_dists = fmm_map.fmm_distance_map.voxel_function_mn
+    edt_dists = edt_map.fmm_distance_map.voxel_function_mn
+
+    # Exact distances along the axes (and signed inside the obstacles)
+    assert np.isclose(edt_dists[5, 10], 0.5 * scale)
+    assert np.isclose(edt_dists[4, 10], -0.5 * scale)
+    assert np.isclose(edt_dists[15, 10], 10.5 * scale)
+    assert np.isclose(edt_dists[30, 40], -4.5 * scale)
+    # The fmm is a first order approximation of the same euclidean field
+    assert np.max(np.abs(fmm_dists - edt_dists)) <= 2. * scale
+    assert np.all(np.sign(fmm_dists) == np.sign(edt_dists))
+
+
 def main_test():
     np.random.seed(seed=1)
     test_fmm_map()
+    test_obstacle_distance_backends()
     print("%sFmm_map tests passed!%s" % (color_green, color_reset))
 
 
@@ -0,0 +1,70 @@
+import copy
+import pickle
+import numpy as np
+from dotmap import DotMap
+from params.central_params import create_agent_params, get_agent_params
+from params.frozen_params import FrozenParams, freeze_params
+from utils.utils import check_dotmap_equality, color_green, color_reset
+
+
+def test_freeze_params():
+    p = DotMap(a=1, b=[1., 2.], c=DotMap(d=np.ones(3), e='e'), f=DotMap())
+    frozen = freeze_params(p)
+    assert(isinstance(frozen.c, FrozenParams))
+    assert(frozen.a == 1 and frozen.b == (1., 2.) and frozen.c.e == 'e')
+    assert(frozen.get('a') == 1 and frozen.get('g', 2) == 2)
+    assert('c' in frozen and 'g' not in frozen and frozen['a'] == 1)
+    assert(frozen.f.empty() and not frozen.c.empty())
+    assert(list(frozen.keys()) == list(p.keys()))
+    # nothing can be changed
+    for fn in [lambda: setattr(frozen, 'a', 2),
+               lambda: setattr(frozen.c, 'g', 2),
+               lambda: delattr(frozen, 'a')]:
+        try:
+            fn()
+            assert(False)
+        except AttributeError:
+            pass
+    try:
+        frozen.c.d[0] = 2.
+        assert(False)
+    except ValueError:
+        pass
+    # the snapshot is shared rather than copied
+    assert(copy.deepcopy(frozen) is frozen)
+    unpickled = pickle.loads(pickle.dumps(frozen))
+    assert(np.array_equal(unpickled.c.d, frozen.c.d))
+    assert(unpickled.toDict()['c']['e'] == 'e')
+
+
+def test_agent_params():
+    p = get_agent_params()
+    assert(get_agent_params() is p)
+    assert(check_dotmap_equality(create_agent_params(), p))
+    assert(p.radius == create_agent_params().radius)
+    # the planner params are parsed before they are frozen
+    p = get_agent_params(with_planner=True, with_robot=True)
+    assert(p.robot_params.physical_params.radius > 0)
+    expected = create_agent_params(with_planner=True).planner_params
+    expected.planner.parse_params(expected)
+    grid_p = expected.control_pipeline_params.waypoint_params
+    grid = grid_p.grid(grid_p)
+    frozen_grid_p = p.planner_params.control_pipeline_params.waypoint_params
+    frozen_grid = frozen_grid_p.grid(frozen_grid_p)
+    assert(frozen_grid_p.n == grid_p.n == grid.n)
+    assert(np.allclose(frozen_grid_p.bound_min, grid_p.bound_min))
+    assert(np.allclose(frozen_grid_p.bound_max, grid_p.bound_max))
+    for w, frozen_w in zip(grid.sample_egocentric_waypoints(vf=.5),
+                           frozen_grid.sample_egocentric_waypoints(vf=.5)):
+        assert(np.array_equal(w, frozen_w))
+    assert(p.planner_params.planning_horizon == expected.planning_horizon)
+
+
+def main_test():
+    test_freeze_params()
+    test_agent_params()
+    print("%sFrozen params tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
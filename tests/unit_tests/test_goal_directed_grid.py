@@ -0,0 +1,126 @@
+import numpy as np
+from dotmap import DotMap
+from params.central_params import create_control_pipeline_params
+from control_pipelines.control_pipeline_online import ControlPipelineOnline
+from waypoint_grids.goal_directed_grid import GoalDirectedGrid
+from utils.voxel_map_utils import VoxelMap
+from utils.utils import generate_config_from_pos_3, color_green, color_reset
+
+
+class WallMap(object):
+    """A straight wall along x = wall_x (the only obstacle)"""
+
+    def __init__(self, wall_x):
+        self.wall_x = wall_x
+
+    def dist_to_nearest_obs(self, pos_nk2):
+        return np.abs(self.wall_x - pos_nk2[:, :, 0])
+
+
+def create_params(num_waypoints=400):
+    p = create_control_pipeline_params()
+    p.pipeline = ControlPipelineOnline
+    p.online_params = DotMap(latency_budget_s=10.,
+                             min_waypoints=100,
+                             max_waypoints=300)
+    p.waypoint_params.grid = GoalDirectedGrid
+    p.waypoint_params.goal_directed_params.num_waypoints = num_waypoints
+    return p
+
+
+def create_grid(num_waypoints=400):
+    p = create_params(num_waypoints)
+    p.waypoint_params.grid.parse_params(p.waypoint_params)
+    return GoalDirectedGrid(p.waypoint_params)
+
+
+def test_sampling():
+    grid = create_grid()
+    gp = grid.params.goal_directed_params
+    # a fixed budget of waypoints
+    assert(grid.n == 400)
+    goal_angle = 0.7
+    wx_n11, wy_n11, wtheta_n11, vf_n11, wf_n11 = \
+        grid.sample_egocentric_waypoints(vf=0., v0=0., goal_angle=goal_angle)
+    for w_n11 in [wx_n11, wy_n11, wtheta_n11, vf_n11, wf_n11]:
+        assert(w_n11.shape == (400, 1, 1))
+    bearing_n = np.arctan2(wy_n11[:, 0, 0], wx_n11[:, 0, 0])
+    radius_n = np.hypot(wx_n11[:, 0, 0], wy_n11[:, 0, 0])
+    # concentrated around the goal direction (inside the cone, which is
+    # centered on the closest ray)
+    ray_spacing = 2. * np.pi / gp.num_rays
+    assert(np.abs(np.median(bearing_n) - goal_angle) < 0.1)
+    assert(np.all(np.abs(bearing_n - goal_angle) <= gp.max_cone + ray_spacing))
+    assert(np.all(radius_n >= gp.min_distance - 1e-4))
+    assert(np.all(radius_n <= gp.max_distance + 1e-4))
+
+    # the pattern is cached per start velocity and the minimum distance
+    # grows with it
+    assert(len(grid.patterns) == 1)
+    wx_n11, wy_n11, _, _, _ = \
+        grid.sample_egocentric_waypoints(vf=0., v0=0.5, goal_angle=goal_angle)
+    assert(len(grid.patterns) == 2)
+    assert(grid._min_distance(0.5) > grid._min_distance(0.))
+    radius_n = np.hypot(wx_n11[:, 0, 0], wy_n11[:, 0, 0])
+    assert(np.all(radius_n >= grid._min_distance(0.5) - 1e-4))
+
+
+def test_free_space():
+    grid = create_grid()
+    gp = grid.params.goal_directed_params
+    # a wall 1m ahead of the robot (which faces +x)
+    start_config = generate_config_from_pos_3(np.array([0., 0., 0.]))
+    free_distances_m = grid.compute_free_distances(WallMap(1.), start_config)
+    assert(free_distances_m.shape == (gp.num_rays,))
+    straight_idx = grid._closest_ray_idxs(np.array([0.]))[0]
+    back_idx = grid._closest_ray_idxs(np.array([np.pi]))[0]
+    assert(np.isclose(free_distances_m[straight_idx],
+                      1. - gp.obstacle_margin - gp.ray_step, atol=gp.ray_step))
+    assert(free_distances_m[back_idx] == gp.max_distance)
+
+    # with the goal ahead (behind the wall) the waypoints stay in front of it
+    wx_n11, _, _, _, _ = grid.sample_egocentric_waypoints(
+        vf=0., v0=0., goal_angle=0., free_distances_m=free_distances_m)
+    assert(np.all(wx_n11 < 1. - gp.obstacle_margin + 1e-4))
+
+    # the cone does not open towards the wall when the robot has to turn
+    lower, upper = grid.compute_free_cone(np.pi, free_distances_m, 2.)
+    assert(np.all(np.cos(np.linspace(lower, upper, 10)) < 1e-6))
+
+
+def test_goal_directed_plan():
+    p = create_params(num_waypoints=200)
+    control_pipeline = ControlPipelineOnline(p)
+    control_pipeline.load_control_pipeline()
+    assert(control_pipeline.goal_directed)
+    dt = control_pipeline.params.dt
+    start_config = generate_config_from_pos_3(np.array([5., 5., 0.]), dt=dt,
+                                              v=0.3)
+    # the fmm angle map points along +y everywhere
+    fmm_map = DotMap(fmm_angle_map=VoxelMap(scale=1., origin_2=np.array([0., 0.]),
+                                            map_size_2=np.array([20, 20]),
+                                            function_array_mn=np.full((20, 20), np.pi / 2.)))
+    waypts, horizons, trajectories_lqr, trajectories_spline, _ = \
+        control_pipeline.plan(start_config, fmm_map=fmm_map,
+                              obstacle_map=WallMap(7.))
+    n = waypts.n
+    assert(0 < n <= 200)
+    assert(trajectories_lqr.n == n and horizons.shape == (n,))
+    assert(np.allclose(trajectories_spline.speed_nk1()[:, 0], 0.3, atol=1e-5))
+    # the waypoints are mostly to the left (along the fmm angle) and in front
+    # of the wall
+    waypt_pos_n2 = waypts.position_nk2()[:, 0]
+    assert(np.median(waypt_pos_n2[:, 1]) > 5.)
+    assert(np.all(waypt_pos_n2[:, 0] < 7.))
+
+
+def main_test():
+    test_sampling()
+    test_free_space()
+    test_goal_directed_plan()
+    print("%sGoal directed grid tests passed!%s" %
+          (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
@@ -0,0 +1,257 @@
+import os
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from dotmap import DotMap
+from agents.humans.human_appearance import HumanAppearance
+from mp_env import map_utils as mu
+from mp_env.mp_env import Building
+from sbpd.sbpd import StanfordBuildingParserDataset
+from utils.utils import generate_config_from_pos_3, color_green, color_reset
+
+speeds = [0.3, 0.9]
+poses = ['pose_a', 'pose_b']
+body_shape = 519
+num_frames = 2
+
+
+class FakeMesh(object):
+    def __init__(self, vertices, name):
+        self.vertices = vertices
+        self.name = name
+
+
+class FakeShape(object):
+    def __init__(self, mesh):
+        self.meshes = [mesh]
+
+
+class StubDataset(StanfordBuildingParserDataset):
+    """The SURREAL directory layout without the meshes, load_human_mesh
+    returns a (deterministic) fake mesh and counts every load"""
+
+    def __init__(self, data_dir, human_mesh_cache_size, poses_per_bin=0):
+        surreal_params = DotMap(data_dir=data_dir,
+                                human_mesh_cache_size=human_mesh_cache_size,
+                                human_mesh_poses_per_bin=poses_per_bin,
+                                reload_human_meshes=True,
+                                compute_human_traversible=False)
+        super().__init__('all', surreal_params=surreal_params)
+        self.loaded = []
+
+    def load_human_mesh(self, human_materials, mesh_dir, frame, gender):
+        self.loaded.append((mesh_dir, frame))
+        # a small mesh (with its feet above the ground) centered at (1, 2)
+        vertices = np.array([[1., 2., .1], [1.2, 2., .1], [1., 2.3, 1.8]])
+        vertices[:, 2] += 0.01 * frame
+        return [FakeShape(FakeMesh(vertices, 'human_mesh'))], \
+            np.array([1., 2., 0.])
+
+
+class StubRenderer(object):
+    """Records the entities loaded into (and updated in) the scene"""
+
+    def __init__(self):
+        self.num_entities = 0
+        self.loaded = []
+        self.updated = []
+        self.removed = []
+
+    def load_shapes(self, shapess, dedup_tbo=False, allow_repeat_humans=False):
+        self.num_entities += 1
+        self.loaded.append(shapess[0].meshes[0].name)
+        return ['human_%d' % self.num_entities]
+
+    def update_entity_mesh(self, entity_id, mesh):
+        self.updated.append((entity_id, mesh.vertices.copy()))
+
+    def remove_human(self, name):
+        self.removed.append(name)
+
+
+class StubHuman(object):
+    def __init__(self, name, pos_3, speed, mesh_seed=1, texture=0):
+        self.name = name
+        self.config = generate_config_from_pos_3(pos_3, v=speed)
+        self.appearance = HumanAppearance('male', ['texture_%d.jpg' % texture],
+                                          body_shape,
+                                          np.random.RandomState(mesh_seed))
+
+    def get_name(self):
+        return self.name
+
+    def get_appearance(self):
+        return self.appearance
+
+    def get_current_config(self):
+        return self.config
+
+
+def create_surreal_dir(data_dir):
+    for speed in speeds:
+        for pose in poses:
+            gender_dir = os.path.join(data_dir, 'velocity_%.2f_m_s' % speed,
+                                      pose, 'body_shape_%d' % body_shape,
+                                      'male')
+            os.makedirs(gender_dir)
+            for frame in range(num_frames):
+                open(os.path.join(gender_dir, 'human_mesh_%d.obj' % frame),
+                     'w').close()
+
+
+def create_building(dataset):
+    HumanAppearance.dataset = dataset
+    building = Building.__new__(Building)
+    building.map = DotMap(origin=np.array([0., 0.]))
+    building.r_obj = StubRenderer()
+    building.renderer_entitiy_ids = []
+    building.people = {}
+    building.human_meshes_in_scene = {}
+    building.human_mesh_cache = OrderedDict()
+    building.human_occupancy = mu.HumanOccupancy(np.ones((10, 10), dtype=bool))
+    return building
+
+
+def test_human_mesh_cache():
+    with tempfile.TemporaryDirectory() as data_dir:
+        create_surreal_dir(data_dir)
+        dataset = StubDataset(data_dir, human_mesh_cache_size=3)
+        building = create_building(dataset)
+        # the directory listings are cached
+        dataset.sample_human_mesh_info(0.3, 'male', body_shape,
+                                       np.random.RandomState(0))
+        assert(data_dir in dataset.listdir_cache)
+        os.makedirs(os.path.join(data_dir, 'velocity_2.00_m_s'))
+        assert(dataset.get_velocity_dir(2.) ==
+               os.path.join(data_dir, 'velocity_0.90_m_s'))
+
+        # same mesh (appearance, speed bin, pose and frame) is only loaded
+        # once, no matter the exact speed
+        human = StubHuman('ped_1', [3., 4., 0.], 0.3)
+        mesh_1 = building.get_human_mesh(human)
+        human = StubHuman('ped_2', [5., 1., 1.], 0.35)
+        mesh_2 = building.get_human_mesh(human)
+        assert(mesh_1 is mesh_2)
+        assert(len(dataset.loaded) == 1)
+        # (in the canonical position with its feet on the ground)
+        assert(np.isclose(mesh_1['ego_vertices'][:, 2].min(), 0.))
+        assert(np.allclose(mesh_1['ego_vertices'][0, :2], 0.))
+        # keyed by the appearance and speed bin (which repeat)
+        key = next(iter(building.human_mesh_cache))
+        assert(key == ('male', body_shape, 'texture_0.jpg',
+                       os.path.join(data_dir, 'velocity_0.30_m_s')))
+
+        # the other speed bin is a different mesh
+        mesh_3 = building.get_human_mesh(StubHuman('ped_3', [3., 4., 0.], 0.9))
+        assert(mesh_3 is not mesh_1)
+        assert(mesh_3['velocity_dir'] != mesh_1['velocity_dir'])
+        assert(len(dataset.loaded) == 2)
+
+        # least recently used humans are evicted (at most 3 meshes are kept)
+        for texture in range(1, 20):
+            for speed in speeds:
+                building.get_human_mesh(StubHuman('ped', [3., 4., 0.], speed,
+                                                  texture=texture))
+            assert(sum(len(meshes) for meshes in
+                       building.human_mesh_cache.values()) <= 3)
+        assert(key not in building.human_mesh_cache)
+        last_key = next(reversed(building.human_mesh_cache))
+        assert(last_key[2] == 'texture_19.jpg')
+
+        # the cache can be disabled
+        dataset.surreal_params.human_mesh_cache_size = 0
+        building = create_building(dataset)
+        building.get_human_mesh(StubHuman('ped', [3., 4., 0.], 0.3))
+        assert(len(building.human_mesh_cache) == 0)
+    HumanAppearance.dataset = None
+
+
+def test_poses_per_bin():
+    num_poses = len(poses) * num_frames
+    with tempfile.TemporaryDirectory() as data_dir:
+        create_surreal_dir(data_dir)
+        # every sampled pose is loaded (once)
+        dataset = StubDataset(data_dir, human_mesh_cache_size=64)
+        building = create_building(dataset)
+        human = StubHuman('ped_1', [3., 4., 0.], 0.3)
+        human_meshes = [building.get_human_mesh(human) for _ in range(40)]
+        assert(len(dataset.loaded) == num_poses)
+        assert(len(set(id(mesh) for mesh in human_meshes)) == num_poses)
+
+        # unless the human already has poses_per_bin poses in the speed bin
+        dataset = StubDataset(data_dir, human_mesh_cache_size=64,
+                              poses_per_bin=2)
+        building = create_building(dataset)
+        human = StubHuman('ped_1', [3., 4., 0.], 0.3)
+        human_meshes = [building.get_human_mesh(human) for _ in range(40)]
+        assert(len(dataset.loaded) == 2)
+        # (whose poses still change)
+        assert(len(set(id(mesh) for mesh in human_meshes)) == 2)
+        building.get_human_mesh(StubHuman('ped_1', [3., 4., 0.], 0.9))
+        assert(len(dataset.loaded) == 3)
+    HumanAppearance.dataset = None
+
+
+def test_move_human():
+    with tempfile.TemporaryDirectory() as data_dir:
+        create_surreal_dir(data_dir)
+        dataset = StubDataset(data_dir, human_mesh_cache_size=8,
+                              poses_per_bin=1)
+        building = create_building(dataset)
+        r_obj = building.r_obj
+
+        human = StubHuman('ped_1', [3., 4., 0.], 0.3)
+        building.update_human(human)
+        assert(len(r_obj.loaded) == 1 and len(dataset.loaded) == 1)
+        # the shared cached mesh keeps its name
+        human_mesh, entity_ids = building.human_meshes_in_scene['ped_1']
+        assert(r_obj.loaded[0] == 'human_meshped_1')
+        assert(human_mesh['shapess'][0].meshes[0].name == 'human_mesh')
+
+        # a human whose (sampled) pose is unchanged is only moved, i.e. the
+        # vertices of its entity are updated
+        human = StubHuman('ped_1', [5., 6., np.pi / 2.], 0.35)
+        building.update_human(human)
+        assert(len(r_obj.loaded) == 1 and len(dataset.loaded) == 1)
+        assert(r_obj.updated[-1][0] == entity_ids[0])
+        vertices = r_obj.updated[-1][1]
+        expected = building._transform_to_world(human_mesh['ego_vertices'],
+                                                np.array([5., 6., np.pi / 2.]))
+        assert(np.allclose(vertices, expected))
+        assert(building.people['ped_1'] is human)
+
+        # a new speed bin reloads the human (with a mesh of that speed)
+        building.update_human(StubHuman('ped_1', [5., 6., 0.], 0.9))
+        assert(r_obj.removed == ['ped_1'])
+        assert(len(r_obj.loaded) == 2)
+        assert('0.90' in building.human_meshes_in_scene['ped_1'][0]['velocity_dir'])
+
+        # so does a new pose
+        dataset.surreal_params.human_mesh_poses_per_bin = 0
+        human = StubHuman('ped_1', [5., 7., 0.], 0.9)
+        num_loaded, num_updated = len(r_obj.loaded), len(r_obj.updated)
+        for _ in range(10):
+            building.update_human(human)
+        num_loaded = len(r_obj.loaded) - num_loaded
+        num_updated = len(r_obj.updated) - num_updated
+        assert(num_loaded > 0 and num_updated > 0)
+        assert(num_loaded + num_updated == 10)
+
+        # without reload_human_meshes the pose is kept (in the speed bin)
+        dataset.surreal_params.reload_human_meshes = False
+        num_loaded = len(r_obj.loaded)
+        for _ in range(10):
+            building.update_human(human)
+        assert(len(r_obj.loaded) == num_loaded)
+    HumanAppearance.dataset = None
+
+
+def main_test():
+    test_human_mesh_cache()
+    test_poses_per_bin()
+    test_move_human()
+    print("%sHuman mesh tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
@@ -0,0 +1,146 @@
+import numpy as np
+import scipy.ndimage
+from skimage import morphology
+from mp_env import map_utils as mu
+from params.central_params import create_building_params
+from utils.utils import Foo, color_green, color_reset
+
+# robot base, height and radius (cm) and the env of the sbpd Loader
+robot = Foo(base=5., height=100., radius=20.)
+env = Foo(resolution=5, num_point_threshold=2, valid_min=-10, valid_max=200,
+          n_samples_per_face=200)
+
+
+class BoxShape(object):
+    """Points sampled (uniformly) in boxes, in place of a human mesh"""
+
+    def __init__(self, boxes, seed=0):
+        self.boxes = boxes
+        self.seed = seed
+
+    def get_number_of_meshes(self):
+        return 1
+
+    def sample_points_on_face_of_shape(self, i, n_samples_per_face, sc):
+        rng = np.random.RandomState(self.seed)
+        p = np.concatenate([rng.uniform(lo, hi, (4000, 3))
+                            for lo, hi in self.boxes], axis=0) * sc
+        face_idx = np.arange(len(p)) // n_samples_per_face
+        face_areas = np.ones(face_idx[-1] + 1) * n_samples_per_face
+        return p, face_areas, face_idx
+
+
+def create_map(size=(120, 100)):
+    traversible = np.ones(size[::-1], dtype=bool)
+    traversible[:3] = False
+    return Foo(origin=np.array([0., 0.]), size=np.array(size),
+               resolution=env.resolution, _traversible=traversible,
+               traversible=traversible)
+
+
+def human_shape(x, y, hollow=False, seed=0):
+    """A (ring shaped if hollow) human of about 60cm wide at (x, y) meters"""
+    if hollow:
+        boxes = [((x - .3, y - .3, 0), (x + .3, y - .2, 1.7)),
+                 ((x - .3, y + .2, 0), (x + .3, y + .3, 1.7)),
+                 ((x - .3, y - .3, 0), (x - .2, y + .3, 1.7)),
+                 ((x + .2, y - .3, 0), (x + .3, y + .3, 1.7))]
+    else:
+        boxes = [((x - .3, y - .2, 0), (x + .3, y + .2, 1.7))]
+    return [BoxShape(boxes, seed)]
+
+
+def occupied_full_map(map, shapess):
+    """The (whole map) space occupied by the human, computed as in the
+    original add_human_to_traversible"""
+    p, face_areas, face_idx = shapess[0].sample_points_on_face_of_shape(
+        0, env.n_samples_per_face, 100.)
+    wt = face_areas[face_idx] / env.n_samples_per_face
+    ind = np.logical_and(p[:, 2] > robot.base,
+                         p[:, 2] < robot.base + robot.height)
+    num_obstacle_points = np.zeros((map.size[1], map.size[0]))
+    cells = np.round((p[ind, :2] - map.origin) / map.resolution).astype(int)
+    # ignore the points outside of the map
+    in_map = np.all((cells >= 0) & (cells < map.size), axis=1)
+    ind[ind] = in_map
+    cells = cells[in_map]
+    np.add.at(num_obstacle_points, (cells[:, 1], cells[:, 0]), wt[ind])
+    img = num_obstacle_points > env.num_point_threshold
+    # _fill_holes
+    l, n = scipy.ndimage.label(np.logical_not(img))
+    cnts = np.bincount(l.reshape(-1))
+    thresh = create_building_params().building_thresh
+    for i, cnt in enumerate(cnts):
+        if cnt < thresh:
+            l[l == i] = -1
+    img[l == -1] = True
+    selem = morphology.disk(robot.radius / map.resolution)
+    return scipy.ndimage.binary_dilation(img, selem)
+
+
+def compute_occupancy(map, shapess, center_2):
+    return mu.compute_human_occupancy(
+        map, robot.base, robot.height, robot.radius, env.valid_min,
+        env.valid_max, env.num_point_threshold, shapess=shapess, sc=100.,
+        n_samples_per_face=env.n_samples_per_face, human_xy_center_2=center_2)
+
+
+def test_human_occupancy_patch():
+    map = create_map()
+    # inside the map, with a small hole, and against the edge of the map
+    for x, y, hollow in [(2., 2.5, False), (3., 3., True), (.2, 4., True)]:
+        shapess = human_shape(x, y, hollow=hollow)
+        window, occupied, radius, _ = compute_occupancy(
+            map, shapess, np.array([x, y]))
+        expected = occupied_full_map(map, shapess)
+        assert(occupied.shape[0] < expected.shape[0] / 2)
+        assert(np.array_equal(occupied, expected[window]))
+        # nothing is occupied outside of the window
+        expected[window] = False
+        assert(not expected.any())
+        assert(.3 < radius < .5)
+
+
+def test_human_occupancy_accumulator():
+    map = create_map()
+    occupancy = mu.HumanOccupancy(map._traversible)
+    positions = {'a': (2., 2.5), 'b': (2.3, 2.7), 'c': (4., 4.)}
+
+    def add(name, x, y):
+        window, occupied, _, _ = compute_occupancy(
+            map, human_shape(x, y), np.array([x, y]))
+        occupancy.add(name, window, occupied)
+
+    def assert_occupancy(positions):
+        expected = np.zeros(map._traversible.shape, dtype=bool)
+        for x, y in positions.values():
+            expected |= occupied_full_map(map, human_shape(x, y))
+        assert(np.array_equal(occupancy.human_traversible, ~expected))
+        assert(np.array_equal(occupancy.traversible,
+                              map._traversible & ~expected))
+
+    for name, (x, y) in positions.items():
+        add(name, x, y)
+    assert_occupancy(positions)
+    # the overlapping humans are reference counted
+    occupancy.remove('a')
+    positions.pop('a')
+    assert_occupancy(positions)
+    # moving a human
+    add('c', 1., 1.)
+    positions['c'] = (1., 1.)
+    assert_occupancy(positions)
+    for name in list(positions.keys()):
+        occupancy.remove(name)
+    assert(np.all(occupancy.counts == 0))
+    assert(np.array_equal(occupancy.traversible, map._traversible))
+
+
+def main_test():
+    test_human_occupancy_patch()
+    test_human_occupancy_accumulator()
+    print("%sHuman occupancy tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
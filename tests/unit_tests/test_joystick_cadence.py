@@ -0,0 +1,187 @@
+import os
+import sys
+import numpy as np
+from dotmap import DotMap
+from simulators.sim_state import AgentState
+from trajectory.trajectory import Trajectory
+from utils.utils import generate_config_from_pos_3, color_green, color_reset
+# (the joystick is run from its own directory)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'joystick'))
+from joystick_py.joystick_planner import JoystickWithPlanner, JoystickWithPlannerPosns  # noqa: E402
+
+dt = 0.05
+control_horizon = 4
+replan_interval = 3
+
+
+class StraightPlanner(object):
+    """Plans straight (along +x) trajectories, the speeds of the n-th plan
+    are n + 0.01 * t (to tell the commands apart)"""
+
+    def __init__(self):
+        self.num_plans = 0
+
+    def optimize(self, start_config, goal_config, sim_state_hist=None):
+        self.num_plans += 1
+        k = 40
+        start_2 = start_config.position_nk2()[0, 0]
+        position_1k2 = start_2 + \
+            np.stack([np.arange(k) * dt, np.zeros(k)], axis=1)[None]
+        speed_1k1 = self.num_plans + 0.01 * np.arange(k)[None, :, None]
+        trajectory = Trajectory(dt=dt, n=1, k=k, position_nk2=position_1k2,
+                                speed_nk1=speed_1k1,
+                                heading_nk1=np.zeros((1, k, 1)),
+                                angular_speed_nk1=np.zeros((1, k, 1)))
+        return {'trajectory': trajectory}
+
+
+class SpeedDynamics(object):
+    """The actions are the speeds and angular speeds (like Dubins3D)"""
+
+    def parse_trajectory(self, trajectory):
+        return trajectory.position_and_heading_nk3(), \
+            trajectory.speed_and_angular_speed_nk2()
+
+
+class WorldState(object):
+    def __init__(self, robot_pos_3, pedestrians=None):
+        self.robots = {"robot": AgentState(
+            name="robot", radius=0.2,
+            current_config=generate_config_from_pos_3(robot_pos_3))}
+        self.pedestrians = pedestrians if pedestrians is not None else {}
+
+    def get_pedestrians(self):
+        return self.pedestrians
+
+    def get_robots(self):
+        return self.robots
+
+
+def create_joystick(joystick_class, use_system_dynamics):
+    joystick = joystick_class.__new__(joystick_class)
+    joystick.joystick_params = DotMap(replan_interval=replan_interval,
+                                      replan_clearance=0.5,
+                                      use_system_dynamics=use_system_dynamics)
+    joystick.agent_params = DotMap(dt=dt, control_horizon=control_horizon)
+    joystick.system_dynamics_params = DotMap(v_bounds=[0., 1.2],
+                                             w_bounds=[-1.1, 1.1])
+    joystick.system_dynamics = SpeedDynamics()
+    joystick.planner = StraightPlanner()
+    joystick.goal_config = generate_config_from_pos_3(np.array([100., 0., 0.]))
+    joystick.robot_current = np.array([0., 0., 0.])
+    joystick.robot_v = 0.
+    joystick.robot_w = 0.
+    joystick.sim_states = {}
+    joystick.sim_state_now = WorldState(joystick.robot_current)
+    joystick.joystick_on = True
+    joystick.simulator_joystick_update_ratio = 1
+    joystick.commands = None
+    joystick.plans_since_replan = None
+    joystick.plan_goal_3 = None
+    # the commands are recorded instead of sent to the robot
+    joystick.sent_cmds = []
+    joystick.send_cmds = lambda cmds, send_vel_cmds: \
+        joystick.sent_cmds.append((cmds, send_vel_cmds))
+    return joystick
+
+
+def step(joystick):
+    joystick.joystick_plan()
+    joystick.joystick_act()
+
+
+def sent_speeds(joystick, speed_idx):
+    return np.array([cmd[speed_idx] for cmds, _ in joystick.sent_cmds
+                     for cmd in cmds])
+
+
+def check_cadence(joystick, speed_idx):
+    plan_horizon = control_horizon * replan_interval
+    assert(joystick.plan_horizon() == plan_horizon)
+    # the first plan is buffered for replan_interval control horizons
+    for i in range(replan_interval):
+        step(joystick)
+        assert(joystick.planner.num_plans == 1)
+        assert(joystick.num_commands_left() ==
+               plan_horizon - (i + 1) * control_horizon)
+    # the commands of the plan are sent in order and only once
+    speeds = sent_speeds(joystick, speed_idx)
+    assert(len(speeds) == plan_horizon)
+    expected = 1. + 0.01 * np.arange(plan_horizon)
+    # (the last speed repeats the second to last one)
+    expected[-1] = expected[-2]
+    assert(np.allclose(speeds, expected))
+
+    # then it replans (the old commands were all consumed)
+    step(joystick)
+    assert(joystick.planner.num_plans == 2)
+    assert(joystick.plans_since_replan == 0)
+    assert(joystick.num_commands_left() == plan_horizon - control_horizon)
+    assert(np.allclose(sent_speeds(joystick, speed_idx)[-control_horizon:],
+                       2. + 0.01 * np.arange(control_horizon)))
+
+    # a pedestrian within the replan clearance forces a replan
+    pedestrian = AgentState(name="pedestrian", radius=0.2,
+                            current_config=generate_config_from_pos_3(
+                                joystick.robot_current + np.array([0.7, 0., 0.])))
+    joystick.sim_state_now = WorldState(joystick.robot_current,
+                                        {"pedestrian": pedestrian})
+    step(joystick)
+    assert(joystick.planner.num_plans == 3)
+    assert(joystick.num_commands_left() == plan_horizon - control_horizon)
+    # but not once it is far enough
+    joystick.sim_state_now = WorldState(joystick.robot_current)
+    step(joystick)
+    assert(joystick.planner.num_plans == 3)
+
+    # and so does a new goal
+    joystick.goal_config = generate_config_from_pos_3(np.array([50., 5., 0.]))
+    step(joystick)
+    assert(joystick.planner.num_plans == 4)
+    assert(len(sent_speeds(joystick, speed_idx)) ==
+           plan_horizon + 4 * control_horizon)
+
+
+def test_velocity_commands():
+    joystick = create_joystick(JoystickWithPlanner, use_system_dynamics=True)
+    check_cadence(joystick, speed_idx=0)
+    assert(all(send_vel_cmds for _, send_vel_cmds in joystick.sent_cmds))
+
+    # the commands are sent in groups of simulator_joystick_update_ratio
+    joystick = create_joystick(JoystickWithPlanner, use_system_dynamics=True)
+    joystick.simulator_joystick_update_ratio = 2
+    step(joystick)
+    assert([len(cmds) for cmds, _ in joystick.sent_cmds] == [2, 2])
+    assert(joystick.num_commands_left() ==
+           control_horizon * (replan_interval - 1))
+
+
+def test_positional_commands():
+    joystick = create_joystick(JoystickWithPlannerPosns,
+                               use_system_dynamics=False)
+    # (x, y, theta, v)
+    check_cadence(joystick, speed_idx=3)
+    assert(not any(send_vel_cmds for _, send_vel_cmds in joystick.sent_cmds))
+    # the positions of the sent commands follow the plan
+    x_cmds = np.array([cmd[0] for cmds, _ in joystick.sent_cmds[:replan_interval]
+                       for cmd in cmds])
+    assert(np.allclose(x_cmds, np.arange(len(x_cmds)) * dt))
+
+    # the last commands of a plan are all consumed
+    joystick = create_joystick(JoystickWithPlannerPosns,
+                               use_system_dynamics=False)
+    for _ in range(replan_interval):
+        step(joystick)
+    assert(joystick.commands is None and joystick.num_commands_left() == 0)
+
+
+def main_test():
+    test_velocity_commands()
+    test_positional_commands()
+    print("%sJoystick cadence tests passed!%s" %
+          (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
@@ -0,0 +1,115 @@
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+from params.central_params import create_obstacle_map_params
+from obstacles.sbpd_map import SBPDMap
+from obstacles import map_bundle as mb
+from utils.utils import color_green, color_reset
+
+
+def create_traversible():
+    traversible = np.ones((120, 100), dtype=bool)
+    traversible[:5, :] = False
+    traversible[50:70, 30:60] = False
+    return traversible
+
+
+def test_map_bundle():
+    traversible_dir = tempfile.mkdtemp()
+    try:
+        p = create_obstacle_map_params()
+        p.use_map_bundle = True
+        p.traversible_dir = traversible_dir
+        traversible = create_traversible()
+        pos_nk2 = np.array([[[1.0, 1.0], [2.2, 3.0], [0.5, 0.1]]])
+
+        # first map generates the bundle
+        map_1 = SBPDMap(p, renderer=0, res=5., map_trav=traversible,
+                        building_name="test_building")
+        bundle_dir = mb.get_map_bundle_dir("test_building", traversible_dir)
+        for name in ['traversible', 'free_xy_map_m2',
+                     'obstacle_dist_' + p.obstacle_dist_backend,
+                     'obstacle_angle_' + p.obstacle_dist_backend]:
+            assert(os.path.exists(os.path.join(bundle_dir, name + '.npy')))
+        assert(mb.bundle_matches(bundle_dir, 5., map_1.get_map_size_2(),
+                                traversible))
+
+        # second map loads it memory-mapped
+        map_2 = SBPDMap(p, renderer=0, res=5., map_trav=traversible,
+                        building_name="test_building")
+        dist_mn = map_2.fmm_map.fmm_distance_map.voxel_function_mn
+        assert(isinstance(dist_mn, np.memmap))
+        assert(isinstance(map_2.free_xy_map_m2, np.memmap))
+        assert(np.allclose(map_1.dist_to_nearest_obs(pos_nk2),
+                           map_2.dist_to_nearest_obs(pos_nk2)))
+        assert(np.array_equal(map_1.free_xy_map_m2, map_2.free_xy_map_m2))
+
+        # a different resolution invalidates the bundle
+        map_3 = SBPDMap(p, renderer=0, res=10., map_trav=traversible,
+                        building_name="test_building")
+        assert(mb.bundle_matches(bundle_dir, 10., map_3.get_map_size_2(),
+                                traversible))
+        assert(not mb.bundle_matches(bundle_dir, 5., map_3.get_map_size_2(),
+                                    traversible))
+
+        # so does a different traversible (with the same name and size)
+        changed_traversible = traversible.copy()
+        changed_traversible[80:90, 10:20] = False
+        assert(not mb.bundle_matches(bundle_dir, 10., map_3.get_map_size_2(),
+                                     changed_traversible))
+        map_4 = SBPDMap(p, renderer=0, res=10., map_trav=changed_traversible,
+                        building_name="test_building")
+        assert(mb.bundle_matches(bundle_dir, 10., map_4.get_map_size_2(),
+                                 changed_traversible))
+        assert(np.array_equal(mb.load_bundle_array(bundle_dir, 'traversible'),
+                              changed_traversible))
+        pos_nk2 = np.array([[[1.5, 7.5]]])
+        assert(map_4.dist_to_nearest_obs(pos_nk2)[0, 0] <
+               map_3.dist_to_nearest_obs(pos_nk2)[0, 0])
+        # (and the original traversible is not served the changed one)
+        map_5 = SBPDMap(p, renderer=0, res=10., map_trav=traversible,
+                        building_name="test_building")
+        assert(np.allclose(map_5.dist_to_nearest_obs(pos_nk2),
+                           map_3.dist_to_nearest_obs(pos_nk2)))
+    finally:
+        shutil.rmtree(traversible_dir)
+
+
+def test_source_stat():
+    traversible_dir = tempfile.mkdtemp()
+    try:
+        traversible = create_traversible()
+        bundle_dir = mb.get_map_bundle_dir("test_building", traversible_dir)
+        source_filename = mb.get_source_filename(bundle_dir)
+        os.makedirs(os.path.dirname(source_filename))
+        with open(source_filename, 'wb') as f:
+            pickle.dump({'resolution': 5., 'traversible': traversible}, f)
+        assert(not mb.source_matches(bundle_dir))
+        assert(mb.save_bundle_metadata(bundle_dir, 5., [100, 120], [0., 0.],
+                                       traversible))
+        mb.save_bundle_array(bundle_dir, 'traversible', traversible)
+        assert(mb.source_matches(bundle_dir))
+
+        # the bundled traversible is not trusted once data.pkl changes
+        with open(source_filename, 'ab') as f:
+            f.write(b'0')
+        assert(not mb.source_matches(bundle_dir))
+        # but the arrays are kept when the traversible itself did not change
+        assert(not mb.save_bundle_metadata(bundle_dir, 5., [100, 120],
+                                           [0., 0.], traversible))
+        assert(mb.source_matches(bundle_dir))
+        assert(mb.load_bundle_array(bundle_dir, 'traversible') is not None)
+    finally:
+        shutil.rmtree(traversible_dir)
+
+
+def main_test():
+    test_map_bundle()
+    test_source_stat()
+    print("%sMap bundle tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
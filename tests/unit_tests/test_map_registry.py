@@ -0,0 +1,105 @@
+import json
+import numpy as np
+from params.central_params import create_obstacle_map_params
+from obstacles import map_registry
+from utils.fmm_map import FmmMap
+from utils.utils import color_green, color_reset
+
+
+def create_traversible():
+    traversible = np.ones((120, 100), dtype=bool)
+    traversible[:5, :] = False
+    traversible[50:70, 30:60] = False
+    return traversible
+
+
+def test_shared_obstacle_map():
+    p = create_obstacle_map_params()
+    p.use_map_bundle = False
+    traversible = create_traversible()
+    pos_nk2 = np.array([[[1.0, 1.0], [2.2, 3.0], [0.5, 0.1]]])
+
+    # the same building always gives the same (read-only) map
+    map_1 = map_registry.get_obstacle_map(p, renderer=0, res=5.,
+                                          map_trav=traversible)
+    map_2 = map_registry.get_obstacle_map(p, renderer=0, res=5.,
+                                          map_trav=1. * traversible)
+    assert(map_1 is map_2)
+    assert(not map_1.occupancy_grid_map.flags.writeable)
+    assert(not map_1.fmm_map.fmm_distance_map.voxel_function_mn.flags.writeable)
+
+    # agents can still build their goal fmm maps masked by the shared grid
+    goal_fmm_map = FmmMap.create_fmm_map_based_on_goal_position(
+        goal_positions_n2=np.array([[2.5, 4.5]]),
+        map_size_2=map_1.get_map_size_2(),
+        dx=map_1.get_dx(),
+        map_origin_2=map_1.get_map_origin_2(),
+        mask_grid_mn=map_1.create_occupancy_grid_for_map())
+    assert(goal_fmm_map.fmm_distance_map.voxel_function_mn.shape ==
+           traversible.shape)
+
+    # attaching to the exported shared memory gives an identical map
+    descriptor = json.dumps(map_registry.export_to_shared_memory(map_1))
+    p_joystick = create_obstacle_map_params()
+    attached_map = map_registry.attach_from_shared_memory(p_joystick,
+                                                          descriptor)
+    assert(np.allclose(map_1.dist_to_nearest_obs(pos_nk2),
+                       attached_map.dist_to_nearest_obs(pos_nk2)))
+    assert(np.array_equal(map_1.free_xy_map_m2, attached_map.free_xy_map_m2))
+    assert(np.array_equal(map_1.get_map_size_2(),
+                          attached_map.get_map_size_2()))
+    del attached_map
+    map_registry.release_shared_memory()
+
+
+def test_map_eviction():
+    map_registry.obstacle_maps.clear()
+    p = create_obstacle_map_params()
+    p.use_map_bundle = False
+    p.max_cached_maps = 2
+    traversible = create_traversible()
+
+    # the traversible is part of the key, even for a named building
+    map_1 = map_registry.get_obstacle_map(p, renderer=0, res=5.,
+                                          map_trav=traversible,
+                                          building_name="test_building")
+    changed_traversible = traversible.copy()
+    changed_traversible[80:90, 10:20] = False
+    map_2 = map_registry.get_obstacle_map(p, renderer=0, res=5.,
+                                          map_trav=changed_traversible,
+                                          building_name="test_building")
+    assert(map_1 is not map_2)
+    assert(np.array_equal(map_2.occupancy_grid_map,
+                          np.logical_not(changed_traversible) * 1.))
+    assert(len(map_registry.obstacle_maps) == 2)
+
+    # the least recently used map (and its shared memory) is released
+    map_registry.export_to_shared_memory(map_1)
+    map_registry.export_to_shared_memory(map_2)
+    assert(map_registry.get_obstacle_map(p, renderer=0, res=5.,
+                                         map_trav=traversible,
+                                         building_name="test_building") is map_1)
+    map_3 = map_registry.get_obstacle_map(p, renderer=0, res=10.,
+                                          map_trav=traversible,
+                                          building_name="test_building")
+    assert(len(map_registry.obstacle_maps) == 2)
+    assert(map_2 not in map_registry.obstacle_maps.values())
+    assert(id(map_2) not in map_registry.exported_blocks)
+    assert(id(map_1) in map_registry.exported_blocks)
+    assert(map_3 in map_registry.obstacle_maps.values())
+
+    map_registry.release_obstacle_map(map_1)
+    assert(list(map_registry.obstacle_maps.values()) == [map_3])
+    assert(not map_registry.exported_blocks)
+    map_registry.release_shared_memory()
+    map_registry.obstacle_maps.clear()
+
+
+def main_test():
+    test_shared_obstacle_map()
+    test_map_eviction()
+    print("%sMap registry tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
@@ -0,0 +1,150 @@
+import numpy as np
+from dotmap import DotMap
+from agents.agent import Agent
+from objectives.goal_distance import GoalDistance
+from objectives.objective_function import ObjectiveFunction
+from simulators.sim_state import AgentState, compute_agent_clearance
+from trajectory.trajectory import Trajectory
+from utils.utils import generate_config_from_pos_3, color_green, color_reset
+
+dt = 0.05
+
+
+class StraightPlanner(object):
+    """Plans straight (along +x) trajectories at 1m/s"""
+
+    def __init__(self):
+        self.num_plans = 0
+
+    def optimize(self, start_config, goal_config):
+        self.num_plans += 1
+        k = 40
+        start_2 = start_config.position_nk2()[0, 0]
+        position_1k2 = start_2 + \
+            np.stack([np.arange(k) * dt, np.zeros(k)], axis=1)[None]
+        trajectory = Trajectory(dt=dt, n=1, k=k, position_nk2=position_1k2,
+                                speed_nk1=np.ones((1, k, 1)),
+                                heading_nk1=np.zeros((1, k, 1)),
+                                angular_speed_nk1=np.zeros((1, k, 1)))
+        return {'trajectory': trajectory}
+
+
+class EuclideanGoalDistance(GoalDistance):
+    def compute_dist_to_goal_nk(self, trajectory):
+        return np.linalg.norm(trajectory.position_nk2() - self.goal_2, axis=2)
+
+
+class FakeFmmMap(object):
+    def __init__(self):
+        self.goals = []
+
+    def change_goal(self, goal_pos_n2):
+        self.goals.append(goal_pos_n2)
+
+
+class WorldState(object):
+    def __init__(self, pedestrians):
+        self.pedestrians = pedestrians
+
+    def get_pedestrians(self):
+        return self.pedestrians
+
+    def get_robots(self):
+        return {}
+
+
+def create_agent(replan_interval):
+    start = generate_config_from_pos_3(np.array([0., 0., 0.]), dt=dt)
+    goal = generate_config_from_pos_3(np.array([100., 0., 0.]), dt=dt)
+    agent = Agent(start, goal, "agent")
+    agent.params = DotMap(dt=dt, radius=0.2, control_horizon=10,
+                          episode_horizon=10000,
+                          replan_interval=replan_interval,
+                          replan_clearance=0.5,
+                          planner_params=DotMap(track_accel=False),
+                          episode_termination_reasons=['Timeout',
+                                                       'Obstacle Collision',
+                                                       'Pedestrian Collision',
+                                                       'Success'],
+                          goal_margin=0.3, verbose=False)
+    agent.obstacle_map = DotMap(
+        dist_to_nearest_obs=lambda pos_nk2: np.full(pos_nk2.shape[:2], 10.))
+    agent.fmm_map = FakeFmmMap()
+    goal_distance = EuclideanGoalDistance(
+        DotMap(goal_cost=1., goal_margin=0.3, power=2), agent.fmm_map)
+    goal_distance.goal_2 = goal.position_nk2()[0, 0]
+    agent.obj_fn = ObjectiveFunction(DotMap(obj_type='mean'))
+    agent.obj_fn.add_objective(goal_distance)
+    agent.planner = StraightPlanner()
+    agent.planned_next_config = start
+    agent.trajectory = Trajectory(dt=dt, n=1, k=0)
+    agent.collision_point_k = np.inf
+    Agent.set_sim_dt(dt)
+    return agent
+
+
+def test_replan_interval():
+    # replans on every update by default
+    agent = create_agent(replan_interval=1)
+    for _ in range(5):
+        agent.update()
+    assert(agent.planner.num_plans == 5)
+
+    # follows the buffered trajectory in between
+    agent = create_agent(replan_interval=4)
+    for _ in range(12):
+        agent.update()
+    assert(agent.planner.num_plans == 3)
+    assert(agent.path_step == 12)
+    assert(np.allclose(agent.get_current_config().position_nk2()[0, 0],
+                       agent.trajectory.position_nk2()[0, 11]))
+    assert(agent.get_current_config().position_nk2()[0, 0, 0] > 0.)
+    assert(not agent.end_acting)
+
+    # but replans when the buffered trajectory runs out
+    agent = create_agent(replan_interval=100)
+    for _ in range(25):
+        agent.update()
+    assert(agent.planner.num_plans == 3)
+    assert(not agent.end_acting)
+
+
+def test_forced_replan():
+    agent = create_agent(replan_interval=4)
+    agent.update()
+    assert(agent.planner.num_plans == 1)
+
+    # another agent is within the replan clearance
+    pos_3 = agent.get_current_config().to_3D_numpy()
+    pedestrian = AgentState(name="pedestrian", radius=0.2,
+                            current_config=generate_config_from_pos_3(
+                                pos_3 + np.array([0.7, 0., 0.])))
+    world_state = WorldState({"pedestrian": pedestrian})
+    assert(np.isclose(compute_agent_clearance(world_state, "agent", pos_3, 0.2),
+                      0.3))
+    path_step = agent.path_step
+    agent.update(world_state)
+    assert(agent.planner.num_plans == 2)
+    # (the buffered trajectory after the next config was replaced)
+    assert(agent.trajectory.k == path_step + 1 + agent.params.control_horizon)
+    agent.update(WorldState({}))
+    assert(agent.planner.num_plans == 2)
+
+    # the goal changed
+    agent.set_goal_config(generate_config_from_pos_3(np.array([50., 5., 0.])))
+    agent.update()
+    assert(agent.planner.num_plans == 3)
+    assert(len(agent.fmm_map.goals) == 1)
+    agent.update()
+    assert(agent.planner.num_plans == 3)
+
+
+def main_test():
+    test_replan_interval()
+    test_forced_replan()
+    print("%sReplan cadence tests passed!%s" %
+          (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
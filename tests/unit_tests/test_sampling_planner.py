@@ -0,0 +1,102 @@
+import numpy as np
+from dotmap import DotMap
+from params.central_params import create_planner_params
+from control_pipelines.control_pipeline_online import ControlPipelineOnline
+from objectives.objective_function import Objective, ObjectiveFunction
+from planners.sampling_planner import SamplingPlanner
+from utils.utils import generate_config_from_pos_3, color_green, color_reset
+
+
+class PointDistance(Objective):
+    """The (squared) distance to a point plus an (adjustable) penalty"""
+    tag = 'point_distance'
+
+    def __init__(self, point_2):
+        self.point_2 = point_2
+        self.penalty = 0.
+
+    def evaluate_objective(self, trajectory):
+        diff_nk2 = trajectory.position_nk2() - self.point_2
+        return np.sum(diff_nk2 ** 2, axis=2) + self.penalty
+
+
+def create_planner(full_replan_interval=3):
+    p = create_planner_params()
+    p.control_pipeline_params.pipeline = ControlPipelineOnline
+    p.control_pipeline_params.online_params = DotMap(latency_budget_s=10.,
+                                                     min_waypoints=300,
+                                                     max_waypoints=300)
+    p.warm_start_params = DotMap(enabled=True,
+                                 neighborhood_radius=0.5,
+                                 cost_tolerance=0.1,
+                                 full_replan_interval=full_replan_interval)
+    obj_fn = ObjectiveFunction(DotMap(obj_type='mean'))
+    objective = PointDistance(np.array([7., 6.]))
+    obj_fn.add_objective(objective)
+    return SamplingPlanner(obj_fn, p), objective
+
+
+def test_warm_start():
+    planner, objective = create_planner()
+    dt = planner.params.dt
+    goal_config = generate_config_from_pos_3(np.array([7., 6., 0.]), dt=dt)
+    start_config = generate_config_from_pos_3(np.array([5., 5., 0.]), dt=dt,
+                                              v=0.3)
+    # the first plan evaluates all the waypoints
+    obj_vals, _ = planner.eval_objective(start_config, goal_config)
+    assert(np.all(np.isfinite(obj_vals)))
+    assert(planner.num_warm_plans == 0)
+    assert(planner.incumbent_cost == np.min(obj_vals))
+
+    # then only the neighborhood of the previous optimal waypoint
+    start_config = generate_config_from_pos_3(np.array([5.05, 5.02, 0.]), dt=dt,
+                                              v=0.3)
+    incumbent_pos_3 = planner.incumbent_pos_3.copy()
+    obj_vals, data = planner.eval_objective(start_config, goal_config)
+    assert(planner.num_warm_plans == 1)
+    evaluated_n = np.isfinite(obj_vals)
+    assert(0 < np.sum(evaluated_n) < len(obj_vals))
+    waypt_pos_n2 = data[0].position_nk2()[:, 0]
+    dists_n = np.linalg.norm(waypt_pos_n2 - incumbent_pos_3[:2], axis=1)
+    assert(np.all(dists_n[evaluated_n] <= 0.5))
+    data = planner.optimize(start_config, goal_config)
+    assert(planner.num_warm_plans == 2)
+    assert(data['trajectory'].n == 1)
+
+    # every full_replan_interval plans all the waypoints are evaluated
+    obj_vals, _ = planner.eval_objective(start_config, goal_config)
+    assert(planner.num_warm_plans == 0 and np.all(np.isfinite(obj_vals)))
+
+    # and whenever the cost of the incumbent goes up
+    planner.eval_objective(start_config, goal_config)
+    assert(planner.num_warm_plans == 1)
+    objective.penalty = 10.
+    obj_vals, _ = planner.eval_objective(start_config, goal_config)
+    assert(planner.num_warm_plans == 0 and np.all(np.isfinite(obj_vals)))
+
+    # or the incumbent is infeasible (until a plan is feasible again)
+    objective.penalty = np.inf
+    for _ in range(3):
+        obj_vals, _ = planner.eval_objective(start_config, goal_config)
+        assert(planner.num_warm_plans == 0 and np.all(obj_vals == np.inf))
+    assert(planner.incumbent_cost == np.inf)
+    objective.penalty = 0.
+    obj_vals, _ = planner.eval_objective(start_config, goal_config)
+    assert(planner.num_warm_plans == 0 and np.all(np.isfinite(obj_vals)))
+
+    # or the goal changes
+    planner.optimize(start_config, goal_config)
+    assert(planner.num_warm_plans == 1)
+    goal_config = generate_config_from_pos_3(np.array([3., 6., 0.]), dt=dt)
+    planner.optimize(start_config, goal_config)
+    assert(planner.num_warm_plans == 0)
+
+
+def main_test():
+    test_warm_start()
+    print("%sSampling planner tests passed!%s" %
+          (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import numpy as np
+from utils import scoring_utils
+from utils.utils import color_green, color_reset
+
+
+def create_score_dict(rng, episode_name, algo_name, termination_cause):
+    num_steps = rng.randint(5, 20)
+    return {"episode_name": episode_name,
+            "algo_name": algo_name,
+            "seed": 991,
+            "success": termination_cause == "Success",
+            "termination_cause": termination_cause,
+            "path_length": rng.uniform(1, 10),
+            "num_exec_robot": num_steps,
+            "robot_speed": rng.uniform(0, 1, size=num_steps),
+            "time_to_collision": rng.uniform(0, 5, size=num_steps)}
+
+
+def test_results_store():
+    rng = np.random.RandomState(1)
+    causes = ["Success", "Timeout", "Pedestrian Collision"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        score_dicts = []
+        for algo_name in ["sampling", "social_force"]:
+            results_dir = os.path.join(tmp_dir, "test_" + algo_name)
+            for i in range(12):
+                score_dict = create_score_dict(rng, "ep_%d" % i, algo_name,
+                                               causes[i % 3])
+                if i == 5:
+                    del score_dict["path_length"]  # missing score
+                score_dicts.append(score_dict)
+                scalars, per_step = \
+                    scoring_utils.split_episode_scores(score_dict)
+                assert(set(per_step.keys()) ==
+                       set(["robot_speed", "time_to_collision"]))
+                scoring_utils.append_episode_scores(results_dir, scalars)
+                scoring_utils.save_per_step_scores(results_dir, "ep_%d" % i,
+                                                   per_step)
+            # the per-step scores are stored separately
+            per_step = scoring_utils.load_per_step_scores(results_dir, "ep_3")
+            assert(np.allclose(per_step["robot_speed"],
+                               score_dicts[-9]["robot_speed"]))
+
+        results_dirs = [os.path.join(tmp_dir, "test_sampling"),
+                        os.path.join(tmp_dir, "test_social_force")]
+        results, summary = scoring_utils.collate_episode_scores(results_dirs)
+        assert(len(results) == len(score_dicts))
+        assert("robot_speed" not in results.columns)
+        for row, score_dict in zip(results.itertuples(), score_dicts):
+            assert(row.episode_name == score_dict["episode_name"])
+            assert(row.termination_cause == score_dict["termination_cause"])
+            if "path_length" in score_dict:
+                assert(np.isclose(row.path_length, score_dict["path_length"]))
+            else:
+                assert(np.isnan(row.path_length))
+
+        # breakdown per algorithm and termination cause
+        assert(len(summary) == 2 * len(causes))
+        for algo_name in ["sampling", "social_force"]:
+            for cause in causes:
+                lengths = [d["path_length"] for d in score_dicts
+                           if d["algo_name"] == algo_name and
+                           d["termination_cause"] == cause and
+                           "path_length" in d]
+                stats = summary.loc[(algo_name, cause), "path_length"]
+                assert(stats["count"] == len(lengths))
+                assert(np.isclose(stats["mean"], np.mean(lengths)))
+                assert(np.isclose(stats["50%"], np.median(lengths)))
+                success = summary.loc[(algo_name, cause), "success"]
+                assert(success["mean"] == (cause == "Success"))
+
+        # overall summary
+        overall = scoring_utils.aggregate_scores(results, group_by=None,
+                                                 percentiles=[90])
+        steps = [d["num_exec_robot"] for d in score_dicts]
+        assert(np.isclose(overall.loc["num_exec_robot", "90%"],
+                          np.percentile(steps, 90)))
+
+
+def test_rerun_episodes():
+    rng = np.random.RandomState(2)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results_dir = os.path.join(tmp_dir, "test_sampling")
+        for i in range(4):
+            scalars, _ = scoring_utils.split_episode_scores(
+                create_score_dict(rng, "ep_%d" % i, "sampling", "Timeout"))
+            scoring_utils.append_episode_scores(results_dir, scalars)
+        # every episode has its own row file (concurrent writers never
+        # overwrite each other's rows)
+        assert(len(os.listdir(os.path.join(results_dir,
+                                           scoring_utils.rows_dirname))) == 4)
+
+        # re-running an episode replaces its row
+        rerun = create_score_dict(rng, "ep_1", "sampling", "Success")
+        scalars, _ = scoring_utils.split_episode_scores(rerun)
+        scoring_utils.append_episode_scores(results_dir, scalars)
+        scores = scoring_utils.load_scores(results_dir)
+        assert(list(scores["episode_name"]) == ["ep_0", "ep_2", "ep_3", "ep_1"])
+        assert(scores["termination_cause"][-1] == "Success")
+        assert(np.isclose(scores["path_length"][-1], rerun["path_length"]))
+        assert(scoring_utils.row_time_key not in scores)
+        results = scoring_utils.load_results(results_dir)
+        assert(len(results) == 4)
+
+
+def main_test():
+    test_results_store()
+    test_rerun_episodes()
+    print("%sScoring utils tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
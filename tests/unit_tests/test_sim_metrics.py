@@ -0,0 +1,290 @@
+import numpy as np
+import pandas as pd
+from simulators.sim_state import SimState, AgentState
+from utils.utils import generate_config_from_pos_3, color_green, color_reset
+
+
+def create_sim_states(num_steps=40, num_peds=6, dt=0.1, seed=1):
+    """Random walking pedestrians around a robot driving along the x axis.
+    Pedestrians spawn (and despawn) at different sim steps."""
+    rng = np.random.RandomState(seed)
+    ped_starts = rng.uniform(0, 6, size=(num_peds, 2))
+    ped_vels = rng.uniform(-0.8, 0.8, size=(num_peds, 2))
+    # no pedestrians in the first couple of steps
+    spawn_steps = rng.randint(2, num_steps // 2, size=num_peds)
+    despawn_steps = spawn_steps + rng.randint(num_steps // 4, num_steps,
+                                              size=num_peds)
+    sim_states = {}
+    for step in range(num_steps):
+        peds = {}
+        for i in range(num_peds):
+            if not (spawn_steps[i] <= step < despawn_steps[i]):
+                continue
+            pos_2 = ped_starts[i] + ped_vels[i] * (step - spawn_steps[i]) * dt
+            theta = np.arctan2(ped_vels[i][1], ped_vels[i][0])
+            name = "ped_%d" % i
+            peds[name] = AgentState(name=name, radius=0.2,
+                                    current_config=generate_config_from_pos_3(
+                                        [pos_2[0], pos_2[1], theta]))
+        robot_pos_3 = [0.5 * step * dt, 3.0 + 0.1 * np.sin(step), 0.0]
+        robots = {"robot_agent": AgentState(name="robot_agent", radius=0.3,
+                                            current_config=generate_config_from_pos_3(robot_pos_3))}
+        sim_states[step] = SimState(environment={}, pedestrians=peds,
+                                    robots=robots, sim_t=step * dt, delta_t=dt)
+    return sim_states
+
+
+def test_sim_states_to_dataframe():
+    from simulators.simulator_helper import sim_states_to_dataframe
+    sim_states = create_sim_states()
+    df, agent_info = sim_states_to_dataframe(sim_states)
+
+    assert(list(df.columns) == ["sim_step", "agent_name", "x", "y", "theta"])
+    assert(isinstance(df.agent_name.dtype, pd.CategoricalDtype))
+    num_rows = sum([len(s.get_all_agents(True)) for s in sim_states.values()])
+    assert(len(df) == num_rows)
+    assert(agent_info["robot_agent"] == [0.3])
+    # every row matches the agent's position in that sim_state
+    for row in df.sample(n=20, random_state=1).itertuples():
+        agent = sim_states[row.sim_step].get_all_agents(True)[row.agent_name]
+        pos_3 = agent.get_current_config().to_3D_numpy()
+        assert(np.allclose([row.x, row.y, row.theta], pos_3))
+
+
+def loop_time_to_collision(sim_df, dt):
+    """Reference (per sim_step) implementation of the time to collision"""
+    robot_indcs = (sim_df.agent_name == 'robot_agent')
+    ped_df = sim_df[~robot_indcs]
+    bot_df = sim_df[robot_indcs]
+    robot_trajectory = np.vstack([bot_df.x, bot_df.y, bot_df.theta]).T
+    robot_inst_vels = np.diff(robot_trajectory, axis=0)[:, :-1] / dt
+    vel_df = ped_df.groupby(['agent_name'], observed=True)[
+        ['x', 'y']].diff().fillna(0) / dt
+    vel_df.columns = ['vx', 'vy']
+    ped_df = pd.concat([ped_df, vel_df], axis=1)
+    ttc = np.zeros((len(robot_inst_vels)))
+    for sim_step in range(len(robot_inst_vels)):
+        robot_inst_vel = robot_inst_vels[sim_step - 1]
+        sim_step += 1
+        ped_inst = ped_df[ped_df.sim_step == sim_step]
+        if len(ped_inst) == 0:
+            ttc[sim_step - 1] = ttc[sim_step - 2]
+            continue
+        botped_relative_vels = np.array(ped_inst.loc[:, ('vx', 'vy')]) - \
+            robot_inst_vel
+        botped_vectors = robot_trajectory[sim_step, :2] - \
+            np.array(ped_inst.loc[:, ('x', 'y')])
+        botped_distances = np.linalg.norm(botped_vectors, axis=1)
+        botped_uvectors = botped_vectors / botped_distances[:, None]
+        botped_component = np.sum(botped_relative_vels * botped_uvectors,
+                                  axis=1)
+        ttc_all = botped_distances / botped_component
+        ttc_pos = ttc_all[ttc_all > 0]
+        ttc[sim_step - 1] = -1 if len(ttc_pos) == 0 else np.min(ttc_pos)
+    return ttc
+
+
+def loop_closest_pedestrian_distance(sim_df):
+    """Reference (per sim_step) implementation of the closest distance"""
+    robot_indcs = (sim_df.agent_name == 'robot_agent')
+    ped_df = sim_df[~robot_indcs]
+    bot_df = sim_df[robot_indcs]
+    robot_trajectory = np.vstack([bot_df.x, bot_df.y]).T
+    cpd = np.zeros((len(robot_trajectory)))
+    for sim_step in range(len(robot_trajectory)):
+        ped_inst = ped_df[ped_df.sim_step == sim_step]
+        if len(ped_inst) == 0:
+            cpd[sim_step] = cpd[sim_step - 1]
+            continue
+        ped_inst_posns = np.vstack([ped_inst.x, ped_inst.y]).T
+        cpd[sim_step] = np.min(np.linalg.norm(
+            robot_trajectory[sim_step] - ped_inst_posns, axis=1))
+    return cpd
+
+
+def test_pedestrian_metrics():
+    from dotmap import DotMap
+    from simulators.simulator_helper import sim_states_to_dataframe
+    from metrics import metrics_sim_utils
+    ttcs = []
+    for seed in range(5):
+        sim_states = create_sim_states(num_peds=8, seed=seed)
+        sim_df, _ = sim_states_to_dataframe(sim_states)
+        central_sim = DotMap(sim_df=sim_df, dt=0.1)
+
+        cpd = metrics_sim_utils.closest_pedestrian_distance(central_sim)
+        assert(np.allclose(cpd, loop_closest_pedestrian_distance(sim_df),
+                           rtol=0, atol=1e-12))
+        ttc = metrics_sim_utils.time_to_collision(central_sim)
+        assert(np.allclose(ttc, loop_time_to_collision(sim_df, 0.1),
+                           rtol=0, atol=1e-12))
+        assert(np.all(cpd[:2] == 0))  # no pedestrians yet
+        ttcs.append(ttc)
+    # the scenes cover steps with and without upcoming collisions
+    assert(np.any(np.hstack(ttcs) == -1) and np.any(np.hstack(ttcs) > 0))
+
+
+def test_metric_registry():
+    from dotmap import DotMap
+    from trajectory.trajectory import Trajectory
+    from simulators.simulator_helper import sim_states_to_dataframe
+    from metrics import metrics_sim_utils
+    dt = 0.1
+    sim_states = create_sim_states()
+    sim_df, _ = sim_states_to_dataframe(sim_states)
+    bot_df = sim_df[sim_df.agent_name == 'robot_agent']
+    robot_traj_k3 = np.vstack([bot_df.x, bot_df.y, bot_df.theta]).T
+    trajectory = Trajectory(dt=dt, n=1, k=len(robot_traj_k3),
+                            position_nk2=robot_traj_k3[None, :, :2],
+                            heading_nk1=robot_traj_k3[None, :, 2:])
+    robot = DotMap(termination_cause="Success",
+                   goal_config=generate_config_from_pos_3([2.5, 3.0, 0.]))
+    robot.get_trajectory = lambda: trajectory
+    central_sim = DotMap(sim_df=sim_df, dt=dt, robot=robot)
+
+    metrics_list = ["success", "robot_speed", "robot_motion_energy",
+                    "robot_acceleration", "robot_jerk", "path_length",
+                    "goal_traversal_ratio", "closest_pedestrian_distance",
+                    "time_to_collision", "not_a_metric"]
+    inputs = metrics_sim_utils.EpisodeMetricInputs(central_sim)
+    metrics_out = {}
+    for name in metrics_list[:-1]:
+        metric_fn, _ = metrics_sim_utils.metric_registry[name]
+        metrics_out[name] = metric_fn(central_sim, inputs=inputs)
+    # the robot derivatives are only computed once and then shared
+    assert(set(['robot_vel_k2', 'robot_acc_k2', 'robot_jerk_k2',
+                'ped_arrays']).issubset(inputs.cache.keys()))
+    # (trajectories are stored as float32)
+    robot_pos_k2 = np.squeeze(trajectory.position_nk2())
+    robot_vel_k2 = np.diff(robot_pos_k2, axis=0) / dt
+    robot_acc_k2 = np.diff(robot_vel_k2, axis=0) / dt
+    assert(metrics_out["success"])
+    assert(np.allclose(metrics_out["robot_speed"],
+                       np.linalg.norm(robot_vel_k2, axis=1)))
+    assert(np.isclose(metrics_out["robot_motion_energy"],
+                      np.sum(robot_vel_k2**2)))
+    assert(np.allclose(metrics_out["robot_acceleration"], robot_acc_k2))
+    assert(np.allclose(metrics_out["robot_jerk"],
+                       np.diff(robot_acc_k2, axis=0) / dt))
+
+    # scoring everything at once gives the same results as calling each metric
+    all_metrics = metrics_sim_utils.compute_metrics(central_sim, metrics_list)
+    assert("not_a_metric" not in all_metrics)
+    for name, value in metrics_out.items():
+        assert(np.allclose(all_metrics[name], value))
+        metric_fn, _ = metrics_sim_utils.metric_registry[name]
+        assert(np.allclose(metric_fn(central_sim), value))
+
+
+def test_online_metrics():
+    from dotmap import DotMap
+    from simulators.simulator_helper import sim_states_to_dataframe
+    from metrics import metrics_sim_utils
+    from metrics.online_metrics import OnlineEpisodeMetrics
+    dt = 0.1
+    for seed in range(5):
+        sim_states = create_sim_states(num_peds=8, seed=seed)
+        online_metrics = OnlineEpisodeMetrics(dt)
+        for sim_step, sim_state in sim_states.items():
+            online_metrics.update(sim_step, sim_state)
+        scores = online_metrics.get_scores()
+
+        # same scores as the metrics computed from the whole episode
+        sim_df, _ = sim_states_to_dataframe(sim_states)
+        bot_df = sim_df[sim_df.agent_name == 'robot_agent']
+        inputs = metrics_sim_utils.EpisodeMetricInputs(
+            DotMap(sim_df=sim_df, dt=dt))
+        # (the online metrics sample the robot once per sim_step, unlike the
+        # robot trajectory, see test_online_scores_do_not_replace_metrics)
+        inputs.cache['robot_pos_k2'] = np.vstack([bot_df.x, bot_df.y]).T
+        assert(np.isclose(scores["total_sim_time_taken"],
+                          (len(sim_states) - 1) * dt))
+        for name in ["path_length", "robot_motion_energy"]:
+            metric_fn, _ = metrics_sim_utils.metric_registry[name]
+            assert(np.isclose(scores[name], metric_fn(None, inputs=inputs)))
+        jerk_k2 = metrics_sim_utils.robot_jerk(None, inputs=inputs)
+        assert(np.isclose(scores["robot_mean_jerk"],
+                          np.mean(np.linalg.norm(jerk_k2, axis=1))))
+        # (the first steps without pedestrians are 0 in the batch metrics)
+        cpd = metrics_sim_utils.closest_pedestrian_distance(None, inputs=inputs)
+        assert(np.isclose(scores["min_closest_pedestrian_distance"],
+                          np.min(cpd[cpd > 0])))
+        ttc = metrics_sim_utils.time_to_collision(None, inputs=inputs)
+        min_ttc = np.min(ttc[ttc > 0]) if np.any(ttc > 0) else -1
+        assert(np.isclose(scores["min_time_to_collision"], min_ttc))
+
+    # no pedestrians and no robot collisions
+    online_metrics = OnlineEpisodeMetrics(dt)
+    for sim_step, sim_state in create_sim_states(num_peds=0).items():
+        online_metrics.update(sim_step, sim_state)
+    assert(online_metrics.get_scores()["min_closest_pedestrian_distance"] == -1)
+    assert(online_metrics.get_scores()["min_time_to_collision"] == -1)
+    assert(online_metrics.get_robot_colliders() == [])
+
+
+def test_online_scores_do_not_replace_metrics():
+    from dotmap import DotMap
+    from trajectory.trajectory import Trajectory
+    from simulators.simulator_helper import sim_states_to_dataframe
+    from metrics import metrics_sim_utils
+    from metrics.online_metrics import OnlineEpisodeMetrics
+    dt = 0.1
+    sim_states = create_sim_states()
+    sim_df, _ = sim_states_to_dataframe(sim_states)
+    online_metrics = OnlineEpisodeMetrics(dt)
+    for sim_step, sim_state in sim_states.items():
+        online_metrics.update(sim_step, sim_state)
+    online_scores = online_metrics.get_scores()
+
+    # the robot trajectory is at a finer (control) rate than the sim_states
+    k = 4 * len(sim_states)
+    t_k = np.arange(k) * dt / 4.
+    position_1k2 = np.stack([0.5 * t_k, 3.0 + 0.05 * np.sin(8. * t_k)],
+                            axis=1)[None]
+    trajectory = Trajectory(dt=dt / 4., n=1, k=k, position_nk2=position_1k2,
+                            heading_nk1=np.zeros((1, k, 1)))
+    robot = DotMap(goal_config=generate_config_from_pos_3([2.5, 3.0, 0.]))
+    robot.get_trajectory = lambda: trajectory
+    central_sim = DotMap(sim_df=sim_df, dt=dt, robot=robot, sim_states=sim_states)
+
+    metrics_list = ["total_sim_time_taken", "path_length", "path_length_ratio",
+                    "robot_motion_energy", "closest_pedestrian_distance"]
+    batch_metrics = metrics_sim_utils.compute_metrics(central_sim,
+                                                      metrics_list)
+    all_metrics = metrics_sim_utils.compute_metrics(central_sim, metrics_list,
+                                                    online_scores)
+    assert(not np.isclose(online_scores["path_length"],
+                          batch_metrics["path_length"]))
+    for name in metrics_list:
+        assert(np.allclose(all_metrics[name], batch_metrics[name]))
+    # the path length and its ratio agree
+    goal_dist = np.linalg.norm(position_1k2[0, 0] - np.array([2.5, 3.0]))
+    assert(np.isclose(all_metrics["path_length_ratio"],
+                      all_metrics["path_length"] / goal_dist, rtol=1e-5))
+    # the online only scores are added
+    for name in ["robot_mean_jerk", "min_closest_pedestrian_distance",
+                 "min_time_to_collision"]:
+        assert(all_metrics[name] == online_scores[name])
+
+    # without the sim history the online scores are used instead
+    metrics_list = [m for m in metrics_list
+                    if m not in metrics_sim_utils.sim_history_metrics]
+    all_metrics = metrics_sim_utils.compute_metrics(central_sim, metrics_list,
+                                                    online_scores)
+    assert(all_metrics["total_sim_time_taken"] ==
+           online_scores["total_sim_time_taken"])
+    assert("closest_pedestrian_distance" not in all_metrics)
+    assert(np.isclose(all_metrics["path_length"], batch_metrics["path_length"]))
+
+
+def main_test():
+    test_sim_states_to_dataframe()
+    test_pedestrian_metrics()
+    test_metric_registry()
+    test_online_metrics()
+    test_online_scores_do_not_replace_metrics()
+    print("%sSim metrics tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
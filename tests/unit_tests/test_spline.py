@@ -1,3 +1,4 @@
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 from trajectory.spline.spline_3rd_order import Spline3rdOrder
@@ -218,12 +219,99 @@ def test_spline_rescaling():
     assert valid_idxs_n[0] == 0
 
 
+def create_random_splines(n, k, dtype=np.float64, seed=1):
+    """Fits n random splines (starting at the origin) evaluated at k times"""
+    rng = np.random.RandomState(seed)
+    dt = .05
+    start_config = SystemConfig(
+        dt, n, 1, speed_nk1=rng.uniform(0., .5, (n, 1, 1)), variable=False)
+    goal_config = SystemConfig(dt, n, 1,
+                               position_nk2=rng.uniform(.5, 3., (n, 1, 2)),
+                               heading_nk1=rng.uniform(-1.5, 1.5, (n, 1, 1)),
+                               variable=False)
+    final_times_n1 = rng.uniform(1., 4., (n, 1))
+    ts_nk = np.linspace(0., 1., k)[None] * final_times_n1
+    p = DotMap(spline_params=DotMap(epsilon=1e-5, dtype=dtype))
+    spline_traj = Spline3rdOrder(dt=dt, k=k, n=n, params=p.spline_params)
+    spline_traj.fit(start_config, goal_config, final_times_n1, factors=None)
+    spline_traj.eval_spline(ts_nk, calculate_speeds=True)
+    return spline_traj, start_config, goal_config, final_times_n1, ts_nk
+
+
+def test_spline_evaluation():
+    """
+    Checks the (Horner form) evaluation of the splines against the power form
+    of their polynomials, in double and single precision, and that the
+    evaluation buffers are reused
+    """
+    n, k = 20, 30
+    spline_traj, start_config, goal_config, final_times_n1, ts_nk = \
+        create_random_splines(n, k)
+    t_nk = ts_nk / final_times_n1
+    t_n4k = np.stack([t_nk**3, t_nk**2, t_nk, np.ones_like(t_nk)], axis=1)
+    ps_nk = np.squeeze(np.matmul(spline_traj.p_coeffs_n14, t_n4k), axis=1)
+    ps_n4k = np.stack([ps_nk**3, ps_nk**2, ps_nk, np.ones_like(ps_nk)], axis=1)
+    ps_dot_n4k = np.stack([3. * ps_nk**2, 2. * ps_nk, np.ones_like(ps_nk),
+                           np.zeros_like(ps_nk)], axis=1)
+    xs_nk = np.squeeze(np.matmul(spline_traj.x_coeffs_n14, ps_n4k), axis=1)
+    ys_nk = np.squeeze(np.matmul(spline_traj.y_coeffs_n14, ps_n4k), axis=1)
+    xs_dot_nk = np.squeeze(np.matmul(spline_traj.x_coeffs_n14, ps_dot_n4k), axis=1)
+    ys_dot_nk = np.squeeze(np.matmul(spline_traj.y_coeffs_n14, ps_dot_n4k), axis=1)
+    assert(np.allclose(spline_traj.position_nk2()[:, :, 0], xs_nk, atol=1e-12))
+    assert(np.allclose(spline_traj.position_nk2()[:, :, 1], ys_nk, atol=1e-12))
+    assert(np.allclose(spline_traj.heading_nk1()[:, :, 0],
+                       np.arctan2(ys_dot_nk, xs_dot_nk), atol=1e-12))
+    # the splines start at the start and end at the goal configs
+    assert(np.allclose(spline_traj.speed_nk1()[:, 0],
+                       start_config.speed_nk1()[:, 0], atol=1e-6))
+    assert(np.allclose(spline_traj.position_nk2()[:, -1],
+                       goal_config.position_nk2()[:, 0], atol=1e-6))
+
+    # the evaluations are written into the same buffers
+    position_nk2 = spline_traj.position_nk2()
+    speed_nk1 = spline_traj.speed_nk1()
+    expected_speed_nk1 = speed_nk1.copy()
+    spline_traj.eval_spline(ts_nk * 0.5, calculate_speeds=True)
+    assert(spline_traj.position_nk2() is position_nk2)
+    assert(spline_traj.speed_nk1() is speed_nk1)
+    spline_traj.eval_spline(ts_nk, calculate_speeds=True)
+    assert(np.allclose(spline_traj.speed_nk1(), expected_speed_nk1))
+
+    # single precision splines are close to the double precision ones
+    spline_traj_32 = create_random_splines(n, k, dtype=np.float32)[0]
+    assert(spline_traj_32.position_nk2().dtype == np.float32)
+    assert(np.allclose(spline_traj_32.position_heading_speed_and_angular_speed_nk5(),
+                       spline_traj.position_heading_speed_and_angular_speed_nk5(),
+                       atol=1e-3))
+
+
+def benchmark_spline(ns=(1, 1000, 10000), k=40, dtypes=(np.float64, np.float32)):
+    """Times fitting, evaluating and rescaling batches of n splines"""
+    for dtype in dtypes:
+        for n in ns:
+            spline_traj, start_config, goal_config, final_times_n1, ts_nk = \
+                create_random_splines(n, k, dtype=dtype)
+            num_reps = max(5, 2000 // n)
+            start_t = time.perf_counter()
+            for _ in range(num_reps):
+                spline_traj.fit(start_config, goal_config,
+                                final_times_n1, factors=None)
+                spline_traj.eval_spline(ts_nk, calculate_speeds=True)
+                spline_traj.rescale_spline_horizon_to_dynamically_feasible_horizon(
+                    speed_max_system=1.2, angular_speed_max_system=1.1)
+            step_t = (time.perf_counter() - start_t) / num_reps
+            print("%s n=%d k=%d: %.3fms per fit + eval + rescale" %
+                  (np.dtype(dtype).name, n, k, step_t * 1000))
+
+
 def main_test():
     test_spline_3rd_order(visualize=False)
     test_spline_rescaling()
+    test_spline_evaluation()
     test_piecewise_spline(visualize=False)
     print("%sSpline tests passed!%s" % (color_green, color_reset))
 
 
 if __name__ == '__main__':
     main_test()
+    benchmark_spline()
@@ -0,0 +1,160 @@
+import os
+import tempfile
+import multiprocessing
+import numpy as np
+import imageio.v2 as imageio
+from dotmap import DotMap
+from utils.utils import generate_config_from_pos_3, color_green, color_reset
+from utils.image_utils import render_scene, get_topview_frame, TopviewFigure, \
+    init_topview_worker, render_topview_worker, fit_image
+from unit_tests.test_sim_metrics import create_sim_states
+
+
+def create_topview_scene(num_steps=8):
+    traversible = np.ones((120, 160))
+    traversible[30:50, 60:120] = 0  # an obstacle
+    environment = {"map_traversible": traversible, "map_scale": 0.05,
+                   "room_center": np.array([4., 3., 0.])}
+    sim_states = create_sim_states(num_steps=num_steps)
+    for sim_state in sim_states.values():
+        # robots are drawn with their start and goal
+        robot = sim_state.get_robot()
+        robot.start_config = generate_config_from_pos_3([0., 3., 0.])
+        robot.goal_config = generate_config_from_pos_3([5., 3., 0.])
+        sim_state.wall_t = 0.0
+    return environment, sim_states
+
+
+def test_topview_figure():
+    environment, sim_states = create_topview_scene()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        p = DotMap(output_directory=tmp_dir, img_scale=0.3,
+                   verbose_printing=False, render_3D=False)
+        topview = TopviewFigure(p, environment)
+        for step, s in sim_states.items():
+            camera_pos_13 = s.get_robot().get_pos3()
+            render_scene(p, None, None, environment, camera_pos_13,
+                         s.get_pedestrians(), s.get_robots(), s.get_sim_t(),
+                         0.0, "scene%d.png" % step)
+            topview.render(get_topview_frame(camera_pos_13, s.get_pedestrians(),
+                                             s.get_robots(), s.get_sim_t(), 0.0),
+                           "topview%d.png" % step)
+        topview.close()
+        # reusing the figure (with the map drawn once) gives the same frames
+        for step in sim_states.keys():
+            scene = imageio.imread(os.path.join(tmp_dir, "scene%d.png" % step))
+            frame = imageio.imread(os.path.join(tmp_dir, "topview%d.png" % step))
+            assert(np.array_equal(scene, frame))
+
+
+def test_topview_blit():
+    environment, sim_states = create_topview_scene()
+    p = DotMap(output_directory=None, img_scale=0.6,
+               verbose_printing=False, render_3D=False)
+    topview = TopviewFigure(p, environment)
+    for s in sim_states.values():
+        image = topview.render_image(
+            get_topview_frame(None, s.get_pedestrians(), s.get_robots(),
+                              s.get_sim_t(), 0.0))
+        # blitting atop the cached map gives the same image as redrawing
+        # the whole figure
+        for artist in topview.fig.findobj():
+            artist.set_animated(False)
+        topview.fig.canvas.draw()
+        rows, cols = topview.crop
+        full_image = \
+            np.array(topview.fig.canvas.buffer_rgba())[rows, cols, :3]
+        assert(np.array_equal(image, full_image))
+        for artist in topview.foreground:
+            artist.set_animated(True)
+    topview.close()
+
+
+def test_topview_workers():
+    environment, sim_states = create_topview_scene()
+    p = DotMap(output_directory=None, img_scale=0.6,
+               verbose_printing=False, render_3D=False)
+    frames = [get_topview_frame(None, s.get_pedestrians(), s.get_robots(),
+                                s.get_sim_t(), 0.0)
+              for s in sim_states.values()]
+    with multiprocessing.Pool(2, initializer=init_topview_worker,
+                              initargs=(p, environment)) as pool:
+        images = pool.map(render_topview_worker, frames)
+    # same images as rendering them in this process
+    init_topview_worker(p, environment)
+    for frame, image in zip(frames, images):
+        assert(np.array_equal(render_topview_worker(frame), image))
+
+
+def test_render_movie():
+    from simulators.simulator_helper import SimulatorHelper
+    environment, sim_states = create_topview_scene(num_steps=15)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sim = SimulatorHelper.__new__(SimulatorHelper)
+        sim.params = DotMap(output_directory=tmp_dir, img_scale=0.6,
+                            verbose_printing=False, render_3D=False,
+                            fps_scale_down=0.5, record_video=True,
+                            keep_sim_history=True, video_format='gif')
+        sim.dt = 0.1
+        sim.robot = True
+        sim.environment = environment
+        sim.episode_params = DotMap(name="episode")
+        sim.sim_states = sim_states
+        sim.render(None, None)
+        # the frames are streamed into the movie (no individual images)
+        assert(os.listdir(tmp_dir) == ["movie_episode.gif"])
+        movie = imageio.mimread(os.path.join(tmp_dir, "movie_episode.gif"))
+        assert(len(movie) == 8)  # every other state
+        topview = TopviewFigure(sim.params, environment)
+        image = topview.render_image(sim.get_topview_frame(sim_states[14], None))
+        assert(movie[-1].shape[:2] == image.shape[:2])
+        topview.close()
+
+
+def test_render_3D_movie():
+    from simulators.simulator_helper import SimulatorHelper
+    environment, sim_states = create_topview_scene(num_steps=6)
+    rng = np.random.RandomState(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sim = SimulatorHelper.__new__(SimulatorHelper)
+        sim.params = DotMap(output_directory=tmp_dir, img_scale=0.6,
+                            verbose_printing=False, render_3D=True,
+                            fps_scale_down=1, record_video=True,
+                            keep_sim_history=True, video_format='gif')
+        sim.dt = 0.1
+        sim.robot = True
+        sim.environment = environment
+        sim.episode_params = DotMap(name="episode")
+        sim.sim_states = sim_states
+        # (tightly cropped) frames of slightly different sizes
+        sizes = [(100 + rng.randint(-3, 4), 160 + rng.randint(-5, 6))
+                 for _ in sim_states]
+        images = [rng.randint(0, 255, size=size + (3,)).astype(np.uint8)
+                  for size in sizes]
+        rendered = iter(images)
+        sim.render_sim_state = lambda renderer, camera_pose, state: \
+            next(rendered)
+        sim.render(None, None)
+        movie = imageio.mimread(os.path.join(tmp_dir, "movie_episode.gif"))
+        assert(len(movie) == len(images))
+        assert(all([frame.shape[:2] == sizes[0] for frame in movie]))
+
+    # frames are centered, padded with white or cropped
+    image = np.zeros((4, 6, 3), dtype=np.uint8)
+    fitted = fit_image(image, (6, 4))
+    assert(fitted.shape == (6, 4, 3))
+    assert(np.all(fitted[1:5] == 0) and np.all(fitted[[0, 5]] == 255))
+    assert(np.array_equal(fit_image(image, (4, 6)), image))
+
+
+def main_test():
+    test_topview_figure()
+    test_topview_blit()
+    test_topview_workers()
+    test_render_movie()
+    test_render_3D_movie()
+    print("%sTopview render tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
@@ -0,0 +1,93 @@
+import copy
+import pickle
+import numpy as np
+from trajectory.trajectory import Trajectory, SystemConfig
+from utils.utils import color_green, color_reset
+
+
+def create_segment(rng, n=1, k=1):
+    """A SystemConfig (k = 1) or Trajectory segment of random states"""
+    cls = SystemConfig if k == 1 else Trajectory
+    return cls(dt=.05, n=n, k=k,
+                        position_nk2=rng.uniform(-5, 5, (n, k, 2)),
+                        speed_nk1=rng.uniform(0, 1, (n, k, 1)),
+                        acceleration_nk1=rng.uniform(-1, 1, (n, k, 1)),
+                        heading_nk1=rng.uniform(-np.pi, np.pi, (n, k, 1)),
+                        angular_speed_nk1=rng.uniform(-1, 1, (n, k, 1)),
+                        angular_acceleration_nk1=rng.uniform(-1, 1, (n, k, 1)))
+
+
+def assert_trajectories_equal(traj, segments):
+    """traj is the concatenation (along time) of all the segments"""
+    assert(traj.k == sum([s.k for s in segments]))
+    for accessor in ['position_nk2', 'speed_nk1', 'acceleration_nk1',
+                     'heading_nk1', 'angular_speed_nk1',
+                     'angular_acceleration_nk1']:
+        expected = np.concatenate([getattr(s, accessor)() for s in segments],
+                                  axis=1)
+        assert(np.array_equal(getattr(traj, accessor)(), expected))
+
+
+def test_append_along_time_axis():
+    rng = np.random.RandomState(0)
+    traj = Trajectory(dt=.05, n=1, k=0)
+    segments = [traj.copy(traj)]
+    for i in range(100):
+        # configs (k = 1) and longer segments
+        segment = create_segment(rng, k=1 + (i % 3) * 4)
+        traj.append_along_time_axis(segment)
+        segments.append(segment)
+    assert_trajectories_equal(traj, segments)
+    assert(np.all(traj.valid_horizons_n1 == traj.k))
+
+    # the accessors are views of the (doubling) buffers
+    buffer, _ = traj._time_axis_buffers['_position_nk2']
+    assert(traj.position_nk2().base is buffer)
+    assert(traj.k <= buffer.shape[1] <= 2 * traj.k)
+
+    # appending after clipping continues from the clipped trajectory
+    traj.clip_along_time_axis(50)
+    segment = create_segment(rng, k=3)
+    traj.append_along_time_axis(segment)
+    assert(traj.k == 53)
+    assert(np.array_equal(traj.position_nk2()[:, 50:],
+                          segment.position_nk2()))
+
+    # and after taking (dropping the beginning)
+    position_nk2 = traj.position_nk2() * 1.
+    traj.take_along_time_axis(10)
+    segment = create_segment(rng, k=2)
+    traj.append_along_time_axis(segment)
+    assert(np.array_equal(traj.position_nk2(),
+                          np.concatenate([position_nk2[:, 10:],
+                                          segment.position_nk2()], axis=1)))
+
+    # copies do not keep the spare capacity and can still be appended to
+    for traj_copy in [copy.deepcopy(traj), pickle.loads(pickle.dumps(traj))]:
+        assert('_time_axis_buffers' not in traj_copy.__dict__)
+        assert(traj_copy.position_nk2().shape == (1, traj.k, 2))
+        traj_copy.append_along_time_axis(segment)
+        assert(traj_copy.k == traj.k + 2)
+        assert(np.array_equal(traj_copy.position_nk2()[:, :traj.k],
+                              traj.position_nk2()))
+
+    # without tracking the acceleration
+    traj = Trajectory(dt=.05, n=2, k=0, track_trajectory_acceleration=False)
+    segments = []
+    for i in range(10):
+        segment = create_segment(rng, n=2, k=2)
+        traj.append_along_time_axis(segment,
+                                    track_trajectory_acceleration=False)
+        segments.append(segment)
+    assert(np.array_equal(traj.heading_nk1(),
+                          np.concatenate([s.heading_nk1() for s in segments], axis=1)))
+    assert(traj.acceleration_nk1().size == 0)
+
+
+def main_test():
+    test_append_along_time_axis()
+    print("%sTrajectory tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
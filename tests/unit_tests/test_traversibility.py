@@ -0,0 +1,161 @@
+import numpy as np
+import scipy.ndimage
+from skimage import morphology
+from mp_env import map_utils as mu
+from params.central_params import create_building_params
+from utils.utils import Foo, color_green, color_reset
+
+# robot base, height and radius (cm) and the env of the sbpd Loader
+robot = Foo(base=5., height=100., radius=20.)
+env = Foo(padding=10, resolution=5, num_point_threshold=2, valid_min=-10,
+          valid_max=200, n_samples_per_face=20)
+
+
+def box_mesh(lo, hi):
+    """The 12 triangles of the faces of an axis aligned box (in meters)"""
+    vertices = np.array([[x, y, z] for x in (lo[0], hi[0])
+                         for y in (lo[1], hi[1]) for z in (lo[2], hi[2])])
+    faces = np.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5],
+                      [0, 4, 5], [0, 5, 1], [2, 3, 7], [2, 7, 6],
+                      [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]])
+    return Foo(vertices=vertices, faces=faces)
+
+
+class MeshesShape(object):
+    """A building made of (box) meshes"""
+
+    def __init__(self, meshes):
+        self.meshes = meshes
+
+    def get_number_of_meshes(self):
+        return len(self.meshes)
+
+    def get_vertices(self):
+        return [np.concatenate([m.vertices for m in self.meshes], axis=0)]
+
+    def sample_points_on_face_of_shape(self, i, n_samples_per_face, sc):
+        # same as swiftshader_renderer.sample_points_on_faces
+        vs = self.meshes[i].vertices * sc
+        fs = self.meshes[i].faces
+        rng = np.random.RandomState(0)
+        idx = np.repeat(np.arange(fs.shape[0]), n_samples_per_face)
+        r = rng.rand(idx.size, 2)
+        r1 = r[:, :1]
+        r2 = r[:, 1:]
+        sqrt_r1 = np.sqrt(r1)
+        v1 = vs[fs[idx, 0], :]
+        v2 = vs[fs[idx, 1], :]
+        v3 = vs[fs[idx, 2], :]
+        pts = (1 - sqrt_r1) * v1 + sqrt_r1 * (1 - r2) * v2 + sqrt_r1 * r2 * v3
+        v1 = vs[fs[:, 0], :]
+        v2 = vs[fs[:, 1], :]
+        v3 = vs[fs[:, 2], :]
+        ar = 0.5 * np.sqrt(np.sum(np.cross(v1 - v3, v2 - v3)**2, 1))
+        return pts, ar, idx
+
+
+def create_building():
+    """A room (floor and walls) with a pillar and a low table"""
+    floor = box_mesh((0., 0., -.05), (6., 4., 0.))
+    walls = [box_mesh((0., 0., 0.), (6., .1, 2.5)),
+             box_mesh((0., 3.9, 0.), (6., 4., 2.5)),
+             box_mesh((0., 0., 0.), (.1, 4., 2.5)),
+             box_mesh((5.9, 0., 0.), (6., 4., 2.5))]
+    pillar = box_mesh((2., 1.5, 0.), (2.4, 1.9, 2.5))
+    table = box_mesh((4., 2., .7), (5., 3., .75))
+    shapess = [MeshesShape([floor] + walls), MeshesShape([pillar, table])]
+    vs = np.concatenate([s.get_vertices()[0] for s in shapess], axis=0)
+    return mu.make_map(env.padding, env.resolution, vertex=vs, sc=100.), shapess
+
+
+def traversible_reference(map, shapess, robot_radius):
+    """The traversible as computed by the original compute_traversibility"""
+    num_obstacle_points = np.zeros((map.size[1], map.size[0]))
+    num_points = np.zeros((map.size[1], map.size[0]))
+    for shapes in shapess:
+        for j in range(shapes.get_number_of_meshes()):
+            p, face_areas, face_idx = shapes.sample_points_on_face_of_shape(
+                j, env.n_samples_per_face, 100.)
+            wt = face_areas[face_idx] / env.n_samples_per_face
+            ind = np.logical_and(p[:, 2] > robot.base,
+                                 p[:, 2] < robot.base + robot.height)
+            num_obstacle_points += mu._project_to_map(map, p[ind, :], wt[ind])
+            ind = np.logical_and(p[:, 2] > env.valid_min,
+                                 p[:, 2] < env.valid_max)
+            num_points += mu._project_to_map(map, p[ind, :], wt[ind])
+
+    def fill_holes(img, thresh):
+        l, n = scipy.ndimage.label(np.logical_not(img))
+        img_ = img == True
+        cnts = np.bincount(l.reshape(-1))
+        for i, cnt in enumerate(cnts):
+            if cnt < thresh:
+                l[l == i] = -1
+        img_[l == -1] = True
+        return img_
+
+    thresh = create_building_params().building_thresh
+    selem = morphology.disk(robot_radius / map.resolution)
+    obstacle_free = scipy.ndimage.binary_dilation(
+        fill_holes(num_obstacle_points > env.num_point_threshold, thresh),
+        selem) != True
+    valid_space = fill_holes(num_points > env.num_point_threshold, thresh)
+    return num_obstacle_points, num_points, obstacle_free & valid_space
+
+
+def compute_traversibility(map, shapess, robot_radius, cache_key=None,
+                           num_workers=1):
+    return mu.compute_traversibility(
+        map, robot.base, robot.height, robot_radius, env.valid_min,
+        env.valid_max, env.num_point_threshold, shapess=shapess, sc=100.,
+        n_samples_per_face=env.n_samples_per_face, cache_key=cache_key,
+        num_workers=num_workers)
+
+
+def test_traversibility():
+    map, shapess = create_building()
+    num_obstacle_points, num_points, traversible = \
+        traversible_reference(map, shapess, robot.radius)
+    # the pillar and the table are obstacles, the rest of the room is free
+    assert(traversible.any() and not traversible.all())
+    for num_workers in [1, 2]:
+        map_out = compute_traversibility(map, shapess, robot.radius,
+                                         num_workers=num_workers)
+        assert(np.allclose(map_out.num_obstcale_points, num_obstacle_points))
+        assert(np.allclose(map_out.num_points, num_points))
+        assert(np.array_equal(map_out._traversible, traversible * 1.))
+
+
+def test_traversibility_cache():
+    mu.clear_traversible_caches()
+    map, shapess = create_building()
+    key = ('test_building', False)
+    map_out = compute_traversibility(map, shapess, robot.radius, cache_key=key)
+    # the cached point counts are reused (no meshes are needed)
+    map_cached = compute_traversibility(map, [], robot.radius, cache_key=key)
+    assert(np.array_equal(map_cached.traversible, map_out.traversible))
+    for robot_radius in [10., 30.]:
+        _, _, traversible = traversible_reference(map, shapess, robot_radius)
+        map_radius = compute_traversibility(map, [], robot_radius,
+                                            cache_key=key)
+        assert(map_radius.num_points is map_out.num_points)
+        assert(np.array_equal(map_radius.traversible, traversible * 1.))
+    # only the most recently used traversibles are kept
+    cache_size = create_building_params().traversible_cache_size
+    assert(len(mu.traversible_cache) == min(3, cache_size))
+    for robot_radius in np.arange(cache_size + 1) + 11.:
+        compute_traversibility(map, [], robot_radius, cache_key=key)
+    assert(len(mu.traversible_cache) == cache_size)
+    assert(len(mu.point_counts_cache) == 1)
+    mu.clear_traversible_caches()
+    assert(len(mu.point_counts_cache) == 0 and len(mu.traversible_cache) == 0)
+
+
+def main_test():
+    test_traversibility()
+    test_traversibility_cache()
+    print("%sTraversibility tests passed!%s" % (color_green, color_reset))
+
+
+if __name__ == '__main__':
+    main_test()
@@ -3,6 +3,8 @@ from trajectory.trajectory import Trajectory
 
 
 class Spline(Trajectory):
+    # the dtype of the spline coefficients and evaluations
+    dtype = np.dtype(np.float64)
 
     def fit(self, start_config, goal_config, final_times_n1=None, factors=None):
         """ Fit spline coefficients based on start_config
@@ -14,12 +16,16 @@ class Spline(Trajectory):
         where ts_nk is in unnormalized time"""
         self.ts_nk = ts_nk
         # Compute the normalized time for spline evaluation
-        ts_normalized_nk = np.clip(ts_nk / self.final_times_n1, 0., 1.)
+        ts_normalized_nk = self._buffer('ts_normalized_nk', ts_nk.shape)
+        np.divide(ts_nk, self.final_times_n1, out=ts_normalized_nk)
+        np.clip(ts_normalized_nk, 0., 1., out=ts_normalized_nk)
         self._eval_spline(ts_normalized_nk, calculate_speeds)
 
         # Convert velocities and accelerations to real world time
-        self.rescale_velocity_and_acceleration(
-            np.ones((self.n, 1)), self.final_times_n1)
+        # (they are only evaluated with calculate_speeds)
+        if calculate_speeds:
+            self.rescale_velocity_and_acceleration(
+                np.ones((self.n, 1)), self.final_times_n1)
 
     def _eval_spline(self, ts_nk, calculate_speeds=True):
         """ Evaluates the spline on points in ts_nk
@@ -27,17 +33,34 @@ class Spline(Trajectory):
         """
         raise NotImplementedError
 
+    def _buffer(self, name, shape):
+        """Returns the buffer (of self.dtype) holding the array name, which is
+        reused by every fit/evaluation and only reallocated when its shape
+        changes.
+        NOTE: the evaluated arrays (position_nk2(), ...) are such buffers, so
+        they are overwritten by the next evaluation (see Trajectory.copy)"""
+        buffers = self.__dict__.get('_spline_buffers')
+        if buffers is None:
+            buffers = self._spline_buffers = {}
+        buffer = buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != self.dtype:
+            buffer = buffers[name] = np.empty(shape, dtype=self.dtype)
+        return buffer
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_spline_buffers', None)
+        return state
+
     def rescale_velocity_and_acceleration(self, time_horizon_old_n1, time_horizon_new_n1):
         """
         Rescale the velocities and acceleration to be consistent with the time horizon given by time_horizon_new_n1,
         assuming the current numbers are consistent with time_horizon_old_n1
         """
-        # Convert velocities and accelerations to real world time
+        # Convert velocities and accelerations to real world time (in place)
         time_scaling_factor_n11 = time_horizon_new_n1[:,
                                                       np.newaxis, :] / time_horizon_old_n1[:, np.newaxis, :]
-        self._speed_nk1 = self._speed_nk1 / time_scaling_factor_n11
-        self._angular_speed_nk1 = self._angular_speed_nk1 / time_scaling_factor_n11
-        self._acceleration_nk1 = self._acceleration_nk1 / \
-            (time_scaling_factor_n11 ** 2)
-        self._angular_acceleration_nk1 = self._angular_acceleration_nk1 / \
-            (time_scaling_factor_n11 ** 2)
+        self._speed_nk1 /= time_scaling_factor_n11
+        self._angular_speed_nk1 /= time_scaling_factor_n11
+        self._acceleration_nk1 /= time_scaling_factor_n11 ** 2
+        self._angular_acceleration_nk1 /= time_scaling_factor_n11 ** 2
@@ -6,6 +6,8 @@ class Spline3rdOrder(Spline):
     def __init__(self, dt, n, k, params):
         super(Spline3rdOrder, self).__init__(dt=dt, n=n, k=k)
         self.params = params
+        # single precision (float32) splines are faster but less accurate
+        self.dtype = np.dtype(params.get('dtype', np.float64))
 
     """ A class representing a 3rd order spline for a mobile ground robot
     (in a 2d cartesian plane). The 3rd order spline allows for constraints
@@ -71,71 +73,83 @@ class Spline3rdOrder(Spline):
         a3_n1 = (final_times_n1 * vg_n1 / f2_n1) + c3_n1 - 2.
         b3_n1 = 1. - c3_n1 - a3_n1
 
-        self.x_coeffs_n14 = np.stack([a1_n1, b1_n1, c1_n1, d1_n1], axis=2)
-        self.y_coeffs_n14 = np.stack([a2_n1, b2_n1, c2_n1, d2_n1], axis=2)
-        self.p_coeffs_n14 = np.stack([a3_n1, b3_n1, c3_n1, 0.0 * c3_n1],
-                                     axis=2)
-        self.final_times_n1 = final_times_n1
-
         # Update the batch size as the same spline object
         # can be used with multiple start/ goal configurations
         self.n = start_config.n
 
+        # the coefficients (highest degree first) are stored in buffers
+        n = self.n
+        self.x_coeffs_n14 = np.stack([a1_n1, b1_n1, c1_n1, d1_n1], axis=2,
+                                     out=self._buffer('x_coeffs_n14', (n, 1, 4)))
+        self.y_coeffs_n14 = np.stack([a2_n1, b2_n1, c2_n1, d2_n1], axis=2,
+                                     out=self._buffer('y_coeffs_n14', (n, 1, 4)))
+        self.p_coeffs_n14 = np.stack([a3_n1, b3_n1, c3_n1, 0.0 * c3_n1], axis=2,
+                                     out=self._buffer('p_coeffs_n14', (n, 1, 4)))
+        self.final_times_n1 = final_times_n1
+
     def _eval_spline(self, ts_nk, calculate_speeds=True):
         """ Evaluates the spline on points in ts_nk
         Assumes ts is normalized to be in [0, 1.]
+        The polynomials (and their derivatives) are evaluated in Horner form
+        directly into (n, k) buffers which are reused by the next evaluations
         """
+        n, k = ts_nk.shape
+        ts_nk = ts_nk.astype(self.dtype, copy=False)
         x_coeffs_n14 = self.x_coeffs_n14
         y_coeffs_n14 = self.y_coeffs_n14
         p_coeffs_n14 = self.p_coeffs_n14
 
-        # with tf.name_scope('eval_spline'):
-        ts_n4k = np.stack([np.power(ts_nk, 3), np.power(ts_nk, 2),
-                           ts_nk, np.ones_like(ts_nk)], axis=1)
-        ps_nk = np.squeeze(np.matmul(p_coeffs_n14, ts_n4k), axis=1)
+        position_nk2 = self._buffer('position_nk2', (n, k, 2))
+        heading_nk1 = self._buffer('heading_nk1', (n, k, 1))
 
-        ps_n4k = np.stack([np.power(ps_nk, 3), np.power(ps_nk, 2),
-                           ps_nk, np.ones_like(ps_nk)], axis=1)
-        ps_dot_n4k = np.stack([3.0 * np.power(ps_nk, 2), 2.0 * ps_nk,
-                               np.ones_like(ps_nk), np.zeros_like(ps_nk)],
-                              axis=1)
+        ps_nk = _horner(p_coeffs_n14, ts_nk, self._buffer('ps_nk', (n, k)))
+        _horner(x_coeffs_n14, ps_nk, position_nk2[:, :, 0])
+        _horner(y_coeffs_n14, ps_nk, position_nk2[:, :, 1])
 
-        xs_nk = np.squeeze(np.matmul(x_coeffs_n14, ps_n4k), axis=1)
-        ys_nk = np.squeeze(np.matmul(y_coeffs_n14, ps_n4k), axis=1)
+        xs_dot_nk = _horner_derivative(x_coeffs_n14, ps_nk,
+                                       self._buffer('xs_dot_nk', (n, k)))
+        ys_dot_nk = _horner_derivative(y_coeffs_n14, ps_nk,
+                                       self._buffer('ys_dot_nk', (n, k)))
+        np.arctan2(ys_dot_nk, xs_dot_nk, out=heading_nk1[:, :, 0])
 
-        xs_dot_nk = np.squeeze(np.matmul(x_coeffs_n14, ps_dot_n4k), axis=1)
-        ys_dot_nk = np.squeeze(np.matmul(y_coeffs_n14, ps_dot_n4k), axis=1)
-
-        self._position_nk2 = np.stack([xs_nk, ys_nk], axis=2)
-        self._heading_nk1 = np.arctan2(ys_dot_nk, xs_dot_nk)[:, :, None]
+        self._position_nk2 = position_nk2
+        self._heading_nk1 = heading_nk1
 
         if calculate_speeds:
-            ts_dot_n4k = np.stack([3.0 * np.power(ts_nk, 2), 2.0 * ts_nk,
-                                   np.ones_like(ts_nk), np.zeros_like(ts_nk)],
-                                  axis=1)
-            ps_ddot_n4k = np.stack([6.0 * ps_nk, 2.0 * np.ones_like(ps_nk),
-                                    np.zeros_like(ps_nk),
-                                    np.zeros_like(ps_nk)], axis=1)
-
-            ps_dot_nk = np.squeeze(
-                np.matmul(p_coeffs_n14, ts_dot_n4k), axis=1)
-
-            xs_ddot_nk = np.squeeze(
-                np.matmul(x_coeffs_n14, ps_ddot_n4k), axis=1)
-            ys_ddot_nk = np.squeeze(
-                np.matmul(y_coeffs_n14, ps_ddot_n4k), axis=1)
-
-            speed_ps_nk = np.sqrt(xs_dot_nk**2 + ys_dot_nk**2)
-            speed_nk = (speed_ps_nk * ps_dot_nk)
-
-            numerator_nk = xs_dot_nk * ys_ddot_nk - ys_dot_nk * xs_ddot_nk
-            angular_speed_nk = numerator_nk / (speed_ps_nk**2) * ps_dot_nk
-
-            self._speed_nk1 = speed_nk[:, :, None]
-            self._angular_speed_nk1 = angular_speed_nk[:, :, None]
-
-            self._acceleration_nk1 = np.zeros_like(self._speed_nk1)
-            self._angular_acceleration_nk1 = np.zeros_like(self._speed_nk1)
+            speed_nk1 = self._buffer('speed_nk1', (n, k, 1))
+            angular_speed_nk1 = self._buffer('angular_speed_nk1', (n, k, 1))
+            acceleration_nk1 = self._buffer('acceleration_nk1', (n, k, 1))
+            angular_acceleration_nk1 = \
+                self._buffer('angular_acceleration_nk1', (n, k, 1))
+
+            ps_dot_nk = _horner_derivative(p_coeffs_n14, ts_nk,
+                                           self._buffer('ps_dot_nk', (n, k)))
+            xs_ddot_nk = _horner_second_derivative(
+                x_coeffs_n14, ps_nk, self._buffer('xs_ddot_nk', (n, k)))
+            ys_ddot_nk = _horner_second_derivative(
+                y_coeffs_n14, ps_nk, self._buffer('ys_ddot_nk', (n, k)))
+
+            # speed = sqrt(xs_dot^2 + ys_dot^2) * ps_dot
+            speed_ps_sq_nk = np.multiply(xs_dot_nk, xs_dot_nk,
+                                         out=self._buffer('speed_ps_sq_nk', (n, k)))
+            speed_ps_sq_nk += ys_dot_nk * ys_dot_nk
+            speed_nk = np.sqrt(speed_ps_sq_nk, out=speed_nk1[:, :, 0])
+            speed_nk *= ps_dot_nk
+
+            # angular speed = (xs_dot * ys_ddot - ys_dot * xs_ddot) / speed^2 * ps_dot
+            # (computed in place of the second derivatives)
+            ys_ddot_nk *= xs_dot_nk
+            xs_ddot_nk *= ys_dot_nk
+            numerator_nk = np.subtract(ys_ddot_nk, xs_ddot_nk, out=ys_ddot_nk)
+            numerator_nk /= speed_ps_sq_nk
+            np.multiply(numerator_nk, ps_dot_nk, out=angular_speed_nk1[:, :, 0])
+
+            acceleration_nk1.fill(0.)
+            angular_acceleration_nk1.fill(0.)
+            self._speed_nk1 = speed_nk1
+            self._angular_speed_nk1 = angular_speed_nk1
+            self._acceleration_nk1 = acceleration_nk1
+            self._angular_acceleration_nk1 = angular_acceleration_nk1
 
     def check_dynamic_feasibility(self, speed_max_system, angular_speed_max_system, horizon_s):
         """Checks whether the current computed spline can be executed in time <= horizon_s (specified in seconds)
@@ -219,3 +233,31 @@ class Spline3rdOrder(Spline):
         super().render(axs, batch_idx, freq, plot_heading=plot_heading,
                        plot_velocity=plot_velocity,
                        label_start_and_end=label_start_and_end, name='Spline')
+
+
+def _horner(coeffs_n14, ts_nk, out_nk):
+    """Evaluates the cubics a*t^3 + b*t^2 + c*t + d (coeffs_n14 = [a, b, c, d])
+    at ts_nk as ((a*t + b)*t + c)*t + d into out_nk"""
+    np.multiply(coeffs_n14[:, :, 0], ts_nk, out=out_nk)
+    out_nk += coeffs_n14[:, :, 1]
+    out_nk *= ts_nk
+    out_nk += coeffs_n14[:, :, 2]
+    out_nk *= ts_nk
+    out_nk += coeffs_n14[:, :, 3]
+    return out_nk
+
+
+def _horner_derivative(coeffs_n14, ts_nk, out_nk):
+    """Evaluates the derivative of the cubics, (3a*t + 2b)*t + c, into out_nk"""
+    np.multiply(3. * coeffs_n14[:, :, 0], ts_nk, out=out_nk)
+    out_nk += 2. * coeffs_n14[:, :, 1]
+    out_nk *= ts_nk
+    out_nk += coeffs_n14[:, :, 2]
+    return out_nk
+
+
+def _horner_second_derivative(coeffs_n14, ts_nk, out_nk):
+    """Evaluates the second derivative of the cubics, 6a*t + 2b, into out_nk"""
+    np.multiply(6. * coeffs_n14[:, :, 0], ts_nk, out=out_nk)
+    out_nk += 2. * coeffs_n14[:, :, 1]
+    return out_nk
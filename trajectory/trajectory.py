@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import copy
 
 
@@ -281,27 +280,58 @@ class Trajectory(object):
     def append_along_time_axis(self, trajectory, track_trajectory_acceleration=True):
         """ Utility function to concatenate trajectory
         over time. Useful for assembling an entire
-        trajectory from multiple sub-trajectories. """
-        self._position_nk2 = np.concatenate([self.position_nk2(),
-                                             trajectory.position_nk2()],
-                                            axis=1)
-        self._speed_nk1 = np.concatenate([self.speed_nk1(), trajectory.speed_nk1()],
-                                         axis=1)
+        trajectory from multiple sub-trajectories.
+        The arrays are stored in buffers whose capacity (along the time axis)
+        doubles when full, so appending is amortized O(1) and the accessors
+        (position_nk2(), ...) return views of the buffers. """
+        self._append_to_buffer('_position_nk2', trajectory.position_nk2())
+        self._append_to_buffer('_speed_nk1', trajectory.speed_nk1())
         if(track_trajectory_acceleration):
-            self._acceleration_nk1 = np.concatenate([self.acceleration_nk1(),
-                                                     trajectory.acceleration_nk1()],
-                                                    axis=1)
-            self._angular_acceleration_nk1 = np.concatenate([self.angular_acceleration_nk1(),
-                                                             trajectory.angular_acceleration_nk1()],
-                                                            axis=1)
-        self._heading_nk1 = np.concatenate([self.heading_nk1(),
-                                            trajectory.heading_nk1()], axis=1)
-        self._angular_speed_nk1 = np.concatenate([self.angular_speed_nk1(),
-                                                  trajectory.angular_speed_nk1()],
-                                                 axis=1)
+            self._append_to_buffer('_acceleration_nk1',
+                                   trajectory.acceleration_nk1())
+            self._append_to_buffer('_angular_acceleration_nk1',
+                                   trajectory.angular_acceleration_nk1())
+        self._append_to_buffer('_heading_nk1', trajectory.heading_nk1())
+        self._append_to_buffer('_angular_speed_nk1',
+                               trajectory.angular_speed_nk1())
         self.k = self.k + trajectory.k
         self.valid_horizons_n1 = self.valid_horizons_n1 + trajectory.valid_horizons_n1
 
+    def _append_to_buffer(self, name, arr_nk):
+        """Appends arr_nk to the array self.<name> along the time axis,
+        growing its buffer (by doubling its capacity) only when it is full"""
+        current_nk = self.__dict__[name]
+        buffers = self.__dict__.get('_time_axis_buffers')
+        if buffers is None:
+            buffers = self._time_axis_buffers = {}
+        buffer, view = buffers.get(name, (None, None))
+        k = current_nk.shape[1]
+        new_k = k + arr_nk.shape[1]
+        # the array could have been assigned (or clipped, ...) since the
+        # last append, arrays of other dtypes are upcast like np.concatenate
+        if current_nk is not view or buffer.shape[1] < new_k or \
+                (arr_nk.dtype != buffer.dtype and
+                 np.result_type(buffer, arr_nk) != buffer.dtype):
+            assert(arr_nk.shape[0] == current_nk.shape[0] and
+                   arr_nk.shape[2:] == current_nk.shape[2:])
+            buffer = np.empty((current_nk.shape[0], 2 * new_k) + current_nk.shape[2:],
+                              dtype=np.result_type(current_nk, arr_nk))
+            buffer[:, :k] = current_nk
+        elif arr_nk.shape[0] != buffer.shape[0]:
+            raise ValueError("Cannot append a trajectory of batch size %d to one of %d" %
+                             (arr_nk.shape[0], buffer.shape[0]))
+        buffer[:, k:new_k] = arr_nk
+        view = buffer[:, :new_k]
+        self.__dict__[name] = view
+        buffers[name] = (buffer, view)
+
+    def __getstate__(self):
+        # the spare capacity of the buffers is not copied (nor pickled), the
+        # copied arrays are only as long as the trajectory
+        state = self.__dict__.copy()
+        state.pop('_time_axis_buffers', None)
+        return state
+
     def clip_along_time_axis(self, horizon):
         """ Utility function for clipping a trajectory along
         the time axis. Useful for clipping a trajectory within
@@ -565,6 +595,7 @@ class SystemConfig(Trajectory):
                       np.cos([pos_3[2]]), np.sin([pos_3[2]]))
 
     def render_with_boundary(self, ax, batch_idx, boundary_params, **kwargs):
+        import matplotlib.pyplot as plt
         self.render(ax, batch_idx, **kwargs)
         if boundary_params['norm'] == 2:
             center = self.position_nk2()[batch_idx, 0]
@@ -152,3 +152,89 @@ def bin_points(XYZ_cms, map_size, z_bins, xy_resolution):
         list(sh[:-3]) + [map_size, map_size, n_z_bins])
     isvalids = np.array(isvalids).reshape(list(sh[:-3]) + [sh[-3], sh[-2], 1])
     return counts, isvalids
+
+
+class DepthProjector(object):
+    """Fused (and batch capable) get_point_cloud_from_z, make_geocentric,
+    transform to the robot's location and bin_points for a fixed camera.
+    The per-pixel rays are computed once and the point cloud is never
+    materialized, the bin counts are written into a reusable buffer."""
+
+    def __init__(self, camera_matrix, height, width, sensor_height,
+                 camera_elevation_degree, map_size, z_bins, xy_resolution):
+        self.height, self.width = height, width
+        self.sensor_height = sensor_height
+        self.map_size = map_size
+        self.z_bins = z_bins
+        self.n_z_bins = len(z_bins) + 1
+        self.xy_resolution = xy_resolution
+        # geocentric direction of every pixel (at a depth of 1), see
+        # get_point_cloud_from_z and make_geocentric
+        x, z = np.meshgrid(np.arange(width), np.arange(height - 1, -1, -1))
+        rays_p3 = np.stack([(x.ravel() - camera_matrix.xc) / camera_matrix.f,
+                            np.ones(height * width),
+                            (z.ravel() - camera_matrix.zc) / camera_matrix.f], axis=1)
+        R = get_r_matrix([1., 0., 0.],
+                         angle=np.deg2rad(camera_elevation_degree))
+        rays_p3 = np.matmul(rays_p3, R.T)
+        self.rays_x, self.rays_y, self.rays_z = \
+            [np.ascontiguousarray(rays_p3[:, i]) for i in range(3)]
+        # (same dtype as the weighted counts of bin_points)
+        self.counts = np.zeros((0, map_size, map_size, self.n_z_bins),
+                               dtype=np.float64)
+
+    def project(self, depth_imgs_meters, pos_n3):
+        """Bins the depth images (n x H x W, in meters) taken from the robot
+        locations pos_n3 (x, y in meters and theta, or a single location)
+        Outputs counts n x map_size x map_size x (len(z_bins)+1) and the
+        isvalid masks n x H x W x 1 (same as bin_points).
+        NOTE: the counts are a view of the reusable buffer, they are
+        overwritten by the next call (copy them to keep them)"""
+        depth_imgs_meters = np.reshape(depth_imgs_meters,
+                                       (-1, self.height * self.width))
+        n = len(depth_imgs_meters)
+        # (a single location for all the images)
+        pos_n3 = np.broadcast_to(np.reshape(pos_n3, (-1, 3)), (n, 3))
+        if len(self.counts) < n:
+            self.counts = np.zeros((n, self.map_size, self.map_size,
+                                    self.n_z_bins), dtype=np.float64)
+        counts = self.counts[:n]
+        isvalids = np.zeros((n, self.height, self.width, 1), dtype=bool)
+        for i in range(n):
+            isvalids[i, ..., 0] = self._project_into(
+                depth_imgs_meters[i], pos_n3[i], counts[i].reshape(-1)
+            ).reshape(self.height, self.width)
+        return counts, isvalids
+
+    def _project_into(self, depth_p, pos_3, counts):
+        Y_cm = depth_p * 100.  # convert to centimeters
+        # rotate the rays to the robot's heading (about the z axis)
+        R = get_r_matrix([0., 0., 1.], angle=pos_3[2] - np.pi / 2.)
+        X = Y_cm * (R[0, 0] * self.rays_x + R[0, 1] * self.rays_y)
+        X += pos_3[0] * 100.
+        Y = Y_cm * (R[1, 0] * self.rays_x + R[1, 1] * self.rays_y)
+        Y += pos_3[1] * 100.
+        Z = Y_cm * self.rays_z
+        Z += self.sensor_height
+
+        isvalid = np.logical_not(np.isnan(X))
+        with np.errstate(invalid='ignore'):
+            X_bin = np.round(X / self.xy_resolution).astype(np.int32)
+            Y_bin = np.round(Y / self.xy_resolution).astype(np.int32)
+        # (same as np.digitize for the few increasing z_bins)
+        Z_bin = np.zeros(len(Z), dtype=np.int32)
+        for z_bin in self.z_bins:
+            Z_bin += Z >= z_bin
+        isvalid &= (X_bin >= 0) & (X_bin < self.map_size)
+        isvalid &= (Y_bin >= 0) & (Y_bin < self.map_size)
+        isvalid &= (Z_bin >= 0) & (Z_bin < self.n_z_bins)
+
+        counts.fill(0)
+        ind = (Y_bin[isvalid].astype(np.int64) * self.map_size +
+               X_bin[isvalid]) * self.n_z_bins + Z_bin[isvalid]
+        if len(ind) > 0:
+            # only count over the span of bins that were hit
+            ind_min = ind.min()
+            count = np.bincount(ind - ind_min)
+            counts[ind_min:ind_min + len(count)] = count
+        return isvalid
@@ -1,5 +1,4 @@
 import numpy as np
-import skfmm
 import sys
 if sys.version[0] == '2':
     from voxel_map_utils import VoxelMap
@@ -12,7 +11,8 @@ class FmmMap(object):
     Maintain a FMM distance and angle map corresponding to a given goal and occupancy grid.
     """
 
-    def __init__(self, goal_grid_mn, dx=1, map_origin_2=np.zeros([2], dtype=np.float32), mask_grid_mn=None):
+    def __init__(self, goal_grid_mn, dx=1, map_origin_2=np.zeros([2], dtype=np.float32), mask_grid_mn=None,
+                 backend='fmm'):
         """
         Args:
             goal_grid_mn: A mxn grid containing the goal positions. Typically, it should have 0s at the goal positions
@@ -21,12 +21,18 @@ class FmmMap(object):
             map_origin_2: The origin of the goal grid.
             mask_grid_mn: The part of the goal array to be masked before computing the fmm distance. Typically, the
                           array should have 1 at the grid points to be masked and 0 everywhere else.
+            backend: Either 'fmm' (geodesic distance via skfmm, respects the mask) or 'edt' (exact euclidean
+                     distance transform via scipy, only valid when there is no mask, i.e. obstacle distances).
         """
         m, n = goal_grid_mn.shape[0], goal_grid_mn.shape[1]
+        assert(backend in ['fmm', 'edt'])
+        # the euclidean distance transform ignores any masked regions
+        assert(backend == 'fmm' or mask_grid_mn is None)
         self.mask_grid_mn = mask_grid_mn
         self.goal_grid_mn = goal_grid_mn
         self.map_origin_2 = map_origin_2
         self.dx = dx
+        self.backend = backend
 
         # generate blank distance/angle voxel (3d pixel) maps
         self.fmm_distance_map = VoxelMap(scale=dx,
@@ -54,8 +60,13 @@ class FmmMap(object):
             phi = self.goal_grid_mn
 
         # Compute the fmm distance
-        fmm_distance = skfmm.distance(
-            phi, dx=self.fmm_distance_map.map_scale * np.ones(2))
+        if self.backend == 'edt':
+            fmm_distance = self._signed_distance_transform(
+                phi, self.fmm_distance_map.map_scale)
+        else:
+            import skfmm  # only imported (slow) for the fmm backend
+            fmm_distance = skfmm.distance(
+                phi, dx=self.fmm_distance_map.map_scale * np.ones(2))
 
         # Assign some distance at the mask
         if self.mask_grid_mn is not None:  # Dont think I want to do this
@@ -72,6 +83,22 @@ class FmmMap(object):
         self.fmm_angle_map.voxel_function_mn = np.array(
             fmm_angle, dtype=np.float32)
 
+    @staticmethod
+    def _signed_distance_transform(phi_mn, dx):
+        """
+        Signed euclidean distance to the zero level set of phi_mn, matching
+        the convention of skfmm.distance: the zero contour lies halfway
+        between a goal (negative) cell and a free (positive) cell, so
+        distances are negative inside the goal set.
+        """
+        from scipy import ndimage
+        inside_mn = np.asarray(phi_mn) < 0
+        # distance (in cells) from every cell to the nearest cell on the other side
+        dist_outside_mn = ndimage.distance_transform_edt(
+            np.logical_not(inside_mn))
+        dist_inside_mn = ndimage.distance_transform_edt(inside_mn)
+        return np.where(inside_mn, 0.5 - dist_inside_mn, dist_outside_mn - 0.5) * dx
+
     def change_goal(self, goal_positions_n2, mask_value=1000):
         """
         Recompute the fmm maps based on the new goal position.
@@ -108,7 +135,33 @@ class FmmMap(object):
         return goal_array_mn
 
     @classmethod
-    def create_fmm_map_based_on_goal_position(cls, goal_positions_n2, map_size_2, dx=1, map_origin_2=np.zeros([2], dtype=np.float32), mask_grid_mn=None):
+    def create_fmm_map_from_precomputed(cls, fmm_distance_mn, fmm_angle_mn, dx=1, map_origin_2=np.zeros([2], dtype=np.float32), backend='fmm'):
+        """
+        Create a new fmm map instance from already computed distance and angle
+        arrays (i.e. loaded from a map bundle) without running the fmm again.
+        The arrays are used as is, so read-only memory maps stay shared.
+        """
+        fmm_map = cls.__new__(cls)
+        m, n = fmm_distance_mn.shape[0], fmm_distance_mn.shape[1]
+        fmm_map.mask_grid_mn = None
+        fmm_map.goal_grid_mn = None
+        fmm_map.map_origin_2 = map_origin_2
+        fmm_map.dx = dx
+        fmm_map.backend = backend
+        fmm_map.fmm_distance_map = VoxelMap(scale=dx,
+                                            origin_2=map_origin_2,
+                                            map_size_2=np.array(
+                                                [n, m], dtype=np.float32),
+                                            function_array_mn=fmm_distance_mn)
+        fmm_map.fmm_angle_map = VoxelMap(scale=dx,
+                                         origin_2=map_origin_2,
+                                         map_size_2=np.array(
+                                             [n, m], dtype=np.float32),
+                                         function_array_mn=fmm_angle_mn)
+        return fmm_map
+
+    @classmethod
+    def create_fmm_map_based_on_goal_position(cls, goal_positions_n2, map_size_2, dx=1, map_origin_2=np.zeros([2], dtype=np.float32), mask_grid_mn=None, backend='fmm'):
         """
         Create a new fmm map instance based on a given goal position.
         """
@@ -119,4 +172,5 @@ class FmmMap(object):
         return cls(goal_grid_mn=goal_array_mn,
                    dx=dx,
                    map_origin_2=map_origin_2,
-                   mask_grid_mn=mask_grid_mn)
+                   mask_grid_mn=mask_grid_mn,
+                   backend=backend)
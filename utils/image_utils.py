@@ -1,11 +1,20 @@
 import os
+import multiprocessing
 import numpy as np
 from utils.utils import *
 import glob
-import imageio
-import matplotlib as mpl
-mpl.use('Agg')  # for rendering without a display
-import matplotlib.pyplot as plt
+
+"""
+NOTE: matplotlib and imageio are slow to import, so they are only imported
+(by the functions that use them) once something is plotted or saved
+"""
+
+
+def get_pyplot():
+    import matplotlib as mpl
+    mpl.use('Agg')  # for rendering without a display
+    import matplotlib.pyplot as plt
+    return plt
 
 
 def plot_image_observation(ax, img_mkd, size=None):
@@ -23,26 +32,62 @@ def plot_image_observation(ax, img_mkd, size=None):
         raise NotImplementedError
 
 
-def gather_metadata(ppm: float, a, plot_start_goal: bool, start: list,
+class AgentFrame(object):
+    """Lightweight (picklable) snapshot of an agent holding only what is
+    drawn in a frame, so the frames can be sent to other processes cheaply"""
+
+    def __init__(self, a, traj_clip: int = 0):
+        self.pos_3 = a.get_current_config().to_3D_numpy()
+        self.radius = a.get_radius()
+        self.color = a.get_color()
+        # collision means either the agent collided with an obstacle (get_collided) or
+        # the agent has recently been collided with and is on a "collision cooldown"
+        self.collided = a.get_collided() or (a.get_collision_cooldown() > 0)
+        try:
+            self.start_3 = a.get_start_config().to_3D_numpy()
+            self.goal_3 = a.get_goal_config().to_3D_numpy()
+        except:
+            self.start_3 = None
+            self.goal_3 = None
+        self.traj_xy_k2 = None
+        trajectory = a.get_trajectory()
+        if trajectory:
+            # only the *last* "traj_clip" points (same as Trajectory.render)
+            self.traj_xy_k2 = np.array(
+                trajectory.position_nk2()[0, -1:-1 * traj_clip:-1])
+
+    @staticmethod
+    def from_arrays(pos_3, radius: float, color: str, collided: bool,
+                    start_3=None, goal_3=None, traj_xy_k2=None):
+        """Constructs an AgentFrame directly from its (recorded) values"""
+        frame = AgentFrame.__new__(AgentFrame)
+        frame.pos_3 = pos_3
+        frame.radius = radius
+        frame.color = color
+        frame.collided = collided
+        frame.start_3 = start_3
+        frame.goal_3 = goal_3
+        frame.traj_xy_k2 = traj_xy_k2
+        return frame
+
+
+def get_agent_frames(agents_dict: dict, traj_clip: int = 0):
+    return {name: AgentFrame(a, traj_clip) for name, a in agents_dict.items()}
+
+
+def gather_metadata(ppm: float, a: AgentFrame, plot_start_goal: bool, start: list,
                     goal: list, traj_col: str = ''):
-    # collision means either the agent collided with an obstacle (get_collided) or
-    # the agent has recently been collided with and is on a "collision cooldown"
-    collided = a.get_collided() or (a.get_collision_cooldown() > 0)
-    markersize = a.get_radius() * ppm
-    pos_3 = a.get_current_config().to_3D_numpy()
+    collided = a.collided
+    markersize = a.radius * ppm
+    pos_3 = a.pos_3
     if(traj_col == ""):
-        traj_col = a.get_color()
+        traj_col = a.color
     start_3 = None
     goal_3 = None
     if(plot_start_goal):
-        try:
-            # set the start and goal if it exists in the agent, else use the provided
-            start_3 = a.get_start_config().to_3D_numpy()
-            goal_3 = a.get_goal_config().to_3D_numpy()
-        except:
-            # use the start_3 and goal_3 provided
-            start_3 = start
-            goal_3 = goal
+        # set the start and goal if it exists in the agent, else use the provided
+        start_3 = a.start_3 if a.start_3 is not None else start
+        goal_3 = a.goal_3 if a.goal_3 is not None else goal
         assert(start_3 is not None)
         assert(goal_3 is not None)
 
@@ -68,16 +113,17 @@ def plot_agent_dict(ax, ppm: float, agents_dict: dict, label='Agent', normal_col
                     traj_color='', plot_start_goal=False, start_3=None, goal_3=None, traj_clip=0):
     # plot all the simulated prerecorded gen_agents
     for i, a in enumerate(agents_dict.values()):
+        if not isinstance(a, AgentFrame):
+            a = AgentFrame(a, traj_clip)
         # gather important info regarding the values to plot
         collided, ms, pos_3, traj_col, start_3, goal_3 = \
             gather_metadata(ppm, a, plot_start_goal,
                             start_3, goal_3, traj_color)
 
         # render agent's trajectory
-        if(plot_trajectory and a.get_trajectory()):
-            a.get_trajectory().render(ax, freq=1, color=traj_col,
-                                      alpha=alpha, plot_quiver=False,
-                                      clip=traj_clip, linewidth=ppm / 8.2)
+        if(plot_trajectory and a.traj_xy_k2 is not None):
+            ax.plot(a.traj_xy_k2[:, 0], a.traj_xy_k2[:, 1], '-', color=traj_col,
+                    alpha=alpha, linewidth=ppm / 8.2)
 
         # gather colors/labels for the agent plot
         start_col, goal_col, draw_label, sl, gl = \
@@ -131,11 +177,22 @@ def plot_topview(ax, extent, traversible, human_traversible, camera_pos_13,
         room_center (np.array): the center of the "room" to focus the image plot off of
         plot_quiver (bool, optional): whether or not to plot the quiver (arrow). Defaults to False.
     """
+    ppm = get_pixels_per_meter(ax)
+    plot_map(ax, extent, traversible, human_traversible)
+    plot_topview_agents(ax, ppm, pedestrians, robots, room_center,
+                        plot_quiver=plot_quiver, plot_meter_tick=plot_meter_tick)
+
+
+def get_pixels_per_meter(ax):
     # get number of pixels-per-meter based off the ax plot space
     img_scale = \
         ax.transData.transform((0, 1)) - ax.transData.transform((0, 0))
     # scale the pixels-per-meter based off the image scale
-    ppm = int(img_scale[1])
+    return int(img_scale[1])
+
+
+def plot_map(ax, extent, traversible, human_traversible):
+    """Plots the (static) environment traversible and the human traversible"""
     ax.imshow(traversible, extent=extent, cmap='gray',
               vmin=-0.5, vmax=1.5, origin='lower')
     # Plot human traversible
@@ -151,6 +208,10 @@ def plot_topview(ax, extent, traversible, human_traversible, camera_pos_13,
                   vmin=-.5, vmax=1.5, origin='lower', alpha=alphas)
         # alphas = np.all(np.logical_not(human_traversible))
 
+
+def plot_topview_agents(ax, ppm: float, pedestrians, robots, room_center,
+                        plot_quiver=False, plot_meter_tick=False):
+    """Plots the agents (and informational visuals) of the topview"""
     # TODO: make plot_quiver a simulator-wide param for pedestrians and robot
     # Plot the camera (robots)
     plot_agent_dict(ax, ppm, robots, label="Robot", normal_color="ro",
@@ -184,7 +245,7 @@ def plot_topview(ax, extent, traversible, human_traversible, camera_pos_13,
 
 def render_scene(p, rgb_image_1mk3, depth_image_1mk1, environment,
                  camera_pos_13, pedestrians, robots,
-                 sim_t: float, wall_t: float, filename: str, with_zoom=False):
+                 sim_t: float, wall_t: float, filename: str = None, with_zoom=False):
     """Plots a single frame from information provided about the world state
 
     Args:
@@ -198,7 +259,8 @@ def render_scene(p, rgb_image_1mk3, depth_image_1mk1, environment,
         robots (AgentState dict): the robots states
         sim_t (float): the simulator time in seconds
         wall_t (float): the wall clock time in seconds
-        filename (str): the name of the file to save
+        filename (str): the name of the file to save (None to return the
+                        image of the frame instead)
     """
     map_scale = environment["map_scale"]
     room_center = environment["room_center"]
@@ -226,6 +288,7 @@ def render_scene(p, rgb_image_1mk3, depth_image_1mk1, environment,
         depth_img_plt_indx = plot_count  # 4
 
     img_size = 10 * p.img_scale
+    plt = get_pyplot()
     fig = plt.figure(figsize=(plot_count * img_size, img_size))
     ax = fig.add_subplot(1, plot_count, 1)
     ax.set_aspect('equal')
@@ -269,6 +332,35 @@ def render_scene(p, rgb_image_1mk3, depth_image_1mk1, environment,
         ax.set_yticks([])
         ax.set_title('Depth')
 
+    image = None
+    if filename is not None:
+        save_figure(p, fig, filename)
+    else:
+        fig.canvas.draw()
+        rows, cols = get_tight_crop(fig)
+        image = np.array(fig.canvas.buffer_rgba())[rows, cols, :3]
+    fig.clear()
+    plt.cla()
+    plt.clf()
+    plt.close('all')
+    plt.close(fig)
+    del fig
+    return image
+
+
+def get_tight_crop(fig):
+    """Rows and columns (of the canvas buffer) of the tight bbox of the figure
+    NOTE: unlike savefig, the bbox is never expanded beyond the canvas"""
+    renderer = fig.canvas.get_renderer()
+    bbox = fig.get_tightbbox(renderer).transformed(fig.dpi_scale_trans)
+    height = int(fig.bbox.height)
+    x0, x1 = max(0, int(np.floor(bbox.x0))), int(np.ceil(bbox.x1))
+    y0, y1 = max(0, int(np.floor(bbox.y0))), int(np.ceil(bbox.y1))
+    # the buffer rows start at the top of the figure
+    return slice(max(0, height - y1), height - y0), slice(x0, x1)
+
+
+def save_figure(p, fig, filename: str):
     full_file_name = os.path.join(p.output_directory, filename)
     if not os.path.exists(full_file_name):
         if p.verbose_printing:
@@ -277,47 +369,238 @@ def render_scene(p, rgb_image_1mk3, depth_image_1mk1, environment,
         touch(full_file_name)  # Just as the bash command
 
     fig.savefig(full_file_name, bbox_inches='tight', pad_inches=0)
-    fig.clear()
-    plt.cla()
-    plt.clf()
-    plt.close('all')
-    plt.close(fig)
-    del fig
     if p.verbose_printing:
         print('\033[32m', "Successfully rendered:",
               full_file_name, '\033[0m')
 
 
-def render_rgb_and_depth(r, camera_pos_13, dx_m: float, human_visible=True):
+def save_image(p, image, filename: str):
+    import imageio
+    full_file_name = os.path.join(p.output_directory, filename)
+    imageio.imwrite(full_file_name, image)
+    if p.verbose_printing:
+        print('\033[32m', "Successfully rendered:",
+              full_file_name, '\033[0m')
+
+
+def get_topview_frame(camera_pos_13, pedestrians, robots, sim_t: float,
+                      wall_t: float):
+    """Gathers (only) what is drawn in a topview frame, in a lightweight form"""
+    # same trajectory clipping as plot_topview_agents
+    return {"camera_pos_13": camera_pos_13,
+            "pedestrians": get_agent_frames(pedestrians, traj_clip=50),
+            "robots": get_agent_frames(robots),
+            "sim_t": sim_t,
+            "wall_t": wall_t}
+
+
+class TopviewFigure(object):
+    """A topview figure whose (static) map is rasterized only once into a
+    cached background, every frame rendered with it restores the background
+    and only draws (blits) the agents, the legend and the title on top"""
+
+    def __init__(self, p, environment: dict):
+        self.p = p
+        map_scale = environment["map_scale"]
+        traversible = environment["map_traversible"]
+        self.room_center = environment["room_center"]
+        # Compute the real_world extent (in meters) of the traversible
+        extent = [0., traversible.shape[1], 0., traversible.shape[0]]
+        extent = np.array(extent) * map_scale
+        img_size = 10 * p.img_scale
+        # NOTE: not a pyplot figure so closing all the pyplot figures (e.g. in
+        # render_scene) does not close it
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.fig = Figure(figsize=(img_size, img_size))
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(1, 1, 1)
+        self.ax.set_aspect('equal')
+        self.ax.set_xlim(0., traversible.shape[1] * map_scale)
+        self.ax.set_ylim(0., traversible.shape[0] * map_scale)
+        plot_map(self.ax, extent, traversible, human_traversible=None)
+        self.ppm = get_pixels_per_meter(self.ax)
+        # crop the frames to the figure (with a typical title) like the
+        # tight bbox of render_scene
+        self.ax.set_title("sim_t=000.000 wall_t=000.000", fontsize=20)
+        self.crop = get_tight_crop(self.fig)
+        # the spines and axes are drawn above the agents (in every frame)
+        self.foreground = list(self.ax.spines.values()) + \
+            [self.ax.xaxis, self.ax.yaxis, self.ax.title]
+        for artist in self.foreground:
+            artist.set_animated(True)
+        # rasterize everything that does not change between frames
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def clear_agents(self):
+        # the map is an image, everything else was drawn for the last frame
+        for artist in list(self.ax.lines) + list(self.ax.collections) + \
+                list(self.ax.texts):
+            artist.remove()
+        if self.ax.get_legend() is not None:
+            self.ax.get_legend().remove()
+
+    def plot_frame(self, frame: dict):
+        """Plots the agents and the title of a single frame (from
+        get_topview_frame) and returns the artists that were drawn"""
+        self.clear_agents()
+        pedestrians = frame["pedestrians"]
+        robots = frame["robots"]
+        plot_topview_agents(self.ax, self.ppm, pedestrians, robots,
+                            self.room_center, plot_quiver=True)
+        if(len(robots) > 0 or len(pedestrians) > 0):
+            self.ax.legend()
+        time_string = "sim_t=%.3f" % frame["sim_t"] + \
+            " wall_t=%.3f" % frame["wall_t"]
+        self.ax.title.set_text(time_string)
+        artists = list(self.ax.collections) + list(self.ax.lines) + \
+            list(self.ax.texts)
+        if self.ax.get_legend() is not None:
+            artists.append(self.ax.get_legend())
+        return artists
+
+    def render_image(self, frame: dict):
+        """Plots a single frame (from get_topview_frame) into an rgb image"""
+        artists = self.plot_frame(frame)
+        # only draw the agents atop the cached background (in zorder)
+        self.fig.canvas.restore_region(self.background)
+        for artist in artists:
+            artist.set_animated(True)
+        for artist in sorted(artists + self.foreground,
+                             key=lambda a: a.get_zorder()):
+            self.ax.draw_artist(artist)
+        rows, cols = self.crop
+        return np.array(self.fig.canvas.buffer_rgba())[rows, cols, :3]
+
+    def render(self, frame: dict, filename: str):
+        """Plots a single frame (from get_topview_frame) and saves it, the
+        whole figure is redrawn (and tightly cropped) just like render_scene"""
+        self.plot_frame(frame)
+        # animated artists are skipped when the whole figure is drawn
+        animated = [a for a in self.fig.findobj() if a.get_animated()]
+        for artist in animated:
+            artist.set_animated(False)
+        save_figure(self.p, self.fig, filename)
+        for artist in animated:
+            artist.set_animated(True)
+
+    def close(self):
+        self.fig.clear()
+        self.background = None
+
+
+# the topview figure of each frame rendering worker process
+worker_topview = None
+
+
+def init_topview_worker(p, environment: dict):
+    """Initializer of the frame rendering workers, draws the map only once"""
+    global worker_topview
+    worker_topview = TopviewFigure(p, environment)
+
+
+def render_topview_worker(frame: dict):
+    """Renders the frame into an image (sent back to be encoded)"""
+    return worker_topview.render_image(frame)
+
+
+def render_topview_frames(p, environment: dict, frames, num_frames: int,
+                          consume_fn):
+    """Renders the topview frames (from get_topview_frame, possibly generated
+    lazily) in a bounded pool of processes (one per cpu) that each draw the
+    static map only once, and passes every image in order (with its 1-based
+    index) to consume_fn as soon as it is ready. At most 4 frames per worker
+    are in flight (rendered ahead of consume_fn) to keep the memory flat"""
+    num_workers = max(1, min(multiprocessing.cpu_count(), num_frames))
+    max_pending = 4 * num_workers
+    pending = []
+    frame_idx = 0
+    with multiprocessing.Pool(num_workers, initializer=init_topview_worker,
+                              initargs=(p, environment)) as pool:
+        for frame in frames:
+            pending.append(pool.apply_async(render_topview_worker, (frame,)))
+            if len(pending) == max_pending:
+                # consume the oldest frame while the workers render the rest
+                frame_idx += 1
+                consume_fn(pending.pop(0).get(), frame_idx)
+        for result in pending:
+            frame_idx += 1
+            consume_fn(result.get(), frame_idx)
+
+
+def fit_image(image, shape_2):
+    """Center pads (with white) or crops the image to shape_2 (rows, cols),
+    movie writers need every frame to have the same size"""
+    fitted = np.full(tuple(shape_2) + image.shape[2:], 255, dtype=image.dtype)
+    src = []
+    dst = []
+    for size, target in zip(image.shape[:2], shape_2):
+        offset = abs(size - target) // 2
+        n = min(size, target)
+        if size > target:
+            src.append(slice(offset, offset + n))
+            dst.append(slice(0, n))
+        else:
+            src.append(slice(0, n))
+            dst.append(slice(offset, offset + n))
+    fitted[dst[0], dst[1]] = image[src[0], src[1]]
+    return fitted
+
+
+def open_movie_writer(output_directory: str, movie_filename: str,
+                      duration: float, video_format: str = 'gif'):
+    """Opens a streaming writer that every frame is appended to (with
+    writer.append_data) as soon as it is rendered, the movie is finalized
+    with writer.close(). Videos are written to mp4 with imageio-ffmpeg (if
+    installed), otherwise frames are incrementally appended to a gif.
+    Returns the writer and the location of the movie"""
+    import imageio
+    if video_format == 'mp4':
+        try:
+            import imageio_ffmpeg
+            output_location = os.path.join(output_directory,
+                                           movie_filename + ".mp4")
+            return imageio.get_writer(output_location, format='FFMPEG',
+                                      mode='I', fps=1.0 / duration), \
+                output_location
+        except ImportError:
+            print("%sFailed to find imageio-ffmpeg, writing a gif instead%s" %
+                  (color_orange, color_reset))
+    output_location = os.path.join(output_directory, movie_filename + ".gif")
+    return imageio.get_writer(output_location, format='GIF', mode='I',
+                              duration=duration), output_location
+
+
+def render_rgb_and_depth(r, camera_pos_n3, dx_m: float, human_visible=True):
     """render the rgb and depth images from the openGL renderer
 
     Args:
         r: the openGL renderer object
-        camera_pos_13: the 3D (x, y, theta) position of the camera
+        camera_pos_n3: the 3D (x, y, theta) positions of the camera, all of
+            them are rendered in a single batched call to the renderer
         dx_m (float): the delta_x in meters between real world and grid units
         human_visible (bool, optional): Whether or not the humans are drawn. Defaults to True.
 
     Returns:
-        rgb_image_1mk3, depth_image_1mk1: the rgb and depth images respectively
+        rgb_image_nmk3, depth_image_nmk2: the rgb and depth (disparity) images respectively
     """
 
     # Convert from real world units to grid world units
-    camera_grid_world_pos_12 = camera_pos_13[:, :2] / dx_m
+    camera_grid_world_pos_n2 = camera_pos_n3[:, :2] / dx_m
 
     # Render RGB and Depth Images. The shape of the resulting
-    # image is (1 (batch), m (width), k (height), c (number channels))
-    rgb_image_1mk3 = r._get_rgb_image(
-        camera_grid_world_pos_12, camera_pos_13[:, 2:3], human_visible=True)
-
-    depth_image_1mk1, _, _ = r._get_depth_image(
-        camera_grid_world_pos_12, camera_pos_13[:, 2:3], xy_resolution=.05,
-        map_size=1500, pos_3=camera_pos_13[0, :3], human_visible=True)
+    # image is (n (batch), m (width), k (height), c (number channels))
+    rgb_image_nmk3, depth_image_nmk2 = r.render_rgb_and_disparity(
+        camera_grid_world_pos_n2, camera_pos_n3[:, 2:3],
+        human_visible=human_visible)
 
-    return rgb_image_1mk3, depth_image_1mk1
+    return rgb_image_nmk3, depth_image_nmk2
 
 
 def save_to_gif(IMAGES_DIR, duration=0.05, gif_filename="movie", clear_old_files=True, verbose=False):
     """Takes the image directory and naturally sorts the images into a singular movie.gif"""
+    import imageio
     images = []
     if not os.path.exists(IMAGES_DIR):
         print('\033[31m', "ERROR: Failed to find image directory at",
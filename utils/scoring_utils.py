@@ -1,57 +1,196 @@
 import os
-import pickle as pkl
-from collections import defaultdict
-from simulators.simulator import Simulator
+import time
+import numpy as np
+import pandas as pd
 
+"""
+Columnar store of the episode scores. Every episode writes its row of scalar
+scores to its own rows/<episode_name>.npz (so concurrent episodes never
+overwrite each other and re-running an episode replaces its row), the rows are
+consolidated into columns (one per scalar score, one row per episode) when
+they are read. The per-step scores (arrays) of every episode are stored
+separately in per_step/<episode_name>.npz so aggregating across runs never
+loads them.
+"""
 
-def collate_episode_scores(central_sim: Simulator, params=None):
+scores_filename = 'scores.npz'
+rows_dirname = 'rows'
+per_step_dirname = 'per_step'
+# key of the time a row was written, to keep the episodes in order
+row_time_key = '_row_time_ns'
+
+
+def split_episode_scores(score_dict: dict):
+    """Splits the output of generate_episode_score_report into the scalar
+    scores (one value per episode) and the per-step scores (arrays)"""
+    scalars = {}
+    per_step = {}
+    for key, score in score_dict.items():
+        if np.ndim(score) == 0:
+            scalars[key] = score
+        else:
+            per_step[key] = np.asarray(score)
+    return scalars, per_step
+
+
+def append_episode_scores(results_dir: str, scalars: dict):
+    """Writes one row (episode) of scalar scores, replacing the previous row
+    of the same episode_name"""
+    row = {key: _to_column([score]) for key, score in scalars.items()}
+    row[row_time_key] = np.array([time.time_ns()])
+    _save_npz(os.path.join(results_dir, rows_dirname,
+                           str(scalars["episode_name"]) + '.npz'), row)
+
+
+def save_per_step_scores(results_dir: str, episode_name: str, per_step: dict):
+    """Saves the per-step scores (arrays) of a single episode"""
+    _save_npz(os.path.join(results_dir, per_step_dirname,
+                           episode_name + '.npz'), per_step)
+
+
+def load_per_step_scores(results_dir: str, episode_name: str):
+    """Loads the per-step scores (arrays) of a single episode"""
+    filename = os.path.join(results_dir, per_step_dirname,
+                            episode_name + '.npz')
+    with np.load(filename, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+def load_scores(results_dir: str):
+    """Returns the scalar score columns of a run (empty if there are none),
+    consolidating the rows of all its episodes"""
+    all_columns = []
+    filename = os.path.join(results_dir, scores_filename)
+    if os.path.exists(filename):
+        # (runs stored before the scores were written per episode)
+        all_columns.append(_load_npz(filename))
+    rows_dir = os.path.join(results_dir, rows_dirname)
+    if os.path.isdir(rows_dir):
+        rows = [_load_npz(os.path.join(rows_dir, f))
+                for f in sorted(os.listdir(rows_dir)) if f.endswith('.npz')]
+        # in the order the episodes were written
+        rows.sort(key=lambda row: row[row_time_key][0])
+        for row in rows:
+            del row[row_time_key]
+        all_columns += rows
+    return _drop_replaced_episodes(_concat_columns(all_columns))
+
+
+def load_results(results_dirs: list):
+    """Concatenates the scalar score columns of many runs into a dataframe
+    with one row per episode"""
+    if isinstance(results_dirs, str):
+        results_dirs = [results_dirs]
+    all_columns = [load_scores(results_dir) for results_dir in results_dirs]
+    results = _concat_columns(all_columns)
+    return pd.DataFrame(results)
+
+
+def aggregate_scores(results: pd.DataFrame,
+                     group_by=('algo_name', 'termination_cause'),
+                     percentiles=(25, 50, 75), metrics: list = None):
+    """
+    Vectorized summary (count, mean, std, min, percentiles, max) of every
+    numeric score, per group of episodes (by default per algorithm and
+    termination cause, i.e. a success/failure breakdown)
+    :param results: dataframe returned by load_results
+    :param group_by: column(s) to group the episodes by, None for no groups
+    :param percentiles: percentiles (0-100) to compute for every score
+    :param metrics: names of the scores to summarize (all numeric by default)
+    :return: dataframe with one row per group and (score, stat) columns
+             (one row per score and stat columns if there are no groups)
     """
-    Takes in the outputs of generate_episode_score_report
-    And digests them into overall scores
+    if group_by is None:
+        group_by = []
+    elif isinstance(group_by, str):
+        group_by = [group_by]
+    group_by = [key for key in group_by if key in results.columns]
+    if metrics is None:
+        metrics = [key for key in results.columns if key not in group_by and
+                   results[key].dtype.kind in 'biuf']
+    numeric = results[metrics].astype(np.float64)
+    percentiles = [p / 100.0 for p in percentiles]
+    if len(group_by) == 0:
+        return numeric.describe(percentiles=percentiles).T
+    numeric = numeric.assign(**{key: results[key] for key in group_by})
+    return numeric.groupby(group_by).describe(percentiles=percentiles)
 
-    :return:
+
+def collate_episode_scores(results_dirs: list,
+                           group_by=('algo_name', 'termination_cause'),
+                           percentiles=(25, 50, 75)):
+    """
+    Takes in the outputs of generate_episode_score_report (of any number of
+    runs, i.e. algorithms and seeds) and digests them into overall scores
+    :return: the per-episode scores and their aggregated summary
     """
+    results = load_results(results_dirs)
+    return results, aggregate_scores(results, group_by=group_by,
+                                     percentiles=percentiles)
+
+
+def _concat_columns(all_columns: list):
+    """Concatenates the rows of all the columns (dicts of columns with the
+    same number of rows), filling the columns that some of them miss"""
+    all_columns = [columns for columns in all_columns if len(columns) > 0]
+    keys = []
+    for columns in all_columns:
+        keys += [key for key in columns.keys() if key not in keys]
+    concatenated = {}
+    for key in keys:
+        # find columns that have this key to know its type
+        like = next(columns[key] for columns in all_columns if key in columns)
+        concatenated[key] = np.concatenate(
+            [columns[key] if key in columns
+             else _missing_values(like, _num_rows(columns))
+             for columns in all_columns])
+    return concatenated
+
+
+def _drop_replaced_episodes(columns: dict):
+    """Keeps only the last row of every episode (re-running an episode
+    replaces its row)"""
+    if "episode_name" not in columns:
+        return columns
+    episode_names = columns["episode_name"]
+    # (the first occurrence in the reversed order is the last row)
+    _, reversed_idxs = np.unique(episode_names[::-1], return_index=True)
+    if len(reversed_idxs) == len(episode_names):
+        return columns
+    keep = np.sort(len(episode_names) - 1 - reversed_idxs)
+    return {key: values[keep] for key, values in columns.items()}
+
+
+def _num_rows(columns: dict):
+    if len(columns) == 0:
+        return 0
+    return len(next(iter(columns.values())))
+
+
+def _to_column(values: list):
+    column = np.asarray(values)
+    if column.dtype.kind in 'OSU':
+        column = column.astype(str)
+    return column
+
+
+def _missing_values(like: np.ndarray, n: int):
+    """Placeholders for episodes missing the column like"""
+    if like.dtype.kind == 'U':
+        return np.full(n, '', dtype=like.dtype)
+    # NOTE: this promotes bool and int columns to float (nan is missing)
+    return np.full(n, np.nan)
+
+
+def _load_npz(filename: str):
+    with np.load(filename, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
 
-    p = params
-
-    # read in and collect tuples of (test name, score_dict)
-    scores_list_success = []
-    scores_list_fail = []
-
-    for i, episode_name in enumerate(list(p.episode_params.tests.keys())):
-        episode = p.episode_params.tests[episode_name]
-        score_filename = os.path.join(p.output_directory,
-                                      "episode_score_%s.pkl" % episode_name)
-        with open(score_filename, 'rb') as f:
-            score_dict = pkl.load(f)
-            if score_dict["success"]:
-                scores_list_success.append((episode_name, score_dict))
-            else:
-                scores_list_fail.append((episode_name, score_dict))
-
-    agg_score_dict_succ = defaultdict(list)
-    agg_score_dict_fail = defaultdict(list)
-    # do something for all the successful episodes
-
-    # do something for all scores that are a single value
-    for test_name, score_dict in scores_list_success:
-        # go through the scores for each episode and aggregate
-        for key in score_dict.keys():
-            score = score_dict[key]
-            if isinstance(score, float):
-                agg_score_dict_succ[key] += [score]
-
-    # do something for all the things that are a distribution/collection of values
-    for test_name, score_dict in scores_list_fail:
-        # go through the scores for each episode and aggregate
-        for key in score_dict.keys():
-            score = score_dict[key]
-            if isinstance(score, float):
-                agg_score_dict_fail[key] += [score]
-
-    # do somethings differently for the unsuccessful episodes
-    # at min, count the different failure reasons
-    #
-
-    scores = []
-    return scores
+def _save_npz(filename: str, arrays: dict):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    # write to a temporary file first so the store is never left half written
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_filename, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_filename, filename)
@@ -10,6 +10,7 @@ import random
 import time
 import logging
 from trajectory.trajectory import SystemConfig
+from params.frozen_params import FrozenParams
 from contextlib import contextmanager
 
 color_orange = '\033[33m'
@@ -173,6 +174,7 @@ def construct_environment(p, test, episode, verbose=True):
     environment = {}
     environment["map_scale"] = float(dx_m)
     environment["room_center"] = room_center
+    environment["building_name"] = p.building_params.building_name
     # obstacle traversible / human traversible
     if p.render_3D:
         environment["human_traversible"] = np.array(human_traversible)
@@ -307,7 +309,7 @@ def check_dotmap_equality(d1, d2):
     for i, key in enumerate(d1.keys()):
         d1_attr = getattr(d1, key)
         d2_attr = getattr(d2, key)
-        if type(d1_attr) is DotMap:
+        if type(d1_attr) is DotMap or isinstance(d1_attr, FrozenParams):
             equality[i] = check_dotmap_equality(d1_attr, d2_attr)
     return np.array(equality).all()
 
@@ -1,8 +1,15 @@
+from params.frozen_params import is_frozen
+
+
 class WaypointGridBase(object):
     """An abstract class representing an egocentric waypoint grid
     for a mobile ground robot."""
     def __init__(self, params):
-        self.params = params.grid.parse_params(params)
+        if is_frozen(params):
+            # (already parsed)
+            self.params = params
+        else:
+            self.params = params.grid.parse_params(params)
         self.n = self.compute_number_waypoints(params)
 
     @staticmethod
@@ -0,0 +1,142 @@
+import numpy as np
+from utils.angle_utils import angle_normalize
+from waypoint_grids.uniform_sampling_grid import UniformSamplingGrid
+
+
+class GoalDirectedGrid(UniformSamplingGrid):
+    """A class representing a fixed number of egocentric waypoints which are
+    concentrated around the direction of the goal (typically the direction of
+    the fmm angle map) inside the cone of free space around it (computed from
+    the obstacle distance field, see compute_free_distances).
+    The waypoint pattern (in units of the cone) is sampled once per start
+    velocity bin and then mapped into the cone of every plan."""
+
+    def __init__(self, params):
+        super(GoalDirectedGrid, self).__init__(params)
+        p = self.params.goal_directed_params
+        # the directions of the rays along which the free space is measured
+        self.ray_bearings_m = np.linspace(-np.pi, np.pi, p.num_rays,
+                                          endpoint=False)
+        # the waypoint patterns indexed by start velocity (bin)
+        self.patterns = {}
+
+    def sample_egocentric_waypoints(self, vf=0., v0=0., goal_angle=0.,
+                                    free_distances_m=None):
+        """ Samples the egocentric waypoints around goal_angle (the egocentric
+        direction of the goal) for a robot starting at speed v0.
+        free_distances_m (see compute_free_distances) are the free distances
+        along every ray of ray_bearings_m, all the rays are free if None."""
+        p = self.params.goal_directed_params
+        direction_n, radius_n, heading_n = self._get_pattern(v0)
+        min_distance = self._min_distance(v0)
+        if free_distances_m is None:
+            free_distances_m = np.full(p.num_rays, p.max_distance)
+        lower, upper = self.compute_free_cone(goal_angle, free_distances_m,
+                                              min_distance)
+        goal_angle = np.clip(goal_angle, lower, upper)
+        # the pattern directions are in [-1, 1], either side of the goal
+        bearing_n = goal_angle + np.where(direction_n < 0,
+                                          direction_n * (goal_angle - lower),
+                                          direction_n * (upper - goal_angle))
+        # the radii are squeezed in the free distance along their direction
+        max_radius_n = np.clip(free_distances_m[self._closest_ray_idxs(bearing_n)],
+                               min_distance, p.max_distance)
+        radius_n = min_distance + (radius_n - min_distance) * \
+            (max_radius_n - min_distance) / max(p.max_distance - min_distance, 1e-6)
+
+        wx_n11 = (radius_n * np.cos(bearing_n))[:, None, None].astype(np.float32)
+        wy_n11 = (radius_n * np.sin(bearing_n))[:, None, None].astype(np.float32)
+        wtheta_n11 = angle_normalize(bearing_n + heading_n)[:, None, None].astype(
+            np.float32)
+        vf_n11 = np.ones_like(wx_n11) * vf
+        wf_n11 = np.zeros_like(wx_n11)
+        return wx_n11, wy_n11, wtheta_n11, vf_n11, wf_n11
+
+    def _get_pattern(self, v0):
+        """The (cached) waypoint pattern of the start velocity v0: the
+        directions (in [-1, 1], concentrated around 0), radii and headings
+        (relative to the direction) of the waypoints"""
+        if v0 not in self.patterns:
+            p = self.params.goal_directed_params
+            rng = np.random.RandomState(p.seed)
+            n = self.n
+            direction_n = np.clip(rng.normal(0., p.direction_std, n), -1., 1.)
+            radius_n = rng.uniform(self._min_distance(v0), p.max_distance, n)
+            heading_n = np.clip(rng.normal(0., p.heading_std, n),
+                                -np.pi / 2., np.pi / 2.)
+            self.patterns[v0] = (direction_n, radius_n, heading_n)
+        return self.patterns[v0]
+
+    def _min_distance(self, v0):
+        """Waypoints closer than the turning radius (at speed v0) are
+        not sampled"""
+        p = self.params.goal_directed_params
+        return min(p.min_distance + v0 / p.angular_speed_max, p.max_distance)
+
+    def _closest_ray_idxs(self, bearing_n):
+        ray_spacing = 2. * np.pi / len(self.ray_bearings_m)
+        return np.mod(np.round((angle_normalize(bearing_n) + np.pi) / ray_spacing),
+                      len(self.ray_bearings_m)).astype(int)
+
+    def compute_free_cone(self, goal_angle, free_distances_m, min_distance):
+        """Returns the (lower, upper) egocentric directions bounding the cone
+        of free rays (at least min_distance long, at most max_cone away from
+        goal_angle) around the free ray closest to goal_angle"""
+        p = self.params.goal_directed_params
+        num_rays = len(self.ray_bearings_m)
+        ray_spacing = 2. * np.pi / num_rays
+        free_m = free_distances_m >= min_distance
+        if not free_m.any():
+            return goal_angle - p.max_cone, goal_angle + p.max_cone
+        # the free ray closest to the goal direction
+        goal_idx = self._closest_ray_idxs(np.array([goal_angle]))[0]
+        offsets = np.arange(num_rays // 2 + 1)
+        candidates = np.stack([goal_idx - offsets, goal_idx + offsets], axis=1).ravel()
+        center_idx = candidates[free_m[np.mod(candidates, num_rays)]][0]
+        # grow the cone on both sides while the rays are free
+        max_steps = int(p.max_cone / ray_spacing)
+        lower_steps = upper_steps = 0
+        while lower_steps < max_steps and free_m[(center_idx - lower_steps - 1) % num_rays]:
+            lower_steps += 1
+        while upper_steps < max_steps and free_m[(center_idx + upper_steps + 1) % num_rays]:
+            upper_steps += 1
+        # (in the frame where the center ray is unwrapped next to the goal)
+        center = goal_angle + angle_normalize(
+            self.ray_bearings_m[center_idx % num_rays] - goal_angle)
+        return center - lower_steps * ray_spacing, center + upper_steps * ray_spacing
+
+    def compute_free_distances(self, obstacle_map, start_config):
+        """The free distance from start_config (in the world frame) along
+        every ray of ray_bearings_m, i.e. up to the first point closer than
+        obstacle_margin to an obstacle (max_distance if there is none)"""
+        p = self.params.goal_directed_params
+        start_pos_3 = start_config.position_and_heading_nk3()[0, 0]
+        distances_s = np.arange(1, int(np.ceil(p.max_distance / p.ray_step)) + 1) * \
+            p.ray_step
+        angles_m = start_pos_3[2] + self.ray_bearings_m
+        pos_ms2 = start_pos_3[None, None, :2] + \
+            distances_s[None, :, None] * \
+            np.stack([np.cos(angles_m), np.sin(angles_m)], axis=1)[:, None, :]
+        blocked_ms = obstacle_map.dist_to_nearest_obs(pos_ms2) < p.obstacle_margin
+        first_blocked_m = np.argmax(blocked_ms, axis=1)
+        free_distances_m = np.where(blocked_ms.any(axis=1),
+                                    distances_s[first_blocked_m] - p.ray_step,
+                                    p.max_distance)
+        return np.minimum(free_distances_m, p.max_distance)
+
+    @property
+    def descriptor_string(self):
+        """Returns a unique string identifying
+        this waypoint grid."""
+        p = self.params
+        name = 'goal_directed_grid_'
+        name += 'n_{:d}'.format(p.n)
+        name += '_direction_std_{:.2f}'.format(p.goal_directed_params.direction_std)
+        name += '_max_distance_{:.2f}'.format(p.goal_directed_params.max_distance)
+        return name
+
+    @staticmethod
+    def compute_number_waypoints(params):
+        """Returns the number of waypoints in this grid
+        (a fixed budget)."""
+        return params.goal_directed_params.num_waypoints
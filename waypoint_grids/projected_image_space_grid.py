@@ -7,13 +7,21 @@ class ProjectedImageSpaceGrid(UniformSamplingGrid):
     coordinates using the camera parameters."""
 
     def __init__(self, params):
-        # Compute the image size bounds based on the focal length and the field of view
-        params = self.compute_image_bounds(params)
+        # (the image size bounds are computed when parsing the params)
         super(ProjectedImageSpaceGrid, self).__init__(params)
 
         # Compute the rotation and translation vectors from the world frame to the optical frame and vice-versa
         self.compute_rotation_and_translation_transformations()
 
+    @staticmethod
+    def parse_params(p):
+        """
+        Compute the image size bounds based on the focal length and the field
+        of view before the number of waypoints (which depends on the bounds).
+        """
+        p = ProjectedImageSpaceGrid.compute_image_bounds(p)
+        return UniformSamplingGrid.parse_params(p)
+
     @staticmethod
     def compute_image_bounds(params):
         """